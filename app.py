@@ -1,14 +1,31 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
+from flask import Flask, render_template, request, jsonify, Response
 import os
 import tempfile
 import uuid
 import threading
 import time
-import subprocess
 import shutil
-import random
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from urllib.parse import quote
+from video_cache import video_cache, extract_video_id
+from youtube_client import get_youtube_object, refresh_youtube_object, resolve_stream, expand_playlist, get_strategy_stats, get_stream_table, get_video_streams, get_basic_info
+from stream_table import LISTED_RESOLUTIONS, select, first, best_audio, size_label, stream_for
+from download_queue import download_queue, stream_slots, QueueFullError
+from stream_download import download_video_audio, fetch_stream, remove_files
+from progress import JobProgress
+from ffmpeg_tools import mux_files, stream_mux, check_ffmpeg, check_ffmpeg_streaming, get_ffmpeg_capabilities
+from job_store import create_job_store
+from job_registry import job_registry, COMPLETED_REUSE_TTL
+from file_serving import serve_download
+from download_cache import DownloadCache
+from rate_limiter import stream_limiter, rate_limit_stats
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, VIDEO_INFO_SECONDS, FALLBACK_STEPS, render_metrics
+from tracing import span, start_span, record_span, current_span, in_current_trace
+from retry_policy import POLICIES, FORBIDDEN, NOT_FOUND, CIRCUIT_OPEN, CircuitOpenError, classify_error, upstream_breaker
+from speculative import speculator, SpeculationCancelled
+from batch_jobs import BATCH_MAX_ITEMS, BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, run_batch, iter_batch_files, stream_zip
 
 app = Flask(__name__)
 
@@ -16,95 +33,30 @@ app = Flask(__name__)
 DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), 'downloads')
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# Status dos downloads
-download_status = {}
-
-def create_youtube_object(url):
-    """Cria objeto YouTube com configurações anti-bot e múltiplas estratégias"""
-    
-    # Lista de user agents para rotação
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15'
-    ]
-    
-    # Estratégias de tentativa (corrigidas)
-    strategies = [
-        # Estratégia 1: Cliente ANDROID (mais confiável)
-        lambda: YouTube(url, client='ANDROID'),
-        
-        # Estratégia 2: Cliente IOS
-        lambda: YouTube(url, client='IOS'),
-        
-        # Estratégia 3: Cliente WEB padrão
-        lambda: YouTube(url, client='WEB'),
-        
-        # Estratégia 4: Cliente TV_EMBED
-        lambda: YouTube(url, client='TV_EMBED'),
-        
-        # Estratégia 5: Cliente WEB_EMBED
-        lambda: YouTube(url, client='WEB_EMBED'),
-        
-        # Estratégia 6: Com use_po_token
-        lambda: YouTube(url, use_po_token=True),
-        
-        # Estratégia 7: Configuração básica
-        lambda: YouTube(url),
-        
-        # Estratégia 8: Cliente ANDROID com bypass
-        lambda: YouTube(url, client='ANDROID_EMBEDDED'),
-    ]
-    
-    # Tenta cada estratégia
-    for i, strategy in enumerate(strategies):
-        try:
-            print(f"Tentando estratégia {i+1}/8...")
-            
-            # Adiciona delay para evitar rate limiting
-            if i > 0:
-                time.sleep(random.uniform(1.0, 3.0))
-            
-            yt = strategy()
-            
-            # Testa se consegue acessar propriedades básicas
-            _ = yt.title  # Força o carregamento dos dados
-            _ = yt.length
-            
-            # Testa se consegue obter streams (importante para evitar 403 no download)
-            streams = yt.streams.filter(progressive=True).first()
-            if not streams:
-                streams = yt.streams.first()
-            
-            if not streams:
-                raise Exception("Nenhum stream disponível")
-            
-            print(f"✓ Sucesso com estratégia {i+1}")
-            return yt
-            
-        except Exception as e:
-            error_msg = str(e)
-            print(f"✗ Estratégia {i+1} falhou: {error_msg[:100]}")
-            
-            # Se é erro 403, tenta estratégias adicionais
-            if "403" in error_msg or "Forbidden" in error_msg:
-                print("  → Detectado erro 403, aplicando delay adicional...")
-                time.sleep(random.uniform(2.0, 5.0))
-            
-            continue
-    
-    # Se todas as estratégias falharam
-    raise Exception("Todas as estratégias falharam. YouTube pode estar bloqueando o acesso. Tente:\n1. Aguardar alguns minutos\n2. Usar uma VPN\n3. Tentar outro vídeo")
+# Status dos downloads (memória ou SQLite compartilhado entre workers, ver JOB_STORE)
+download_status = create_job_store()
 
-def check_ffmpeg():
-    """Verifica se FFmpeg está disponível"""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+# Arquivos prontos em DOWNLOAD_DIR: LRU limitado em bytes (DOWNLOAD_CACHE_MAX_BYTES)
+download_cache = DownloadCache(DOWNLOAD_DIR)
+download_cache.scan()
+
+# Modo rápido do /get_video_info: resoluções completas em segundo plano, uma por vídeo
+INFO_LOOKUP_THREADS = int(os.environ.get('INFO_LOOKUP_THREADS', 8))
+info_lookup_executor = ThreadPoolExecutor(max_workers=INFO_LOOKUP_THREADS, thread_name_prefix='video-info')
+pending_info_lookups = {}
+pending_info_lock = threading.Lock()
+# Espera máxima pela resolução em andamento (depois disso responde com o cartão básico)
+INFO_LOOKUP_TIMEOUT = float(os.environ.get('INFO_LOOKUP_TIMEOUT', 30))
+# Falhas recentes por vídeo: repetidas por INFO_ERROR_TTL segundos sem nova resolução
+INFO_ERROR_TTL = float(os.environ.get('INFO_ERROR_TTL', 30))
+failed_info_lookups = {}
+
+# Guarda também em disco a saída do modo streaming (para servir de novo depois)
+STREAM_CACHE_TO_DISK = os.environ.get('STREAM_CACHE_TO_DISK', '0') == '1'
+
+# Verificação única do FFmpeg na inicialização (refeita sob demanda em /health?reprobe=1)
+_ffmpeg = get_ffmpeg_capabilities()
+print(f"FFmpeg: {_ffmpeg['path'] or 'não encontrado'} {_ffmpeg['version'] or ''} (mux: {_ffmpeg['can_mux']}, streaming: {_ffmpeg['can_stream']})")
 
 def format_duration(seconds):
     """Formata duração em segundos para HH:MM:SS"""
@@ -127,172 +79,437 @@ def format_number(num):
 def index():
     return render_template('index.html')
 
+def cached_video_info(video_id):
+    """Resposta completa do /get_video_info já resolvida recentemente (ou None)"""
+    cached = video_cache.get(video_id)
+    if cached and 'streams' in cached:
+        print(f"✓ Informações de {video_id} servidas do cache")
+        return {
+            'video_info': cached['video_info'],
+            'streams': cached['streams'],
+            'ffmpeg_available': cached['ffmpeg_available']
+        }
+    return None
+
+def describe_video(yt, video_id):
+    """Monta a resposta do /get_video_info a partir do objeto YouTube; retorna (dados, status HTTP)"""
+    # Obtém informações básicas com tratamento de erro individual
+    try:
+        title = yt.title
+        print(f"✓ Título obtido: {title[:50]}...")
+    except Exception as e:
+        print(f"✗ Erro ao obter título: {e}")
+        title = "Título não disponível"
+    
+    try:
+        author = yt.author
+        print(f"✓ Autor obtido: {author}")
+    except Exception as e:
+        print(f"✗ Erro ao obter autor: {e}")
+        author = "Autor não disponível"
+    
+    try:
+        length = yt.length
+        print(f"✓ Duração obtida: {length}s")
+    except Exception as e:
+        print(f"✗ Erro ao obter duração: {e}")
+        length = 0
+    
+    try:
+        thumbnail = yt.thumbnail_url
+        print("✓ Thumbnail obtida")
+    except Exception as e:
+        print(f"✗ Erro ao obter thumbnail: {e}")
+        thumbnail = ""
+    
+    try:
+        views = yt.views or 0
+        print(f"✓ Views obtidas: {views}")
+    except Exception as e:
+        print(f"✗ Erro ao obter views: {e}")
+        views = 0
+    
+    try:
+        description = yt.description or ""
+        print("✓ Descrição obtida")
+    except Exception as e:
+        print(f"✗ Erro ao obter descrição: {e}")
+        description = ""
+    
+    # Obtém informações básicas
+    video_info = {
+        'title': title,
+        'author': author,
+        'length': length,
+        'thumbnail': thumbnail,
+        'views': views,
+        'description': description[:200] + '...' if len(description) > 200 else description
+    }
+    
+    print("✓ Informações básicas coletadas")
+    
+    # Verifica se FFmpeg está disponível
+    ffmpeg_available = check_ffmpeg()
+    print(f"FFmpeg disponível: {ffmpeg_available}")
+    
+    # Obtém streams disponíveis (uma passada pelo manifesto, ver stream_table.py)
+    streams = []
+    
+    try:
+        table = get_stream_table(yt)
+        if ffmpeg_available:
+            # Com FFmpeg: streams adaptivos (HD)
+            for row in select(table, 'video'):
+                if row['resolution'] in LISTED_RESOLUTIONS:
+                    streams.append({
+                        'itag': row['itag'],
+                        'resolution': row['resolution'],
+                        'type': 'adaptive',
+                        'size': size_label(row),
+                        'quality': f"{row['resolution']} HD (Vídeo + Áudio)"
+                    })
+            print(f"✓ {len(streams)} streams adaptivos encontrados")
+    
+        # Streams progressivos (funcionam sem FFmpeg)
+        for row in select(table, 'progressive'):
+            streams.append({
+                'itag': row['itag'],
+                'resolution': row['resolution'],
+                'type': 'progressive',
+                'size': size_label(row),
+                'quality': f"{row['resolution']} (Vídeo + Áudio)"
+            })
+        print(f"✓ {len([s for s in streams if s['type'] == 'progressive'])} streams progressivos encontrados")
+    
+        # Stream de áudio apenas
+        audio_row = best_audio(table)
+        if audio_row:
+            streams.append({
+                'itag': audio_row['itag'],
+                'resolution': 'audio',
+                'type': 'audio',
+                'size': size_label(audio_row),
+                'quality': f"Apenas Áudio ({audio_row['abr']})"
+            })
+            print("✓ Stream de áudio encontrado")
+    
+    except Exception as e:
+        print(f"✗ Erro ao obter streams: {e}")
+        # Fallback: pelo menos tenta obter um stream básico
+        try:
+            basic_stream = yt.streams.first()
+            if basic_stream:
+                streams.append({
+                    'resolution': '360p',
+                    'type': 'basic',
+                    'size': 'N/A',
+                    'quality': 'Qualidade Básica'
+                })
+        except:
+            pass
+    
+    if not streams:
+        return {'error': 'Nenhum stream disponível para este vídeo'}, 400
+    
+    print(f"✓ Total de {len(streams)} streams disponíveis")
+    
+    # Guarda metadados e tabela de streams para o download reutilizar
+    video_cache.update(
+        video_id,
+        author=author,
+        video_info=video_info,
+        streams=streams,
+        ffmpeg_available=ffmpeg_available
+    )
+    
+    return {
+        'video_info': video_info,
+        'streams': streams,
+        'ffmpeg_available': ffmpeg_available
+    }, 200
+
+def friendly_info_error(error_message):
+    """Traduz erros do pytubefix em mensagens para o usuário"""
+    # Mensagens de erro mais informativas
+    if "EOF when reading a line" in error_message:
+        error_message = "Erro de conexão com YouTube. Tente novamente em alguns minutos."
+    elif "Video unavailable" in error_message:
+        error_message = "Vídeo não disponível ou privado."
+    elif "regex_search" in error_message:
+        error_message = "Erro ao processar dados do YouTube. Pode ser um problema temporário."
+    elif "HTTP Error 429" in error_message:
+        error_message = "Muitas requisições. Aguarde alguns minutos antes de tentar novamente."
+    elif "all strategies failed" in error_message.lower():
+        error_message = "YouTube está bloqueando o acesso. Tente novamente em alguns minutos ou use uma VPN."
+    return error_message
+
+def stream_busy_response(error):
+    """Resposta 429 com Retry-After quando todas as vagas de streaming HD estão ocupadas"""
+    return jsonify({
+        'error': 'Servidor ocupado: muitos envios em tempo real. Tente novamente em instantes.',
+        'retry_after': error.retry_after
+    }), 429, {'Retry-After': str(error.retry_after)}
+
+def circuit_open_response(error):
+    """Resposta 503 com Retry-After enquanto o disjuntor de 403 está aberto"""
+    return jsonify({
+        'error': 'YouTube está bloqueando muitos acessos agora. Tente novamente em alguns minutos.',
+        'retry_after': error.retry_after
+    }), 503, {'Retry-After': str(error.retry_after)}
+
 @app.route('/get_video_info', methods=['POST'])
 def get_video_info():
-    """Obtém informações do vídeo"""
+    """Obtém informações do vídeo
+
+    Com "fast": true, responde só com o cartão básico (streams_pending) enquanto
+    os streams são resolvidos em segundo plano; a lista vem de /get_video_streams.
+    """
+    return video_info_response(allow_fast=True)
+
+@app.route('/get_video_streams', methods=['POST'])
+def get_video_streams_info():
+    """Segunda fase do modo rápido: resposta completa, aproveitando a resolução já iniciada"""
+    return video_info_response(allow_fast=False)
+
+def resolve_video_info(url, video_id):
+    """Resolução completa (objeto YouTube + tabela de streams); retorna (dados, status HTTP)
+
+    Falhas (exceção ou status de erro) ficam em failed_info_lookups por INFO_ERROR_TTL.
+    """
     try:
-        data = request.get_json()
-        url = data.get('url', '').strip()
-        
-        if not url:
-            return jsonify({'error': 'URL é obrigatória'}), 400
-        
-        # Validação básica da URL
-        if 'youtube.com' not in url and 'youtu.be' not in url:
-            return jsonify({'error': 'URL deve ser do YouTube'}), 400
-        
-        print(f"Processando URL: {url}")
-        
-        # Cria objeto YouTube com anti-bot e múltiplas estratégias
-        yt = create_youtube_object(url)
+        # Cria objeto YouTube com anti-bot e múltiplas estratégias (ou reutiliza do cache)
+        yt = get_youtube_object(url)
         
         print("✓ Objeto YouTube criado com sucesso")
         
-        # Obtém informações básicas com tratamento de erro individual
-        try:
-            title = yt.title
-            print(f"✓ Título obtido: {title[:50]}...")
-        except Exception as e:
-            print(f"✗ Erro ao obter título: {e}")
-            title = "Título não disponível"
-        
-        try:
-            author = yt.author
-            print(f"✓ Autor obtido: {author}")
-        except Exception as e:
-            print(f"✗ Erro ao obter autor: {e}")
-            author = "Autor não disponível"
-        
-        try:
-            length = yt.length
-            print(f"✓ Duração obtida: {length}s")
-        except Exception as e:
-            print(f"✗ Erro ao obter duração: {e}")
-            length = 0
-        
-        try:
-            thumbnail = yt.thumbnail_url
-            print("✓ Thumbnail obtida")
-        except Exception as e:
-            print(f"✗ Erro ao obter thumbnail: {e}")
-            thumbnail = ""
-        
-        try:
-            views = yt.views or 0
-            print(f"✓ Views obtidas: {views}")
-        except Exception as e:
-            print(f"✗ Erro ao obter views: {e}")
-            views = 0
-        
-        try:
-            description = yt.description or ""
-            print("✓ Descrição obtida")
-        except Exception as e:
-            print(f"✗ Erro ao obter descrição: {e}")
-            description = ""
-        
-        # Obtém informações básicas
-        video_info = {
-            'title': title,
-            'author': author,
-            'length': length,
-            'thumbnail': thumbnail,
-            'views': views,
-            'description': description[:200] + '...' if len(description) > 200 else description
-        }
-        
-        print("✓ Informações básicas coletadas")
-        
-        # Verifica se FFmpeg está disponível
-        ffmpeg_available = check_ffmpeg()
-        print(f"FFmpeg disponível: {ffmpeg_available}")
-        
-        # Obtém streams disponíveis
-        streams = []
-        
+        with span('describe_video'):
+            payload, status_code = describe_video(yt, video_id)
+    except Exception as e:
+        remember_failed_info(video_id, e)
+        raise
+    if status_code != 200:
+        remember_failed_info(video_id, (payload, status_code))
+    return payload, status_code
+
+def remember_failed_info(video_id, outcome):
+    if not video_id:
+        return
+    now = time.monotonic()
+    with pending_info_lock:
+        for key, (expires_at, _) in list(failed_info_lookups.items()):
+            if expires_at <= now:
+                del failed_info_lookups[key]
+        failed_info_lookups[video_id] = (now + INFO_ERROR_TTL, outcome)
+
+def recent_info_failure(video_id):
+    """Falha recente da resolução do vídeo: a exceção ou (dados, status); None se não houver"""
+    with pending_info_lock:
+        item = failed_info_lookups.get(video_id)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del failed_info_lookups[video_id]
+            return None
+        return item[1]
+
+def basic_info_response(basic):
+    """Cartão básico (oEmbed) com as qualidades ainda pendentes"""
+    return {
+        'video_info': basic,
+        'streams': [],
+        'streams_pending': True,
+        'ffmpeg_available': check_ffmpeg()
+    }
+
+def start_info_lookup(url, video_id):
+    """Dispara resolve_video_info em segundo plano (ou retorna a que já está em andamento)"""
+    with pending_info_lock:
+        future = pending_info_lookups.get(video_id)
+        if future is None:
+            future = info_lookup_executor.submit(in_current_trace(resolve_video_info), url, video_id)
+            pending_info_lookups[video_id] = future
+            future.add_done_callback(lambda _: pending_info_lookups.pop(video_id, None))
+    return future
+
+def video_info_response(allow_fast):
+    started = time.monotonic()
+    with span('get_video_info') as trace:
         try:
-            if ffmpeg_available:
-                # Com FFmpeg: streams adaptivos (HD)
-                print("Buscando streams adaptivos...")
-                video_streams = yt.streams.filter(adaptive=True, file_extension='mp4', only_video=True).order_by('resolution').desc()
-                for stream in video_streams:
-                    if stream.resolution in ['1080p', '720p', '480p', '360p']:
-                        streams.append({
-                            'resolution': stream.resolution,
-                            'type': 'adaptive',
-                            'size': f"{stream.filesize / (1024*1024):.1f} MB" if stream.filesize else 'N/A',
-                            'quality': f"{stream.resolution} HD (Vídeo + Áudio)"
-                        })
-                print(f"✓ {len([s for s in streams if s['type'] == 'adaptive'])} streams adaptivos encontrados")
+            data = request.get_json()
+            url = data.get('url', '').strip()
             
-            # Streams progressivos (funcionam sem FFmpeg)
-            print("Buscando streams progressivos...")
-            progressive_streams = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc()
-            for stream in progressive_streams:
-                if stream.resolution:  # Só adiciona se tem resolução válida
-                    streams.append({
-                        'resolution': stream.resolution,
-                        'type': 'progressive',
-                        'size': f"{stream.filesize / (1024*1024):.1f} MB" if stream.filesize else 'N/A',
-                        'quality': f"{stream.resolution} (Vídeo + Áudio)"
-                    })
-            print(f"✓ {len([s for s in streams if s['type'] == 'progressive'])} streams progressivos encontrados")
+            if not url:
+                return jsonify({'error': 'URL é obrigatória'}), 400
             
-            # Stream de áudio apenas
-            print("Buscando stream de áudio...")
-            audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-            if audio_stream:
-                streams.append({
-                    'resolution': 'audio',
-                    'type': 'audio',
-                    'size': f"{audio_stream.filesize / (1024*1024):.1f} MB" if audio_stream.filesize else 'N/A',
-                    'quality': f"Apenas Áudio ({audio_stream.abr})"
-                })
-                print("✓ Stream de áudio encontrado")
+            # Validação básica da URL
+            if 'youtube.com' not in url and 'youtu.be' not in url:
+                return jsonify({'error': 'URL deve ser do YouTube'}), 400
+            
+            print(f"Processando URL: {url}")
+            
+            # Resposta completa já resolvida recentemente para o mesmo vídeo
+            video_id = extract_video_id(url)
+            fast = allow_fast and bool(data.get('fast'))
+            trace.set(video_id=video_id, fast=fast)
+            cached = cached_video_info(video_id)
+            if cached:
+                speculate_download(url, video_id, cached)
+                observe_video_info(trace, started, 'cached')
+                return jsonify(cached)
+            
+            # Falhou há pouco: repete a resposta em vez de resolver tudo de novo
+            failure = recent_info_failure(video_id)
+            if isinstance(failure, Exception):
+                raise failure
+            if failure is not None:
+                observe_video_info(trace, started, 'error')
+                return jsonify(failure[0]), failure[1]
             
+            # Modo rápido: se vai precisar das estratégias, o cartão básico sai antes
+            if fast and video_id and video_cache.get(video_id) is None:
+                start_info_lookup(url, video_id)
+                basic = get_basic_info(url)
+                if basic:
+                    observe_video_info(trace, started, 'basic')
+                    return jsonify(basic_info_response(basic))
+            
+            # Resolução já em andamento para o vídeo (modo rápido): espera por ela, com limite
+            pending = pending_info_lookups.get(video_id)
+            if pending is not None:
+                try:
+                    payload, status_code = pending.result(timeout=INFO_LOOKUP_TIMEOUT)
+                except FutureTimeoutError:
+                    # Continua em segundo plano; o cliente pede as qualidades de novo
+                    basic = get_basic_info(url)
+                    observe_video_info(trace, started, 'timeout')
+                    if basic:
+                        return jsonify(basic_info_response(basic))
+                    return jsonify({'error': 'YouTube demorando para responder. Tente novamente em instantes.'}), 504
+            else:
+                payload, status_code = resolve_video_info(url, video_id)
+            if status_code == 200:
+                speculate_download(url, video_id, payload)
+            observe_video_info(trace, started, 'ok' if status_code == 200 else 'error')
+            return jsonify(payload), status_code
+            
+        except CircuitOpenError as e:
+            # Erro rápido: o cliente sabe quando vale tentar de novo
+            print(f"⚡ {e}")
+            observe_video_info(trace, started, 'circuit_open')
+            return circuit_open_response(e)
         except Exception as e:
-            print(f"✗ Erro ao obter streams: {e}")
-            # Fallback: pelo menos tenta obter um stream básico
-            try:
-                basic_stream = yt.streams.first()
-                if basic_stream:
-                    streams.append({
-                        'resolution': '360p',
-                        'type': 'basic',
-                        'size': 'N/A',
-                        'quality': 'Qualidade Básica'
-                    })
-            except:
-                pass
-        
-        if not streams:
-            return jsonify({'error': 'Nenhum stream disponível para este vídeo'}), 400
-        
-        print(f"✓ Total de {len(streams)} streams disponíveis")
-        
-        return jsonify({
-            'video_info': video_info,
-            'streams': streams,
-            'ffmpeg_available': ffmpeg_available
-        })
-        
-    except Exception as e:
-        error_message = str(e)
-        print(f"✗ Erro geral: {error_message}")
-        
-        # Mensagens de erro mais informativas
-        if "EOF when reading a line" in error_message:
-            error_message = "Erro de conexão com YouTube. Tente novamente em alguns minutos."
-        elif "Video unavailable" in error_message:
-            error_message = "Vídeo não disponível ou privado."
-        elif "regex_search" in error_message:
-            error_message = "Erro ao processar dados do YouTube. Pode ser um problema temporário."
-        elif "HTTP Error 429" in error_message:
-            error_message = "Muitas requisições. Aguarde alguns minutos antes de tentar novamente."
-        elif "all strategies failed" in error_message.lower():
-            error_message = "YouTube está bloqueando o acesso. Tente novamente em alguns minutos ou use uma VPN."
-        
-        return jsonify({'error': f'Erro ao obter informações do vídeo: {error_message}'}), 400
+            error_message = str(e)
+            print(f"✗ Erro geral: {error_message}")
+            observe_video_info(trace, started, 'error', error_message)
+            error_message = friendly_info_error(error_message)
+            return jsonify({'error': f'Erro ao obter informações do vídeo: {error_message}'}), 400
+
+def observe_video_info(trace, started, outcome, error=None):
+    """Fecha a medição do /get_video_info: histograma e atributos do span"""
+    VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome=outcome)
+    trace.set(outcome=outcome)
+    if error:
+        trace.fail(error)
+
+def job_key(url, resolution):
+    """Chave de deduplicação do job: (vídeo, resolução, tipo)"""
+    video_id = extract_video_id(url) or url
+    if resolution == 'audio':
+        kind = 'audio'
+    elif resolution in ['1080p', '720p'] and check_ffmpeg():
+        kind = 'adaptive'
+    else:
+        kind = 'progressive'
+    return (video_id, resolution, kind)
+
+def is_job_reusable(download_id):
+    """Job em andamento ou concluído com arquivo ainda válido"""
+    status = download_status.get(download_id)
+    status = status.copy() if status else None
+    if not status or status['status'] == 'error':
+        return False
+    if status['status'] == 'completed':
+        return (time.time() - status.get('completed_at', 0) < COMPLETED_REUSE_TTL
+                and os.path.exists(status.get('filepath', '')))
+    return True
+
+def speculate_download(url, video_id, payload):
+    """Download especulativo da escolha mais provável (SPECULATIVE_PREFETCH, ver speculative.py)
+
+    O job entra no job_registry como qualquer outro: o /start_download da mesma
+    qualidade o reaproveita.
+    """
+    entry = video_cache.get(video_id) or {}
+    resolution = speculator.predict(video_id, payload.get('streams', []), entry.get('stream_table', []))
+    if not resolution:
+        return None
+    
+    download_id = str(uuid.uuid4())
+    download_status[download_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'filename': '',
+        'error': None,
+        'queued_at': time.time(),
+        'speculative': True
+    }
+    # Já existe job (do usuário ou especulativo) para essa escolha: nada a fazer
+    job_id, created = job_registry.claim(job_key(url, resolution), download_id, is_job_reusable)
+    if not created:
+        download_status.pop(download_id, None)
+        return None
+    
+    if not speculator.start(video_id, download_id, resolution, download_video_thread,
+                            (download_id, url, resolution), on_cancel=cancel_speculative_download):
+        job_registry.release(download_id)
+        download_status.pop(download_id, None)
+        return None
+    return download_id
+
+def cancel_speculative_download(download_id, message):
+    """Job especulativo cancelado antes de começar: libera a chave para um pedido real"""
+    job_registry.release(download_id)
+    download_status[download_id].update({'status': 'error', 'error': message})
+    print(f"🔮 {message}")
+
+def enqueue_download(url, resolution):
+    """Cria (ou reaproveita) o job de download e o coloca na fila
+
+    Retorna o dict da resposta do /start_download; levanta QueueFullError
+    se a fila estiver cheia.
+    """
+    # Gera ID único para o download
+    download_id = str(uuid.uuid4())
+    
+    # Inicializa status (alterações são notificadas aos ouvintes SSE)
+    download_status[download_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'filename': '',
+        'error': None,
+        'queued_at': time.time()
+    }
+    
+    # Mesmo vídeo/resolução em andamento ou concluído: reaproveita o job existente
+    job_id, created = job_registry.claim(job_key(url, resolution), download_id, is_job_reusable)
+    if not created:
+        download_status.pop(download_id, None)
+        existing = download_status[job_id].copy()
+        if existing['status'] == 'completed':
+            download_cache.touch(existing['filepath'])
+        print(f"♻️ Reaproveitando job {job_id} ({existing['status']})")
+        return {'download_id': job_id, 'status': existing['status'], 'reused': True}
+    
+    # Enfileira no pool de workers (com limite de fila)
+    try:
+        position = download_queue.submit(download_id, download_video_thread, download_id, url, resolution)
+    except QueueFullError:
+        job_registry.release(download_id)
+        download_status.pop(download_id, None)
+        raise
+    
+    download_status[download_id]['queue_position'] = position
+    return {'download_id': download_id, 'status': 'queued', 'queue_position': position}
 
 @app.route('/start_download', methods=['POST'])
 def start_download():
@@ -305,83 +522,160 @@ def start_download():
         if not url or not resolution:
             return jsonify({'error': 'URL e resolução são obrigatórias'}), 400
         
-        # Gera ID único para o download
-        download_id = str(uuid.uuid4())
-        
-        # Inicializa status
-        download_status[download_id] = {
-            'status': 'starting',
-            'progress': 0,
-            'filename': '',
-            'error': None
-        }
-        
-        # Inicia download em thread separada
-        thread = threading.Thread(
-            target=download_video_thread,
-            args=(download_id, url, resolution)
-        )
-        thread.daemon = True
-        thread.start()
+        # Escolha do usuário (itens de lote não contam): resolve o download
+        # especulativo do vídeo, reaproveitado ou cancelado, antes de reivindicar a chave
+        speculator.on_choice(extract_video_id(url), resolution)
         
-        return jsonify({'download_id': download_id})
+        try:
+            return jsonify(enqueue_download(url, resolution))
+        except QueueFullError as e:
+            return jsonify({
+                'error': 'Servidor ocupado: muitos downloads na fila. Tente novamente em instantes.',
+                'retry_after': e.retry_after
+            }), 429, {'Retry-After': str(e.retry_after)}
         
     except Exception as e:
         return jsonify({'error': f'Erro ao iniciar download: {str(e)}'}), 400
 
+@app.route('/start_batch', methods=['POST'])
+def start_batch():
+    """Inicia um lote: playlist (`playlist_url`) ou lista de URLs (`urls`)"""
+    data = request.get_json() or {}
+    playlist_url = (data.get('playlist_url') or '').strip()
+    urls = [u.strip() for u in data.get('urls') or [] if isinstance(u, str) and u.strip()]
+    resolution = (data.get('resolution') or '').strip()
+    
+    if not resolution or not (playlist_url or urls):
+        return jsonify({'error': 'Informe a resolução e uma playlist ou lista de URLs'}), 400
+    if len(urls) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Máximo de {BATCH_MAX_ITEMS} vídeos por lote'}), 400
+    
+    try:
+        concurrency = int(data.get('concurrency') or BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Concorrência inválida'}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    
+    batch_id = str(uuid.uuid4())
+    download_status[batch_id] = {
+        'type': 'batch',
+        'status': 'queued',
+        'progress': 0,
+        'resolution': resolution,
+        'concurrency': concurrency,
+        'items': [],
+        'total': len(urls),
+        'error': None
+    }
+    
+    # O coordenador só espera e enfileira: roda fora do pool para não ocupar um worker
+    thread = threading.Thread(
+        target=run_batch,
+        args=(batch_id, download_status, enqueue_download, resolution, concurrency),
+        kwargs={'urls': urls, 'playlist_url': playlist_url, 'expand_playlist': expand_playlist},
+        name=f"batch-{batch_id[:8]}"
+    )
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({'batch_id': batch_id, 'status': 'queued', 'total': len(urls), 'concurrency': concurrency})
+
+@app.route('/batch_status/<batch_id>')
+def batch_status(batch_id):
+    """Progresso agregado do lote e de cada item"""
+    batch = download_status.get(batch_id)
+    batch = batch.copy() if batch is not None else None
+    if batch is None or batch.get('type') != 'batch':
+        return jsonify({'error': 'Lote não encontrado'}), 404
+    
+    return jsonify(batch)
+
+@app.route('/batch_zip/<batch_id>')
+def batch_zip(batch_id):
+    """ZIP com os vídeos do lote, montado e enviado conforme os itens terminam"""
+    batch = download_status.get(batch_id)
+    batch = batch.copy() if batch is not None else None
+    if batch is None or batch.get('type') != 'batch':
+        return jsonify({'error': 'Lote não encontrado'}), 404
+    if batch['status'] == 'error':
+        return jsonify({'error': batch.get('error') or 'Lote falhou'}), 400
+    
+    name = "".join(c for c in batch.get('title') or f"lote_{batch_id[:8]}" if c.isalnum() or c in (' ', '-', '_')).rstrip() or 'lote'
+    filename = f"{name}.zip"
+    ascii_name = filename.encode('ascii', 'ignore').decode() or 'lote.zip'
+    entries = iter_batch_files(batch_id, download_status)
+    return Response(stream_zip(entries, pin=download_cache.pinned), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+def update_queue_positions(waiting_ids):
+    """Grava no status a posição atual de cada job que ainda está na fila"""
+    for position, job_id in enumerate(waiting_ids, start=1):
+        job = download_status.get(job_id)
+        if job is not None:
+            job['queue_position'] = position
+
+download_queue.on_positions = update_queue_positions
+
+def make_job_progress(download_id, stages=('download',)):
+    """Progresso real do job, publicado em download_status com taxa limitada"""
+    return JobProgress(lambda fields: download_status[download_id].update(fields), stages=stages,
+                       on_bytes=speculator.throttle_for(download_id))
+
 def download_video_thread(download_id, url, resolution):
-    """Thread para download do vídeo com fallback automático para HD bloqueado"""
+    """Thread para download do vídeo, com o job inteiro num trace (trace_id = download_id)"""
+    # O job começa ao entrar na fila: a espera por um worker é o primeiro span
+    queued_at = download_status[download_id].get('queued_at')
+    with span('download_job', started_at=queued_at, download_id=download_id, resolution=resolution, url=url) as trace:
+        if queued_at:
+            record_span('queue_wait', queued_at)
+        download_video(download_id, url, resolution)
+        status = download_status[download_id].copy()
+        trace.set(status=status['status'], final_resolution=status.get('final_resolution'))
+        if status['status'] == 'error':
+            trace.fail(status['error'])
+
+def download_video(download_id, url, resolution):
+    """Download do vídeo com fallback automático para HD bloqueado"""
     try:
         # Atualiza status
         download_status[download_id]['status'] = 'downloading'
         
-        # Cria objeto YouTube com anti-bot - com retry para 403
-        retry_count = 3
-        yt = None
-        
-        for attempt in range(retry_count):
-            try:
-                yt = create_youtube_object(url)
-                break
-            except Exception as e:
-                if "403" in str(e) or "Forbidden" in str(e):
-                    if attempt < retry_count - 1:
-                        print(f"Tentativa {attempt + 1} falhou com 403, tentando novamente em 5s...")
-                        time.sleep(5)
-                        continue
-                    else:
-                        raise Exception(f"Erro 403 persistente após {retry_count} tentativas. YouTube pode estar bloqueando o acesso.")
-                else:
-                    raise e
+        # Cria objeto YouTube com anti-bot - novas tentativas conforme a política 'youtube_object'
+        # Tabela de streams do /get_video_info (ou montada agora): escolha sem filtros repetidos
+        yt, table = POLICIES['youtube_object'].call(get_video_streams, url)
         
         if not yt:
             raise Exception("Não foi possível criar objeto YouTube")
         
         # Nome seguro do arquivo
         safe_filename = "".join(c for c in yt.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        safe_filename = f"{safe_filename}_{yt.video_id}"
+        
+        # 403 no meio de uma transferência: URL nova para o mesmo itag, continuando do byte atual
+        resume = partial(resolve_stream, url)
         
         if resolution == 'audio':
             # Download apenas áudio
             print("Baixando stream de áudio...")
-            stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+            with span('stream_filter', kind='audio'):
+                stream = stream_for(yt, best_audio(table))
             if not stream:
                 raise Exception("Stream de áudio não encontrado")
             
             filename = f"{safe_filename}_audio.mp4"
             filepath = os.path.join(DOWNLOAD_DIR, filename)
             
-            # Download com retry para 403
-            for attempt in range(3):
-                try:
-                    stream.download(output_path=DOWNLOAD_DIR, filename=filename)
-                    break
-                except Exception as e:
-                    if "403" in str(e) and attempt < 2:
-                        print(f"Erro 403 no download de áudio, tentativa {attempt + 1}/3")
-                        time.sleep(3)
-                        continue
-                    else:
-                        raise e
+            # Download com novas tentativas (política 'download')
+            job_progress = make_job_progress(download_id)
+            
+            def fetch_audio():
+                with job_progress.transfer('audio', stream.filesize):
+                    fetch_stream(stream, DOWNLOAD_DIR, filename, skip_existing=True, resolve_stream=resume)
+            
+            POLICIES['download'].call(fetch_audio)
             
         elif resolution in ['1080p', '720p'] and check_ffmpeg():
             # Sistema de Fallback Inteligente para HD
@@ -393,11 +687,12 @@ def download_video_thread(download_id, url, resolution):
             try:
                 # Primeira tentativa: HD com FFmpeg
                 print(f"Tentando HD {resolution} com FFmpeg...")
-                download_status[download_id]['status'] = 'downloading_video'
+                download_status[download_id]['status'] = 'downloading_streams'
                 
                 # Busca streams HD
-                video_stream = yt.streams.filter(adaptive=True, file_extension='mp4', res=resolution, only_video=True).first()
-                audio_stream = yt.streams.filter(adaptive=True, file_extension='mp4', only_audio=True).order_by('abr').desc().first()
+                with span('stream_filter', kind='adaptive', resolution=resolution):
+                    video_stream = stream_for(yt, first(table, 'video', resolution))
+                    audio_stream = stream_for(yt, best_audio(table, 'mp4'))
                 
                 if not video_stream or not audio_stream:
                     raise Exception(f"Streams HD {resolution} não encontrados")
@@ -408,12 +703,13 @@ def download_video_thread(download_id, url, resolution):
                 
                 # Só 1 tentativa para HD (se falhar, vai para fallback)
                 try:
-                    print(f"⬇️ Baixando vídeo HD {resolution}...")
-                    video_stream.download(output_path=DOWNLOAD_DIR, filename=f"temp_video_{download_id}.mp4")
-                    
-                    print("⬇️ Baixando áudio HD...")
-                    download_status[download_id]['status'] = 'downloading_audio'
-                    audio_stream.download(output_path=DOWNLOAD_DIR, filename=f"temp_audio_{download_id}.mp4")
+                    print(f"⬇️ Baixando vídeo HD {resolution} e áudio em paralelo...")
+                    job_progress = make_job_progress(download_id, stages=('download', 'mux'))
+                    download_video_audio(
+                        video_stream, audio_stream, DOWNLOAD_DIR,
+                        f"temp_video_{download_id}.mp4", f"temp_audio_{download_id}.mp4",
+                        job_progress=job_progress, resolve_stream=resume
+                    )
                     
                     # Combina com FFmpeg
                     print("🔧 Combinando vídeo e áudio...")
@@ -421,21 +717,12 @@ def download_video_thread(download_id, url, resolution):
                     filename = f"{safe_filename}_{resolution}.mp4"
                     filepath = os.path.join(DOWNLOAD_DIR, filename)
                     
-                    ffmpeg_cmd = [
-                        'ffmpeg', '-y',
-                        '-i', video_temp,
-                        '-i', audio_temp,
-                        '-c', 'copy',
-                        filepath
-                    ]
-                    
-                    subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+                    mux_total = os.path.getsize(video_temp) + os.path.getsize(audio_temp)
+                    with job_progress.transfer('mux', mux_total) as mux:
+                        mux_files(video_temp, audio_temp, filepath, on_progress=mux.set)
                     
                     # Remove arquivos temporários
-                    if os.path.exists(video_temp):
-                        os.remove(video_temp)
-                    if os.path.exists(audio_temp):
-                        os.remove(audio_temp)
+                    remove_files(video_temp, audio_temp)
                     
                     hd_success = True
                     print(f"✅ HD {resolution} baixado com sucesso!")
@@ -444,16 +731,15 @@ def download_video_thread(download_id, url, resolution):
                     print(f"❌ HD {resolution} bloqueado: {str(hd_error)[:100]}")
                     
                     # Limpa arquivos temporários se existirem
-                    if os.path.exists(video_temp):
-                        os.remove(video_temp)
-                    if os.path.exists(audio_temp):
-                        os.remove(audio_temp)
+                    remove_files(video_temp, audio_temp)
                     
                     raise hd_error
                     
             except Exception as hd_error:
-                if "403" in str(hd_error) or "Forbidden" in str(hd_error):
+                if classify_error(hd_error) == FORBIDDEN:
                     print("🚫 YouTube bloqueou HD! Tentando fallback para qualidade menor...")
+                    FALLBACK_STEPS.inc(step='hd', resolution=resolution, outcome='blocked')
+                    current_span().set(hd_blocked=True)
                     download_status[download_id]['status'] = 'downloading'
                     
                     # FALLBACK AUTOMÁTICO: Tenta qualidades menores
@@ -465,59 +751,75 @@ def download_video_thread(download_id, url, resolution):
                             
                             if fallback_res in ['720p'] and check_ffmpeg():
                                 # Tenta 720p com FFmpeg
-                                fb_video = yt.streams.filter(adaptive=True, file_extension='mp4', res=fallback_res, only_video=True).first()
-                                fb_audio = yt.streams.filter(adaptive=True, file_extension='mp4', only_audio=True).order_by('abr').desc().first()
+                                fb_video = stream_for(yt, first(table, 'video', fallback_res))
+                                fb_audio = stream_for(yt, best_audio(table, 'mp4'))
                                 
                                 if fb_video and fb_audio:
                                     try:
                                         video_temp = os.path.join(DOWNLOAD_DIR, f"temp_video_{download_id}.mp4")
                                         audio_temp = os.path.join(DOWNLOAD_DIR, f"temp_audio_{download_id}.mp4")
                                         
-                                        fb_video.download(output_path=DOWNLOAD_DIR, filename=f"temp_video_{download_id}.mp4")
-                                        fb_audio.download(output_path=DOWNLOAD_DIR, filename=f"temp_audio_{download_id}.mp4")
+                                        job_progress = make_job_progress(download_id, stages=('download', 'mux'))
+                                        download_video_audio(
+                                            fb_video, fb_audio, DOWNLOAD_DIR,
+                                            f"temp_video_{download_id}.mp4", f"temp_audio_{download_id}.mp4",
+                                            job_progress=job_progress, resolve_stream=resume
+                                        )
                                         
                                         filename = f"{safe_filename}_{fallback_res}_FALLBACK.mp4"
                                         filepath = os.path.join(DOWNLOAD_DIR, filename)
                                         
-                                        ffmpeg_cmd = ['ffmpeg', '-y', '-i', video_temp, '-i', audio_temp, '-c', 'copy', filepath]
-                                        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+                                        mux_total = os.path.getsize(video_temp) + os.path.getsize(audio_temp)
+                                        with job_progress.transfer('mux', mux_total) as mux:
+                                            mux_files(video_temp, audio_temp, filepath, on_progress=mux.set)
                                         
-                                        if os.path.exists(video_temp):
-                                            os.remove(video_temp)
-                                        if os.path.exists(audio_temp):
-                                            os.remove(audio_temp)
+                                        remove_files(video_temp, audio_temp)
                                         
                                         final_resolution = f"{fallback_res} (HD bloqueado)"
                                         print(f"✅ Fallback {fallback_res} com FFmpeg funcionou!")
+                                        FALLBACK_STEPS.inc(step='adaptive', resolution=fallback_res, outcome='ok')
                                         break
-                                    except:
+                                    except SpeculationCancelled:
+                                        remove_files(video_temp, audio_temp)
+                                        raise
+                                    except Exception:
+                                        FALLBACK_STEPS.inc(step='adaptive', resolution=fallback_res, outcome='error')
+                                        remove_files(video_temp, audio_temp)
                                         continue
                             
                             # Tenta qualidade progressiva
-                            fb_stream = yt.streams.filter(progressive=True, file_extension='mp4', res=fallback_res).first()
+                            fb_stream = stream_for(yt, first(table, 'progressive', fallback_res))
                             if fb_stream:
                                 filename = f"{safe_filename}_{fallback_res}_FALLBACK.mp4"
                                 filepath = os.path.join(DOWNLOAD_DIR, filename)
                                 
-                                fb_stream.download(output_path=DOWNLOAD_DIR, filename=filename)
+                                with make_job_progress(download_id).transfer('stream', fb_stream.filesize):
+                                    fetch_stream(fb_stream, DOWNLOAD_DIR, filename, skip_existing=True, resolve_stream=resume)
                                 final_resolution = f"{fallback_res} (HD bloqueado)"
                                 print(f"✅ Fallback progressivo {fallback_res} funcionou!")
+                                FALLBACK_STEPS.inc(step='progressive', resolution=fallback_res, outcome='ok')
                                 break
                                 
+                        except SpeculationCancelled:
+                            # Cancelado não é falha da qualidade: não desce para a próxima
+                            raise
                         except Exception as fb_error:
                             print(f"❌ Fallback {fallback_res} falhou: {str(fb_error)[:50]}")
+                            FALLBACK_STEPS.inc(step='progressive', resolution=fallback_res, outcome='error')
                             continue
                     
                     if not os.path.exists(filepath):
                         # Último recurso: melhor qualidade disponível
                         print("🔄 Último recurso: melhor qualidade disponível...")
-                        best_stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
+                        best_stream = stream_for(yt, first(table, 'progressive'))
                         if best_stream:
                             filename = f"{safe_filename}_{best_stream.resolution}_MELHOR_DISPONIVEL.mp4"
                             filepath = os.path.join(DOWNLOAD_DIR, filename)
-                            best_stream.download(output_path=DOWNLOAD_DIR, filename=filename)
+                            with make_job_progress(download_id).transfer('stream', best_stream.filesize):
+                                fetch_stream(best_stream, DOWNLOAD_DIR, filename, skip_existing=True, resolve_stream=resume)
                             final_resolution = f"{best_stream.resolution} (melhor disponível)"
                             print(f"✅ Download na melhor qualidade disponível: {best_stream.resolution}")
+                            FALLBACK_STEPS.inc(step='best_available', resolution=best_stream.resolution, outcome='ok')
                         else:
                             raise Exception("Nenhuma qualidade disponível para download")
                 else:
@@ -531,42 +833,43 @@ def download_video_thread(download_id, url, resolution):
             print(f"Baixando stream progressivo {resolution}...")
             
             # Busca stream com fallback
-            stream = yt.streams.filter(progressive=True, file_extension='mp4', res=resolution).first()
-            if not stream:
-                # Fallback para qualquer stream progressivo
-                stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
+            with span('stream_filter', kind='progressive', resolution=resolution):
+                # Sem a resolução pedida: melhor progressivo disponível
+                stream = stream_for(yt, first(table, 'progressive', resolution) or first(table, 'progressive'))
                 if not stream:
                     raise Exception(f"Nenhum stream progressivo disponível")
             
             filename = f"{safe_filename}_{stream.resolution}.mp4"
             filepath = os.path.join(DOWNLOAD_DIR, filename)
             
-            # Download com retry para 403
-            for attempt in range(3):
-                try:
-                    stream.download(output_path=DOWNLOAD_DIR, filename=filename)
-                    break
-                except Exception as e:
-                    if "403" in str(e) and attempt < 2:
-                        print(f"Erro 403 no download progressivo, tentativa {attempt + 1}/3")
-                        time.sleep(5)
-                        # Tenta recriar o objeto YouTube
-                        yt = create_youtube_object(url)
-                        stream = yt.streams.filter(progressive=True, file_extension='mp4', res=resolution).first()
-                        if not stream:
-                            stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-                        continue
-                    else:
-                        raise e
+            # Download com novas tentativas (política 'download')
+            job_progress = make_job_progress(download_id)
+            
+            def fetch_progressive():
+                with job_progress.transfer('stream', stream.filesize):
+                    fetch_stream(stream, DOWNLOAD_DIR, filename, skip_existing=True, resolve_stream=resume)
+            
+            def refresh_progressive(error, kind):
+                # 403: recria o objeto YouTube antes da nova tentativa
+                nonlocal yt, table, stream
+                if kind != FORBIDDEN:
+                    return
+                yt = refresh_youtube_object(url)
+                table = get_stream_table(yt)
+                stream = stream_for(yt, first(table, 'progressive', resolution) or first(table, 'progressive'))
+            
+            POLICIES['download'].call(fetch_progressive, on_retry=refresh_progressive)
         
         # Verifica se arquivo foi criado
         if not os.path.exists(filepath):
             raise Exception("Arquivo não foi criado corretamente")
         
-        # Sucesso
+        # Sucesso: o arquivo entra no cache (pode liberar espaço removendo os menos usados)
+        download_cache.add(filepath)
         final_resolution_display = final_resolution if 'final_resolution' in locals() else resolution
         download_status[download_id].update({
             'status': 'completed',
+            'completed_at': time.time(),
             'progress': 100,
             'filename': filename,
             'filepath': filepath,
@@ -582,27 +885,151 @@ def download_video_thread(download_id, url, resolution):
         print(f"✗ Erro no download: {error_msg}")
         
         # Mensagens de erro mais informativas
-        if "403" in error_msg or "Forbidden" in error_msg:
+        kind = classify_error(e)
+        if kind == CIRCUIT_OPEN:
+            error_msg = f"YouTube está bloqueando muitos acessos agora. Tente novamente em {e.retry_after // 60 + 1} minuto(s)."
+        elif kind == FORBIDDEN:
             error_msg = "YouTube bloqueou todas as qualidades disponíveis. Tente:\n• Aguardar 10-15 minutos\n• Usar uma VPN\n• Tentar um vídeo diferente"
-        elif "404" in error_msg:
+        elif kind == NOT_FOUND:
             error_msg = "Vídeo não encontrado ou foi removido."
         elif "regex_search" in error_msg:
             error_msg = "Erro ao processar dados do YouTube. Pode ser um problema temporário."
         elif "Nenhuma qualidade disponível" in error_msg:
             error_msg = "Todas as qualidades foram bloqueadas pelo YouTube. Tente novamente mais tarde."
         
+        job_registry.release(download_id)
         download_status[download_id].update({
             'status': 'error',
             'error': error_msg
         })
 
+@app.route('/strategy_stats')
+def strategy_stats():
+    """Retorna o placar das estratégias de acesso ao YouTube"""
+    return jsonify({'strategies': get_strategy_stats()})
+
+@app.route('/health')
+def health():
+    """Saúde do serviço: recursos do FFmpeg, fila de downloads e cache"""
+    ffmpeg = get_ffmpeg_capabilities(reprobe=request.args.get('reprobe') == '1')
+    return jsonify({
+        'status': 'ok' if ffmpeg['can_mux'] else 'degraded',
+        'ffmpeg': ffmpeg,
+        'queue': download_queue.stats(),
+        'streams': stream_slots.stats(),
+        'video_cache': video_cache.stats(),
+        'download_cache': download_cache.stats(),
+        'circuit_breaker': upstream_breaker.stats(),
+        'rate_limits': rate_limit_stats(),
+        'speculative': speculator.stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato de texto do Prometheus"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+def build_status_payload(download_id):
+    """Monta o status público do download (ou None se não existir)"""
+    if download_id not in download_status:
+        return None
+    
+    status = download_status[download_id].copy()
+    
+    # Tempo sem receber bytes: distingue transferência parada de lenta
+    now = time.time()
+    status['transfers'] = {
+        part: dict(info, idle_seconds=0 if info['done'] else round(now - info['last_byte_at'], 1))
+        for part, info in status.get('transfers', {}).items()
+    }
+    return status
+
 @app.route('/download_status/<download_id>')
 def get_download_status(download_id):
     """Retorna status do download"""
+    status = build_status_payload(download_id)
+    if status is None:
+        return jsonify({'error': 'Download não encontrado'}), 404
+    
+    return jsonify(status)
+
+@app.route('/download_events/<download_id>')
+def download_events(download_id):
+    """Envia as mudanças de status do download via Server-Sent Events"""
     if download_id not in download_status:
         return jsonify({'error': 'Download não encontrado'}), 404
     
-    return jsonify(download_status[download_id])
+    def event_stream():
+        version = -1
+        while True:
+            version = download_status.wait_for_change(download_id, version, timeout=15)
+            status = build_status_payload(download_id)
+            if status is None:
+                break
+            
+            yield f"event: status\ndata: {json.dumps(status)}\n\n"
+            
+            if status['status'] in ('completed', 'error'):
+                break
+    
+    return Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/stream_download')
+def stream_download():
+    """Envia o HD (vídeo + áudio) remuxado em tempo real, sem arquivos temporários"""
+    url = request.args.get('url', '').strip()
+    resolution = request.args.get('resolution', '').strip()
+    
+    if not url or not resolution:
+        return jsonify({'error': 'URL e resolução são obrigatórias'}), 400
+    
+    if not check_ffmpeg_streaming():
+        return jsonify({'error': 'FFmpeg não disponível para streaming HD'}), 400
+    
+    # Não passa pela fila de downloads: vaga própria, liberada quando a resposta fecha
+    try:
+        release_slot = stream_slots.acquire()
+    except QueueFullError as e:
+        return stream_busy_response(e)
+    
+    try:
+        yt, table = get_video_streams(url)
+        video_stream = stream_for(yt, first(table, 'video', resolution))
+        audio_stream = stream_for(yt, best_audio(table, 'mp4'))
+        if not video_stream or not audio_stream:
+            release_slot()
+            return jsonify({'error': f'Streams {resolution} não encontrados'}), 400
+        safe_filename = "".join(c for c in yt.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        safe_filename = f"{safe_filename}_{yt.video_id}"
+    except CircuitOpenError as e:
+        release_slot()
+        return circuit_open_response(e)
+    except Exception as e:
+        release_slot()
+        return jsonify({'error': f'Erro ao preparar streaming: {str(e)}'}), 400
+    
+    filename = f"{safe_filename}_{resolution}.mp4"
+    tee_path = os.path.join(DOWNLOAD_DIR, filename) if STREAM_CACHE_TO_DISK else None
+    print(f"📡 Streaming {resolution} direto para o cliente: {filename}")
+    
+    ascii_name = filename.encode('ascii', 'ignore').decode() or 'video.mp4'
+    def body():
+        # O FFmpeg abre duas conexões de mídia (vídeo e áudio)
+        stream_limiter.acquire(2)
+        yield from stream_mux(video_stream.url, audio_stream.url, tee_path=tee_path)
+        if tee_path:
+            download_cache.add(tee_path)
+    
+    response = Response(body(), mimetype='video/mp4', headers={
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(release_slot)
+    return response
 
 @app.route('/download_file/<download_id>')
 def download_file(download_id):
@@ -610,7 +1037,9 @@ def download_file(download_id):
     if download_id not in download_status:
         return jsonify({'error': 'Download não encontrado'}), 404
     
-    status = download_status[download_id]
+    status = download_status[download_id].copy()
+    if status.get('type') == 'batch':
+        return jsonify({'error': 'Use /batch_zip para baixar um lote'}), 400
     if status['status'] != 'completed':
         return jsonify({'error': 'Download não concluído'}), 400
     
@@ -618,23 +1047,39 @@ def download_file(download_id):
     if not os.path.exists(filepath):
         return jsonify({'error': 'Arquivo não encontrado'}), 404
     
-    return send_file(filepath, as_attachment=True, download_name=status['filename'])
+    # Pin até o fim do envio: o arquivo não é removido do cache no meio da transferência
+    download_cache.touch(filepath)
+    download_cache.pin(filepath)
+    # Envio no trace do job: o span termina quando a resposta é fechada
+    trace = start_span('serve_file', download_id=download_id, range=request.headers.get('Range'))
+    try:
+        response = serve_download(filepath, status['filename'], DOWNLOAD_DIR)
+    except Exception as e:
+        download_cache.unpin(filepath)
+        trace.end(error=e)
+        raise
+    trace.set(status_code=response.status_code)
+
+    def on_close():
+        download_cache.unpin(filepath)
+        trace.end()
 
-# Limpeza automática de arquivos antigos (executar periodicamente)
+    response.call_on_close(on_close)
+    return response
+
+# Manutenção periódica (o limite de espaço é aplicado a cada arquivo novo, no download_cache)
 def cleanup_old_files():
-    """Remove arquivos antigos"""
+    """Sincroniza o cache de downloads com o disco e remove status antigos"""
     try:
-        current_time = time.time()
-        for filename in os.listdir(DOWNLOAD_DIR):
-            filepath = os.path.join(DOWNLOAD_DIR, filename)
-            if os.path.isfile(filepath):
-                # Remove arquivos com mais de 1 hora
-                if current_time - os.path.getmtime(filepath) > 3600:
-                    os.remove(filepath)
+        # Vê arquivos de outros workers, remove temporários órfãos e aplica o limite
+        download_cache.scan()
+        
+        # Remove status de jobs parados há mais de 1 dia
+        download_status.purge(older_than=86400)
     except Exception as e:
         print(f"Erro na limpeza: {e}")
 
-# Executar limpeza a cada 30 minutos
+# Executar manutenção a cada 30 minutos
 def schedule_cleanup():
     while True:
         time.sleep(1800)  # 30 minutos
@@ -0,0 +1,430 @@
+"""Modo ASGI: os mesmos endpoints do app.py, sem prender uma thread por requisição lenta
+
+Rodar com: hypercorn app_asgi:app --bind 0.0.0.0:5000
+
+As esperas do YouTube (intervalo entre estratégias, backoff após 403, hedge da
+corrida, fila do limite de requisições) são asyncio.sleep; só as chamadas
+bloqueantes ao pytubefix, SQLite e FFmpeg passam por um executor de tamanho
+fixo. Downloads, fila, status e cache são os mesmos objetos do app.py.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from quart import Quart, Response, render_template, request, jsonify, send_file
+import app as sync_app
+from video_cache import video_cache, extract_video_id
+from youtube_client import get_youtube_object_async, get_stream_table, get_basic_info
+from stream_table import first, best_audio, stream_for
+from ffmpeg_tools import check_ffmpeg_streaming, stream_mux
+from file_serving import FILE_SERVING_MODE, file_etag, offload_headers
+from batch_jobs import iter_batch_files, stream_zip
+from job_store import POLL_INTERVAL
+from retry_policy import CircuitOpenError
+from rate_limiter import stream_limiter
+from download_queue import stream_slots, QueueFullError
+from metrics import VIDEO_INFO_SECONDS
+from tracing import span, start_span, in_current_trace
+
+# Threads para as chamadas bloqueantes; as esperas não ocupam nenhuma
+BLOCKING_THREADS = int(os.environ.get('ASGI_BLOCKING_THREADS', 32))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+
+app = Quart(__name__)
+app.config['MAX_CONTENT_LENGTH'] = sync_app.app.config.get('MAX_CONTENT_LENGTH')
+
+
+async def run_blocking(func, *args):
+    """Executa uma função bloqueante no executor limitado (no span atual)"""
+    return await asyncio.get_running_loop().run_in_executor(executor, in_current_trace(func), *args)
+
+
+async def iterate_blocking(iterator):
+    """Consome um gerador bloqueante (FFmpeg, ZIP) no executor, um bloco por vez"""
+    done = object()
+    try:
+        while True:
+            chunk = await run_blocking(next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        # Cliente desconectou: encerra o gerador (mata o FFmpeg, fecha o ZIP)
+        await run_blocking(iterator.close)
+
+
+async def run_flask_view(view, *args, json_body=None):
+    """Executa uma view rápida do app.py (no executor) e converte a resposta
+
+    Mantém um único código para endpoints curtos (status, fila, lotes); os
+    lentos e os de streaming têm versão assíncrona própria abaixo.
+    """
+    # O request do Quart só existe nesta task; a thread do executor recebe uma cópia
+    path, method, query_string = request.path, request.method, request.query_string.decode()
+
+    def call():
+        with sync_app.app.test_request_context(path, method=method, query_string=query_string, json=json_body):
+            response = sync_app.app.make_response(view(*args))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+    data, status_code, headers = await run_blocking(call)
+    return Response(data, status=status_code, headers=headers)
+
+
+class PinnedBody:
+    """Corpo da resposta que mantém o arquivo com pin no cache até terminar o envio
+
+    Com `trace`, o span é encerrado junto com o envio.
+    """
+
+    def __init__(self, body, filepath, trace=None):
+        self._body = body
+        self._filepath = filepath
+        self._trace = trace
+
+    async def __aenter__(self):
+        sync_app.download_cache.pin(self._filepath)
+        return await self._body.__aenter__()
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._body.__aexit__(*exc_info)
+        finally:
+            sync_app.download_cache.unpin(self._filepath)
+            if self._trace is not None:
+                self._trace.end(error=exc_info[1])
+
+
+class SlotBody:
+    """Corpo da resposta que devolve a vaga de streaming quando o envio termina (ou o cliente sai)"""
+
+    def __init__(self, body, release):
+        self._body = body
+        self._release = release
+
+    async def __aenter__(self):
+        return await self._body.__aenter__()
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._body.__aexit__(*exc_info)
+        finally:
+            self._release()
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.route('/get_video_info', methods=['POST'])
+async def get_video_info():
+    """Obtém informações do vídeo sem prender thread durante as tentativas ("fast": cartão básico antes)"""
+    with span('get_video_info'):
+        return await video_info_response(allow_fast=True)
+
+
+@app.route('/get_video_streams', methods=['POST'])
+async def get_video_streams_info():
+    """Segunda fase do modo rápido: resposta completa, aproveitando a resolução já iniciada"""
+    with span('get_video_info'):
+        return await video_info_response(allow_fast=False)
+
+
+# Resoluções completas do modo rápido em andamento, por vídeo
+_info_lookups = {}
+
+
+async def resolve_video_info(url, video_id):
+    try:
+        yt = await get_youtube_object_async(url, executor)
+        print("✓ Objeto YouTube criado com sucesso")
+
+        # Propriedades e streams ainda podem fazer requisições: executor
+        with span('describe_video'):
+            payload, status_code = await run_blocking(sync_app.describe_video, yt, video_id)
+    except Exception as e:
+        sync_app.remember_failed_info(video_id, e)
+        raise
+    if status_code != 200:
+        sync_app.remember_failed_info(video_id, (payload, status_code))
+    return payload, status_code
+
+
+def start_info_lookup(url, video_id):
+    """Task em segundo plano com resolve_video_info (uma por vídeo)"""
+    task = _info_lookups.get(video_id)
+    if task is None:
+        task = asyncio.ensure_future(resolve_video_info(url, video_id))
+        _info_lookups[video_id] = task
+
+        def finished(done):
+            _info_lookups.pop(video_id, None)
+            # Erro sem ninguém esperando: marca como lido (a próxima chamada tenta de novo)
+            if not done.cancelled():
+                done.exception()
+
+        task.add_done_callback(finished)
+    return task
+
+
+async def video_info_response(allow_fast):
+    started = time.monotonic()
+    try:
+        data = await request.get_json()
+        url = data.get('url', '').strip()
+
+        if not url:
+            return jsonify({'error': 'URL é obrigatória'}), 400
+
+        if 'youtube.com' not in url and 'youtu.be' not in url:
+            return jsonify({'error': 'URL deve ser do YouTube'}), 400
+
+        print(f"Processando URL: {url}")
+
+        video_id = extract_video_id(url)
+        cached = sync_app.cached_video_info(video_id)
+        if cached:
+            await run_blocking(sync_app.speculate_download, url, video_id, cached)
+            VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='cached')
+            return jsonify(cached)
+
+        failure = sync_app.recent_info_failure(video_id)
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is not None:
+            VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='error')
+            return jsonify(failure[0]), failure[1]
+
+        if allow_fast and data.get('fast') and video_id and video_cache.get(video_id) is None:
+            start_info_lookup(url, video_id)
+            basic = await run_blocking(get_basic_info, url)
+            if basic:
+                VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='basic')
+                return jsonify(sync_app.basic_info_response(basic))
+
+        task = _info_lookups.get(video_id)
+        if task is not None:
+            try:
+                payload, status_code = await asyncio.wait_for(asyncio.shield(task), sync_app.INFO_LOOKUP_TIMEOUT)
+            except asyncio.TimeoutError:
+                # A task segue em segundo plano; o cliente pede as qualidades de novo
+                basic = await run_blocking(get_basic_info, url)
+                VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='timeout')
+                if basic:
+                    return jsonify(sync_app.basic_info_response(basic))
+                return jsonify({'error': 'YouTube demorando para responder. Tente novamente em instantes.'}), 504
+        else:
+            payload, status_code = await resolve_video_info(url, video_id)
+        if status_code == 200:
+            await run_blocking(sync_app.speculate_download, url, video_id, payload)
+        VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='ok' if status_code == 200 else 'error')
+        return jsonify(payload), status_code
+
+    except CircuitOpenError as e:
+        print(f"⚡ {e}")
+        VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='circuit_open')
+        return sync_app.circuit_open_response(e)
+    except Exception as e:
+        error_message = str(e)
+        print(f"✗ Erro geral: {error_message}")
+        VIDEO_INFO_SECONDS.observe(time.monotonic() - started, outcome='error')
+        error_message = sync_app.friendly_info_error(error_message)
+        return jsonify({'error': f'Erro ao obter informações do vídeo: {error_message}'}), 400
+
+
+@app.route('/start_download', methods=['POST'])
+async def start_download():
+    return await run_flask_view(sync_app.start_download, json_body=await request.get_json(silent=True))
+
+
+@app.route('/start_batch', methods=['POST'])
+async def start_batch():
+    return await run_flask_view(sync_app.start_batch, json_body=await request.get_json(silent=True))
+
+
+@app.route('/batch_status/<batch_id>')
+async def batch_status(batch_id):
+    return await run_flask_view(sync_app.batch_status, batch_id)
+
+
+@app.route('/strategy_stats')
+async def strategy_stats():
+    return await run_flask_view(sync_app.strategy_stats)
+
+
+@app.route('/health')
+async def health():
+    return await run_flask_view(sync_app.health)
+
+
+@app.route('/metrics')
+async def metrics():
+    return await run_flask_view(sync_app.metrics)
+
+
+@app.route('/download_status/<download_id>')
+async def get_download_status(download_id):
+    return await run_flask_view(sync_app.get_download_status, download_id)
+
+
+@app.route('/download_events/<download_id>')
+async def download_events(download_id):
+    """Server-Sent Events sem thread parada por ouvinte: verifica a versão do job periodicamente"""
+    store = sync_app.download_status
+    if not await run_blocking(store.__contains__, download_id):
+        return jsonify({'error': 'Download não encontrado'}), 404
+
+    async def event_stream():
+        version = -1
+        last_sent = 0.0
+        while True:
+            current = await run_blocking(store.version, download_id)
+            # Mudou, ou passaram 15 s (heartbeat, como no modo WSGI)
+            if current != version or time.monotonic() - last_sent >= 15:
+                version = current
+                status = await run_blocking(sync_app.build_status_payload, download_id)
+                if status is None:
+                    break
+
+                yield f"event: status\ndata: {json.dumps(status)}\n\n".encode()
+                last_sent = time.monotonic()
+
+                if status['status'] in ('completed', 'error'):
+                    break
+            await asyncio.sleep(POLL_INTERVAL)
+
+    response = Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
+
+
+@app.route('/stream_download')
+async def stream_download():
+    """HD remuxado em tempo real; a leitura da saída do FFmpeg passa pelo executor"""
+    url = request.args.get('url', '').strip()
+    resolution = request.args.get('resolution', '').strip()
+
+    if not url or not resolution:
+        return jsonify({'error': 'URL e resolução são obrigatórias'}), 400
+
+    if not check_ffmpeg_streaming():
+        return jsonify({'error': 'FFmpeg não disponível para streaming HD'}), 400
+
+    try:
+        release_slot = stream_slots.acquire()
+    except QueueFullError as e:
+        return sync_app.stream_busy_response(e)
+
+    try:
+        yt = await get_youtube_object_async(url, executor)
+
+        def pick_streams():
+            table = get_stream_table(yt)
+            return stream_for(yt, first(table, 'video', resolution)), stream_for(yt, best_audio(table, 'mp4'))
+
+        video_stream, audio_stream = await run_blocking(pick_streams)
+        if not video_stream or not audio_stream:
+            release_slot()
+            return jsonify({'error': f'Streams {resolution} não encontrados'}), 400
+        safe_filename = "".join(c for c in yt.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        safe_filename = f"{safe_filename}_{yt.video_id}"
+    except CircuitOpenError as e:
+        release_slot()
+        return sync_app.circuit_open_response(e)
+    except Exception as e:
+        release_slot()
+        return jsonify({'error': f'Erro ao preparar streaming: {str(e)}'}), 400
+    except BaseException:
+        # Pedido cancelado (cliente saiu) durante a resolução
+        release_slot()
+        raise
+
+    filename = f"{safe_filename}_{resolution}.mp4"
+    tee_path = os.path.join(sync_app.DOWNLOAD_DIR, filename) if sync_app.STREAM_CACHE_TO_DISK else None
+    print(f"📡 Streaming {resolution} direto para o cliente: {filename}")
+
+    # Fichas das duas conexões de mídia do FFmpeg, esperadas sem ocupar thread
+    try:
+        await stream_limiter.acquire_async(2)
+    except BaseException:
+        release_slot()
+        raise
+
+    def body():
+        yield from stream_mux(video_stream.url, audio_stream.url, tee_path=tee_path)
+        if tee_path:
+            sync_app.download_cache.add(tee_path)
+
+    ascii_name = filename.encode('ascii', 'ignore').decode() or 'video.mp4'
+    response = Response(iterate_blocking(body()), mimetype='video/mp4', headers={
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    response.response = SlotBody(response.response, release_slot)
+    response.timeout = None
+    return response
+
+
+@app.route('/batch_zip/<batch_id>')
+async def batch_zip(batch_id):
+    """ZIP do lote montado em tempo real (leitura dos arquivos no executor)"""
+    batch = await run_blocking(sync_app.download_status.read, batch_id)
+    if batch is None or batch.get('type') != 'batch':
+        return jsonify({'error': 'Lote não encontrado'}), 404
+    if batch['status'] == 'error':
+        return jsonify({'error': batch.get('error') or 'Lote falhou'}), 400
+
+    name = "".join(c for c in batch.get('title') or f"lote_{batch_id[:8]}" if c.isalnum() or c in (' ', '-', '_')).rstrip() or 'lote'
+    filename = f"{name}.zip"
+    ascii_name = filename.encode('ascii', 'ignore').decode() or 'lote.zip'
+    entries = iter_batch_files(batch_id, sync_app.download_status)
+    response = Response(iterate_blocking(stream_zip(entries, pin=sync_app.download_cache.pinned)), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
+
+
+@app.route('/download_file/<download_id>')
+async def download_file(download_id):
+    """Envia o arquivo (Range/ETag pelo Quart, ou delegado ao proxy)"""
+    status = await run_blocking(sync_app.download_status.read, download_id)
+    if status is None:
+        return jsonify({'error': 'Download não encontrado'}), 404
+    if status.get('type') == 'batch':
+        return jsonify({'error': 'Use /batch_zip para baixar um lote'}), 400
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Download não concluído'}), 400
+
+    filepath = status['filepath']
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+
+    sync_app.download_cache.touch(filepath)
+    if FILE_SERVING_MODE in ('x-accel', 'x-sendfile'):
+        mimetype = mimetypes.guess_type(status['filename'])[0] or 'application/octet-stream'
+        return Response(b'', status=200, mimetype=mimetype,
+                        headers=offload_headers(filepath, status['filename'], sync_app.DOWNLOAD_DIR))
+
+    # Mesma ETag forte do modo WSGI; Range/If-Range/304 tratados pelo make_conditional
+    response = await send_file(filepath, as_attachment=True, attachment_filename=status['filename'], add_etags=False)
+    response.set_etag(file_etag(filepath))
+    await response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(filepath))
+    trace = start_span('serve_file', download_id=download_id, range=request.headers.get('Range'), status_code=response.status_code)
+    response.response = PinnedBody(response.response, filepath, trace)
+    response.timeout = None
+    return response
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
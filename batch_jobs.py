@@ -0,0 +1,186 @@
+"""Downloads em lote (playlist ou lista de URLs) com limite de concorrência e ZIP em streaming"""
+import os
+import time
+import zipfile
+from contextlib import nullcontext
+from download_queue import QueueFullError
+
+# Máximo de vídeos por lote e de downloads simultâneos de um mesmo lote
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 2))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+
+# Intervalo de verificação do andamento dos itens
+POLL_INTERVAL = 1.0
+TERMINAL = ('completed', 'error')
+
+
+def new_item(url):
+    return {'url': url, 'download_id': None, 'status': 'pending', 'progress': 0, 'filename': '', 'error': None}
+
+
+def summarize(items):
+    """Progresso agregado do lote: itens com erro contam como terminados"""
+    total = len(items)
+    completed = sum(1 for item in items if item['status'] == 'completed')
+    failed = sum(1 for item in items if item['status'] == 'error')
+    done_weight = sum(100 if item['status'] in TERMINAL else item['progress'] for item in items)
+    return {
+        'total': total,
+        'completed': completed,
+        'failed': failed,
+        'active': sum(1 for item in items if item['download_id'] and item['status'] not in TERMINAL),
+        'progress': int(done_weight / total) if total else 0
+    }
+
+
+def run_batch(batch_id, store, enqueue, resolution, concurrency, urls=None, playlist_url=None, expand_playlist=None):
+    """Coordena um lote: expande a playlist, enfileira no máximo `concurrency` itens por vez
+    e publica o progresso agregado em `store[batch_id]`
+
+    `enqueue(url, resolution)` é o mesmo caminho do /start_download e retorna o
+    dict da resposta (com download_id), ou levanta QueueFullError.
+    """
+    batch = store[batch_id]
+    try:
+        if playlist_url:
+            batch['status'] = 'expanding'
+            title, urls = expand_playlist(playlist_url, BATCH_MAX_ITEMS)
+            batch['title'] = title
+            if not urls:
+                raise Exception("Playlist vazia ou indisponível")
+
+        items = [new_item(url) for url in urls[:BATCH_MAX_ITEMS]]
+        batch.update(dict(summarize(items), status='running', items=items))
+
+        next_submit_at = 0
+        while True:
+            # Atualiza os itens a partir do status dos jobs de download
+            for item in items:
+                if item['download_id'] and item['status'] not in TERMINAL:
+                    job = store.get(item['download_id'])
+                    job = job.copy() if job is not None else {'status': 'error', 'error': 'Download não encontrado'}
+                    item.update({
+                        'status': job['status'],
+                        'progress': job.get('progress', 0),
+                        'filename': job.get('filename', ''),
+                        'error': job.get('error')
+                    })
+
+            # Enfileira novos itens até o limite do lote (respeitando a fila global)
+            in_flight = sum(1 for item in items if item['download_id'] and item['status'] not in TERMINAL)
+            for item in items:
+                if in_flight >= concurrency or time.time() < next_submit_at:
+                    break
+                if item['status'] != 'pending':
+                    continue
+                try:
+                    result = enqueue(item['url'], resolution)
+                except QueueFullError as e:
+                    next_submit_at = time.time() + e.retry_after
+                    break
+                except Exception as e:
+                    item.update({'status': 'error', 'error': str(e)})
+                    continue
+                item.update({'download_id': result['download_id'], 'status': result['status']})
+                in_flight += 1
+
+            summary = summarize(items)
+            finished = summary['completed'] + summary['failed'] == summary['total']
+            if finished:
+                status = 'completed' if summary['completed'] else 'error'
+                batch.update(dict(summary, items=items, status=status, completed_at=time.time(),
+                                  error=None if summary['completed'] else 'Nenhum vídeo do lote pôde ser baixado'))
+                print(f"📦 Lote {batch_id} concluído: {summary['completed']}/{summary['total']} vídeos")
+                return
+            batch.update(dict(summary, items=items))
+            time.sleep(POLL_INTERVAL)
+
+    except Exception as e:
+        print(f"✗ Erro no lote {batch_id}: {e}")
+        batch.update({'status': 'error', 'error': str(e)})
+
+
+def iter_batch_files(batch_id, store, poll_interval=POLL_INTERVAL):
+    """Gera (nome no ZIP, caminho) conforme os itens do lote terminam; no fim, um relatório de falhas
+
+    Itens concluídos vão saindo sem esperar o lote inteiro. O relatório é
+    gerado como (nome, bytes).
+    """
+    sent = set()
+    while True:
+        batch = store.get(batch_id)
+        if batch is None:
+            return
+        batch = batch.copy()
+        items = batch.get('items', [])
+        for index, item in enumerate(items, start=1):
+            if item['status'] != 'completed' or index in sent:
+                continue
+            job = store.get(item['download_id'])
+            job = job.copy() if job is not None else {}
+            sent.add(index)
+            if job.get('filepath') and os.path.exists(job['filepath']):
+                yield f"{index:02d} - {job['filename']}", job['filepath']
+        if batch['status'] in TERMINAL:
+            break
+        time.sleep(poll_interval)
+
+    failures = [f"{item['url']}: {item['error'] or item['status']}" for item in items if item['status'] != 'completed']
+    if failures:
+        yield 'FALHAS.txt', ('\n'.join(failures) + '\n').encode('utf-8')
+
+
+class _ZipStream:
+    """Destino do ZipFile sem seek: acumula os bytes escritos até o gerador buscá-los"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, pin=None, chunk_size=1024 * 1024):
+    """Gera os bytes de um ZIP (sem compressão; vídeos já são comprimidos) montado em tempo real
+
+    `entries` produz (nome, caminho) ou (nome, bytes). Nada é gravado em
+    disco; `pin(caminho)` protege cada arquivo enquanto ele é lido.
+    """
+    output = _ZipStream()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(arcname, source)
+            else:
+                with (pin(source) if pin else nullcontext()):
+                    try:
+                        src = open(source, 'rb')
+                    except OSError as e:
+                        print(f"✗ Arquivo do lote indisponível, pulando: {e}")
+                        continue
+                    with src, archive.open(arcname, 'w', force_zip64=True) as dest:
+                        while True:
+                            chunk = src.read(chunk_size)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            data = output.drain()
+                            # Bloco vazio encerraria a resposta chunked antes da hora
+                            if data:
+                                yield data
+            data = output.drain()
+            if data:
+                yield data
+    data = output.drain()
+    if data:
+        yield data
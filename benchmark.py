@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline do app.py contra o fake_upstream (nada sai para o YouTube)
+
+Mede /get_video_info (p50/p99, com e sem cache, com 429 injetado), o tempo
+de jobs progressivos e HD, o tempo de mux e o custo da escada de fallback
+quando o HD é bloqueado. O resultado vai para um JSON (um arquivo por
+execução) para comparar versões:
+
+    python benchmark.py
+    python benchmark.py --requests 100 --bandwidth 2000000
+    python benchmark.py --compare benchmark_results/anterior.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Antes de importar o app: o benchmark mede o app, não os limites de proteção
+os.environ.setdefault('RATE_LIMIT_METADATA_RATE', '0')
+os.environ.setdefault('RATE_LIMIT_STREAM_RATE', '0')
+os.environ.setdefault('CIRCUIT_MIN_CALLS', '1000000')
+
+import app as sync_app
+import youtube_client
+from fake_upstream import FakeUpstream, fake_strategy_factories
+from ffmpeg_tools import check_ffmpeg, get_ffmpeg_capabilities
+from strategy_stats import StrategyScoreboard
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results')
+
+
+def percentile(values, pct):
+    """Percentil pelo método nearest-rank (None se não houver amostras)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 4)
+
+
+def summarize_times(values):
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 4) if values else None,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': round(max(values), 4) if values else None
+    }
+
+
+def new_video_url():
+    """URL com um ID novo (11 caracteres): sem cache nem job reaproveitado"""
+    video_id = 'bm' + ''.join(random.choices(string.ascii_letters + string.digits, k=9))
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+class Bench:
+    """Executa os cenários contra o app.py em processo, pelo test client do Flask"""
+
+    def __init__(self, upstream, args):
+        self.upstream = upstream
+        self.args = args
+        self.client = sync_app.app.test_client()
+        self.created_files = []
+        self.mux_times = []
+
+        # Pytubefix trocado pelo upstream falso, em todas as estratégias
+        youtube_client.STRATEGY_FACTORIES = fake_strategy_factories(upstream.base_url, youtube_client.STRATEGY_NAMES)
+
+        # Mede o mux sem alterar o comportamento
+        original_mux = sync_app.mux_files
+
+        def timed_mux(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original_mux(*args, **kwargs)
+            finally:
+                self.mux_times.append(time.perf_counter() - started)
+
+        sync_app.mux_files = timed_mux
+
+    def reset(self, **config):
+        """Estado limpo entre cenários: upstream, placar das estratégias e tempos de mux"""
+        config.setdefault('bandwidth', self.args.bandwidth)
+        config.setdefault('player_latency', self.args.player_latency)
+        config.setdefault('stream_latency', self.args.stream_latency)
+        config.setdefault('seed', self.args.seed)
+        self.upstream.reset(**config)
+        youtube_client.strategy_scoreboard = StrategyScoreboard()
+        self.mux_times = []
+
+    def video_info(self, url):
+        started = time.perf_counter()
+        response = self.client.post('/get_video_info', json={'url': url})
+        return time.perf_counter() - started, response.status_code
+
+    def run_job(self, url, resolution):
+        """Enfileira o job e espera terminar; retorna (segundos, status final)"""
+        started = time.perf_counter()
+        response = self.client.post('/start_download', json={'url': url, 'resolution': resolution})
+        if response.status_code != 200:
+            return time.perf_counter() - started, {'status': 'error', 'error': response.get_json()}
+        download_id = response.get_json()['download_id']
+        deadline = time.monotonic() + self.args.job_timeout
+        while time.monotonic() < deadline:
+            status = self.client.get(f'/download_status/{download_id}').get_json()
+            if status['status'] in ('completed', 'error'):
+                elapsed = time.perf_counter() - started
+                if status.get('filepath'):
+                    self.created_files.append(status['filepath'])
+                return elapsed, status
+            time.sleep(0.02)
+        return time.perf_counter() - started, {'status': 'timeout'}
+
+    def info_scenario(self, requests, same_video=False, **config):
+        self.reset(**config)
+        url = new_video_url()
+        if same_video:
+            self.video_info(url)
+        times, errors = [], 0
+        for _ in range(requests):
+            elapsed, status_code = self.video_info(url if same_video else new_video_url())
+            times.append(elapsed)
+            errors += status_code != 200
+        return dict(summarize_times(times), errors=errors, upstream=self.upstream.stats(), config=self.upstream.config.as_dict())
+
+    def job_scenario(self, jobs, resolution, **config):
+        self.reset(**config)
+        times, errors, resolutions, nbytes = [], 0, {}, 0
+        for _ in range(jobs):
+            url = new_video_url()
+            # Metadados já resolvidos, como no uso real (info antes do download)
+            self.video_info(url)
+            elapsed, status = self.run_job(url, resolution)
+            if status['status'] != 'completed':
+                errors += 1
+                continue
+            times.append(elapsed)
+            final = status.get('final_resolution') or resolution
+            resolutions[final] = resolutions.get(final, 0) + 1
+            nbytes += os.path.getsize(status['filepath'])
+        result = dict(summarize_times(times), errors=errors, final_resolutions=resolutions)
+        result['throughput_mbps'] = round(nbytes * 8 / 1e6 / sum(times), 2) if times else None
+        if self.mux_times:
+            result['mux'] = summarize_times(self.mux_times)
+        result.update(upstream=self.upstream.stats(), config=self.upstream.config.as_dict())
+        return result
+
+    def cleanup(self):
+        for path in self.created_files:
+            sync_app.download_cache.unpin(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        sync_app.download_cache.scan()
+
+
+def run(args):
+    ffmpeg = get_ffmpeg_capabilities()
+    print(f"🧪 Subindo upstream falso (mídia de {args.duration}s, FFmpeg: {'sim' if ffmpeg['available'] else 'não'})...")
+    upstream = FakeUpstream(duration=args.duration, ffmpeg_path=ffmpeg['path'] if ffmpeg['available'] else None).start()
+    bench = Bench(upstream, args)
+    scenarios = {}
+
+    def scenario(name, func, *func_args, **kwargs):
+        print(f"\n▶ {name}")
+        started = time.perf_counter()
+        result = func(*func_args, **kwargs)
+        result['wall_seconds'] = round(time.perf_counter() - started, 3)
+        scenarios[name] = result
+        print(f"  {json.dumps({k: v for k, v in result.items() if k not in ('upstream', 'config')}, ensure_ascii=False)}")
+
+    try:
+        scenario('video_info_cold', bench.info_scenario, args.requests)
+        scenario('video_info_cached', bench.info_scenario, args.requests, same_video=True)
+        scenario('video_info_429', bench.info_scenario, max(1, args.requests // 2), player_429_rate=args.error_rate)
+        scenario('progressive_job', bench.job_scenario, args.jobs, '360p')
+        scenario('progressive_job_403', bench.job_scenario, args.jobs, '360p', stream_403_rate=args.error_rate)
+
+        if check_ffmpeg():
+            scenario('hd_job', bench.job_scenario, args.jobs, '1080p')
+            # HD bloqueado: escada 1080p → 720p adaptivo → progressivo
+            scenario('hd_fallback_ladder', bench.job_scenario, args.jobs, '1080p', blocked_itags={136, 137})
+            direct = scenarios['progressive_job']['p50']
+            ladder = scenarios['hd_fallback_ladder']['p50']
+            if direct is not None and ladder is not None:
+                scenarios['hd_fallback_ladder']['overhead_vs_progressive_p50'] = round(ladder - direct, 4)
+        else:
+            print("\n⚠️ FFmpeg indisponível: cenários HD, mux e escada de fallback pulados")
+            for name in ('hd_job', 'hd_fallback_ladder'):
+                scenarios[name] = {'skipped': 'ffmpeg indisponível'}
+    finally:
+        bench.cleanup()
+        upstream.stop()
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ffmpeg': ffmpeg['version'],
+            'args': vars(args)
+        },
+        'scenarios': scenarios
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Imprime as métricas numéricas dos cenários em comum (anterior → atual)"""
+    print(f"\n📊 Comparação: {previous['meta'].get('git_commit')} → {current['meta'].get('git_commit')}")
+    for name, result in current['scenarios'].items():
+        old = previous['scenarios'].get(name)
+        if not old or 'skipped' in result or 'skipped' in old:
+            continue
+        for key in ('p50', 'p99', 'mean', 'throughput_mbps', 'errors', 'overhead_vs_progressive_p50'):
+            before, after = old.get(key), result.get(key)
+            if before is None or after is None:
+                continue
+            delta = f" ({(after - before) / before * 100:+.1f}%)" if before else ''
+            print(f"  {name}.{key}: {before} → {after}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=30, help='chamadas a /get_video_info por cenário')
+    parser.add_argument('--jobs', type=int, default=3, help='jobs de download por cenário')
+    parser.add_argument('--duration', type=int, default=10, help='duração (s) da mídia sintética')
+    parser.add_argument('--bandwidth', type=int, default=4_000_000, help='bytes/s por conexão no upstream (0 = sem limite)')
+    parser.add_argument('--player-latency', type=float, default=0.05)
+    parser.add_argument('--stream-latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.2, help='fração de 403/429 nos cenários com falhas')
+    parser.add_argument('--job-timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='arquivo JSON de saída (padrão: benchmark_results/<data>_<commit>.json)')
+    parser.add_argument('--compare', help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = run(args)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{results['meta']['git_commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados em {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
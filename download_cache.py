@@ -0,0 +1,169 @@
+"""Cache LRU dos arquivos em DOWNLOAD_DIR, limitado por tamanho total em bytes"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Espaço máximo ocupado pelos arquivos prontos (padrão 5 GiB)
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+# Temporários (.part, temp_*) sem alteração há mais tempo que isso são de jobs que morreram
+ORPHAN_AGE = int(os.environ.get('DOWNLOAD_CACHE_ORPHAN_AGE', 3600))
+# Arquivos alterados há menos tempo que isso nunca são removidos (podem ser de outro worker)
+EVICT_GRACE = 60
+
+
+def is_temporary(filename):
+    """Arquivo intermediário de um job em andamento (não entra no índice)"""
+    return filename.startswith('temp_') or filename.endswith('.part')
+
+
+class DownloadCache:
+    """Índice em memória (tamanho, último acesso, pins) dos arquivos prontos
+
+    Só arquivos registrados com `add` (ou encontrados pelo `scan`) podem ser
+    removidos; temporários de jobs em andamento ficam fora do índice. Um
+    arquivo com pin (sendo enviado, reaproveitado) nunca é removido.
+    """
+
+    def __init__(self, directory, max_bytes=DOWNLOAD_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pins = {}
+        self._total = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def scan(self):
+        """Sincroniza o índice com o disco (arquivos de outros workers, removidos por fora)
+
+        Temporários órfãos (sem alteração há mais de ORPHAN_AGE) são apagados.
+        """
+        now = time.time()
+        found = {}
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            if is_temporary(filename):
+                if now - st.st_mtime > ORPHAN_AGE:
+                    self._delete(path)
+                continue
+            found[path] = st
+
+        with self._lock:
+            for path in list(self._entries):
+                if path not in found:
+                    self._forget(path)
+            for path, st in found.items():
+                entry = self._entries.get(path)
+                if entry is None:
+                    self._entries[path] = {'size': st.st_size, 'last_access': max(st.st_atime, st.st_mtime)}
+                    self._total += st.st_size
+                else:
+                    self._total += st.st_size - entry['size']
+                    entry['size'] = st.st_size
+            # Ordem LRU: menos recente primeiro
+            self._entries = OrderedDict(sorted(self._entries.items(), key=lambda item: item[1]['last_access']))
+        self.evict()
+
+    def add(self, path):
+        """Registra um arquivo recém-escrito e remove os menos usados se passar do limite"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._forget(path)
+            self._entries[path] = {'size': size, 'last_access': time.time()}
+            self._total += size
+        self.evict()
+
+    def touch(self, path):
+        """Marca o arquivo como usado agora (vai para o fim da fila de remoção)"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry:
+                entry['last_access'] = time.time()
+                self._entries.move_to_end(path)
+
+    def pin(self, path):
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, path):
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    @contextmanager
+    def pinned(self, path):
+        """Impede a remoção do arquivo enquanto o bloco roda"""
+        self.pin(path)
+        try:
+            yield path
+        finally:
+            self.unpin(path)
+
+    def evict(self):
+        """Remove os arquivos menos usados (sem pin) até caber no limite; retorna quantos"""
+        victims = []
+        now = time.time()
+        with self._lock:
+            excess = self._total - self.max_bytes
+            for path, entry in self._entries.items():
+                if excess <= 0:
+                    break
+                if path in self._pins:
+                    continue
+                try:
+                    if now - os.path.getmtime(path) < EVICT_GRACE:
+                        continue
+                except OSError:
+                    pass
+                victims.append(path)
+                excess -= entry['size']
+            for path in victims:
+                self.evicted_bytes += self._entries[path]['size']
+                self.evictions += 1
+                self._forget(path)
+
+        for path in victims:
+            self._delete(path)
+        if victims:
+            print(f"🧹 Cache de downloads: {len(victims)} arquivo(s) removido(s) para caber em {self.max_bytes} bytes")
+        return len(victims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'pinned': len(self._pins),
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+    def _forget(self, path):
+        entry = self._entries.pop(path, None)
+        if entry:
+            self._total -= entry['size']
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"✗ Não foi possível remover {path}: {e}")
@@ -0,0 +1,171 @@
+"""Pool fixo de workers com fila limitada para os downloads, e vagas do streaming HD"""
+import os
+import threading
+import time
+from collections import deque
+from metrics import Gauge
+
+
+class QueueFullError(Exception):
+    """Fila de downloads cheia"""
+
+    def __init__(self, retry_after):
+        super().__init__("Fila de downloads cheia")
+        self.retry_after = retry_after
+
+
+class DownloadQueue:
+    """Executa os jobs em um número fixo de threads, com fila de tamanho máximo"""
+
+    def __init__(self, workers=2, max_queue=20):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        # Média móvel da duração dos jobs, usada para estimar o Retry-After
+        self._avg_duration = 60.0
+        # Chamado com os IDs ainda na fila (em ordem) sempre que ela anda
+        self.on_positions = None
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{i+1}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id, func, args = self._pending.popleft()
+                self._active += 1
+                waiting = [pending_id for pending_id, _, _ in self._pending]
+
+            if self.on_positions and waiting:
+                try:
+                    self.on_positions(waiting)
+                except Exception as e:
+                    print(f"✗ Erro ao atualizar posições da fila: {e}")
+
+            started = time.monotonic()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"✗ Job {job_id} terminou com erro não tratado: {e}")
+            finally:
+                elapsed = time.monotonic() - started
+                with self._cond:
+                    self._active -= 1
+                    self._completed += 1
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * elapsed
+
+    def retry_after(self):
+        """Estimativa (segundos) de quando haverá espaço na fila"""
+        with self._cond:
+            return self._retry_after()
+
+    def _retry_after(self):
+        # Com a fila cheia, o próximo espaço abre quando algum worker termina
+        return max(5, int(self._avg_duration / max(1, self.workers)))
+
+    def submit(self, job_id, func, *args):
+        """Enfileira um job e retorna sua posição na fila (1 = próximo)
+
+        Levanta QueueFullError se a fila já estiver no limite.
+        """
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self._retry_after())
+            self._ensure_workers()
+            self._pending.append((job_id, func, args))
+            position = len(self._pending)
+            self._cond.notify()
+            return position
+
+    def position(self, job_id):
+        """Posição atual do job na fila, ou None se já saiu dela"""
+        with self._cond:
+            for i, (pending_id, _, _) in enumerate(self._pending):
+                if pending_id == job_id:
+                    return i + 1
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': len(self._pending),
+                'active': self._active,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_job_seconds': round(self._avg_duration, 1)
+            }
+
+
+class StreamSlots:
+    """Vagas para muxes em tempo real (/stream_download), que não passam pela fila
+
+    Cada envio é um FFmpeg com duas conexões ao YouTube durante toda a
+    transferência; sem vaga, levanta QueueFullError (429 + Retry-After).
+    """
+
+    def __init__(self, slots=4, retry_after=30):
+        self.slots = slots
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._active = 0
+        self._served = 0
+        self._rejected = 0
+
+    def acquire(self):
+        """Ocupa uma vaga; retorna a função que a libera (pode ser chamada mais de uma vez)"""
+        with self._lock:
+            if self._active >= self.slots:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after)
+            self._active += 1
+            self._served += 1
+        released = []
+
+        def release():
+            with self._lock:
+                if not released:
+                    released.append(True)
+                    self._active -= 1
+
+        return release
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'active': self._active,
+                'served': self._served,
+                'rejected': self._rejected
+            }
+
+
+download_queue = DownloadQueue(
+    workers=int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+    max_queue=int(os.environ.get('DOWNLOAD_QUEUE_MAX', 20))
+)
+
+stream_slots = StreamSlots(
+    slots=int(os.environ.get('STREAM_MAX_CONCURRENT', 4)),
+    retry_after=int(os.environ.get('STREAM_RETRY_AFTER', 30))
+)
+
+# Estado da fila lido só na hora da coleta do /metrics
+Gauge('queue_depth', 'Jobs de download esperando na fila', function=lambda: download_queue.stats()['queued'])
+Gauge('active_jobs', 'Jobs de download em execução', function=lambda: download_queue.stats()['active'])
+Gauge('active_streams', 'Muxes em tempo real (/stream_download) em andamento', function=lambda: stream_slots.stats()['active'])
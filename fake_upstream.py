@@ -0,0 +1,410 @@
+"""YouTube/googlevideo falsos e locais, para medir o app sem acessar a internet
+
+O servidor responde aos metadados (/player) e entrega os bytes dos streams
+(/videoplayback, com Range) com latência, limite de banda por conexão e
+injeção de 403/429 ajustáveis em tempo de execução (`server.config`).
+FakeYouTube tem a parte da interface do pytubefix usada pelo app (title,
+streams.filter(...), Stream.download...), com as URLs apontando para cá.
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import urlopen
+from video_cache import extract_video_id
+
+CHUNK_SIZE = 64 * 1024
+
+# Mesmos itags do YouTube: progressivos 18/22, vídeo adaptivo 136/137, áudio 140
+CATALOG = {
+    18: {'type': 'progressive', 'resolution': '360p', 'abr': '96kbps', 'size': '640x360', 'video_bitrate': '1M'},
+    22: {'type': 'progressive', 'resolution': '720p', 'abr': '128kbps', 'size': '1280x720', 'video_bitrate': '3M'},
+    136: {'type': 'video', 'resolution': '720p', 'abr': None, 'size': '1280x720', 'video_bitrate': '4M'},
+    137: {'type': 'video', 'resolution': '1080p', 'abr': None, 'size': '1920x1080', 'video_bitrate': '8M'},
+    140: {'type': 'audio', 'resolution': None, 'abr': '128kbps', 'size': None, 'video_bitrate': None},
+}
+
+
+class UpstreamConfig:
+    """Comportamento do upstream falso; alterável entre cenários (e durante eles)"""
+
+    def __init__(self, **kwargs):
+        self.player_latency = 0.05
+        self.stream_latency = 0.02
+        # Bytes/s por conexão (0 = sem limite)
+        self.bandwidth = 0
+        self.player_403_rate = 0.0
+        self.player_429_rate = 0.0
+        self.stream_403_rate = 0.0
+        self.stream_429_rate = 0.0
+        # Itags sempre bloqueados com 403 (ex.: HD bloqueado, para a escada de fallback)
+        self.blocked_itags = set()
+        self.seed = 1
+        self.update(**kwargs)
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError(f"Opção desconhecida do upstream falso: {key}")
+            setattr(self, key, set(value) if key == 'blocked_itags' else value)
+        return self
+
+    def as_dict(self):
+        return {key: sorted(value) if isinstance(value, set) else value for key, value in vars(self).items()}
+
+
+def build_media(directory, duration=10, ffmpeg_path=None):
+    """Gera os arquivos de cada itag; com FFmpeg são MP4 válidos (o mux funciona de verdade)
+
+    Sem FFmpeg, bytes aleatórios com o tamanho equivalente ao bitrate.
+    """
+    media = {}
+    for itag, info in CATALOG.items():
+        path = os.path.join(directory, f"{itag}.mp4")
+        if ffmpeg_path:
+            command = [ffmpeg_path, '-y', '-loglevel', 'error']
+            if info['type'] != 'audio':
+                command += ['-f', 'lavfi', '-i', f"testsrc2=size={info['size']}:rate=30"]
+            if info['type'] != 'video':
+                command += ['-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100']
+            command += ['-t', str(duration)]
+            if info['type'] != 'audio':
+                command += ['-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', info['video_bitrate'], '-pix_fmt', 'yuv420p']
+            if info['type'] != 'video':
+                command += ['-c:a', 'aac', '-b:a', '128k']
+            command += ['-f', 'mp4', path]
+            subprocess.run(command, check=True, capture_output=True)
+        else:
+            bitrate = int((info['video_bitrate'] or '0M')[:-1]) * 1_000_000 + (128_000 if info['type'] != 'video' else 0)
+            remaining = bitrate // 8 * duration
+            with open(path, 'wb') as f:
+                while remaining > 0:
+                    block = os.urandom(min(remaining, 1024 * 1024))
+                    f.write(block)
+                    remaining -= len(block)
+        media[itag] = dict(info, itag=itag, path=path, filesize=os.path.getsize(path))
+    return media
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.upstream
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path == '/player':
+            server.count('player')
+            self._player(server, query)
+        elif parts.path == '/videoplayback':
+            server.count('videoplayback')
+            self._videoplayback(server, query)
+        else:
+            self._error(404)
+
+    def _error(self, code, retry_after=None):
+        self.server.upstream.count(f"status_{code}")
+        body = f"HTTP {code}".encode()
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject(self, server, rate_403, rate_429):
+        """Sorteia um erro injetado; retorna True se respondeu com erro"""
+        roll = server.roll()
+        if roll < rate_403:
+            self._error(403)
+            return True
+        if roll < rate_403 + rate_429:
+            self._error(429, retry_after=1)
+            return True
+        return False
+
+    def _player(self, server, query):
+        config = server.config
+        time.sleep(config.player_latency)
+        if self._inject(server, config.player_403_rate, config.player_429_rate):
+            return
+        video_id = query.get('v', '')
+        streams = [
+            {key: media[key] for key in ('itag', 'type', 'resolution', 'abr', 'filesize')}
+            for media in server.media.values()
+        ]
+        body = json.dumps({
+            'video_id': video_id,
+            'title': f"Benchmark {video_id}",
+            'author': 'fake_upstream',
+            'length': server.duration,
+            'views': 1234,
+            'description': 'Vídeo sintético do benchmark',
+            'thumbnail_url': f"{server.base_url}/thumbnail/{video_id}.jpg",
+            'streams': streams
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _videoplayback(self, server, query):
+        config = server.config
+        time.sleep(config.stream_latency)
+        media = server.media.get(int(query.get('itag', 0)))
+        if media is None:
+            self._error(404)
+            return
+        if media['itag'] in config.blocked_itags:
+            self._error(403)
+            return
+        if self._inject(server, config.stream_403_rate, config.stream_429_rate):
+            return
+
+        filesize = media['filesize']
+        start, end = 0, filesize - 1
+        header = self.headers.get('Range')
+        if header and header.startswith('bytes='):
+            first, _, last = header[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), filesize - 1) if last else filesize - 1
+            if start >= filesize or start > end:
+                self._error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{filesize}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        sent = 0
+        started = time.monotonic()
+        try:
+            with open(media['path'], 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    # Contado antes de enviar: o cliente nunca termina antes do contador
+                    server.count('bytes_sent', len(chunk))
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    sent += len(chunk)
+                    if config.bandwidth:
+                        ahead = sent / config.bandwidth - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cliente fechou a conexão keep-alive (fim do download, cancelamento): não é erro
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+class FakeUpstream:
+    """Servidor HTTP local (thread própria) com os metadados e os bytes dos streams"""
+
+    def __init__(self, duration=10, ffmpeg_path=None, **config):
+        self.duration = duration
+        self.config = UpstreamConfig(**config)
+        self._directory = tempfile.mkdtemp(prefix='fake_upstream_')
+        self.media = build_media(self._directory, duration, ffmpeg_path)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._random = random.Random(self.config.seed)
+        self._httpd = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._httpd = _Server(('127.0.0.1', 0), _Handler)
+        self._httpd.upstream = self
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self, **config):
+        """Zera os contadores e aplica a configuração de um novo cenário"""
+        with self._lock:
+            self._counters = {}
+        self.config = UpstreamConfig(**config)
+        self._random = random.Random(self.config.seed)
+
+
+class FakeStream:
+    """Stream com os atributos do pytubefix usados pelo app"""
+
+    _signatures = count(1)
+
+    def __init__(self, info, base_url, video_id, youtube):
+        self.itag = info['itag']
+        self.type = 'audio' if info['type'] == 'audio' else 'video'
+        self.resolution = info['resolution']
+        self.abr = info['abr']
+        self.filesize = info['filesize']
+        self.subtype = 'mp4'
+        self.mime_type = f"{self.type}/mp4"
+        self.is_progressive = info['type'] == 'progressive'
+        self.is_adaptive = not self.is_progressive
+        self.includes_video_track = info['type'] != 'audio'
+        self.includes_audio_track = info['type'] != 'video'
+        # Assinatura nova a cada resolução, como as URLs assinadas do YouTube
+        self.url = f"{base_url}/videoplayback?" + urlencode({'v': video_id, 'itag': self.itag, 'sig': next(self._signatures)})
+        self._youtube = youtube
+
+    def download(self, output_path=None, filename=None, filename_prefix=None, skip_existing=True, timeout=None,
+                 max_retries=0, interrupt_checker=None):
+        filepath = os.path.join(output_path or '.', (filename_prefix or '') + (filename or f"{self.itag}.mp4"))
+        if skip_existing and os.path.exists(filepath) and os.path.getsize(filepath) == self.filesize:
+            return filepath
+        remaining = self.filesize
+        with urlopen(self.url, timeout=timeout or 30) as response, open(filepath, 'wb') as f:
+            while True:
+                if interrupt_checker and interrupt_checker():
+                    return None
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+                if self._youtube.on_progress:
+                    self._youtube.on_progress(self, chunk, remaining)
+        return filepath
+
+
+class FakeStreamQuery:
+    """Subconjunto do StreamQuery do pytubefix (filter, order_by, first...)"""
+
+    def __init__(self, streams):
+        self._streams = list(streams)
+
+    def filter(self, progressive=None, adaptive=None, only_video=None, only_audio=None, file_extension=None,
+               res=None, resolution=None, type=None, subtype=None):
+        result = self._streams
+        if progressive is not None:
+            result = [s for s in result if s.is_progressive == progressive]
+        if adaptive is not None:
+            result = [s for s in result if s.is_adaptive == adaptive]
+        if only_video:
+            result = [s for s in result if s.includes_video_track and not s.includes_audio_track]
+        if only_audio:
+            result = [s for s in result if s.includes_audio_track and not s.includes_video_track]
+        if file_extension or subtype:
+            result = [s for s in result if s.subtype == (file_extension or subtype)]
+        if res or resolution:
+            result = [s for s in result if s.resolution == (res or resolution)]
+        if type:
+            result = [s for s in result if s.type == type]
+        return FakeStreamQuery(result)
+
+    def order_by(self, attribute_name):
+        present = [s for s in self._streams if getattr(s, attribute_name) is not None]
+        return FakeStreamQuery(sorted(present, key=lambda s: int(''.join(filter(str.isdigit, str(getattr(s, attribute_name)))) or 0)))
+
+    def desc(self):
+        return FakeStreamQuery(reversed(self._streams))
+
+    def asc(self):
+        return self
+
+    def first(self):
+        return self._streams[0] if self._streams else None
+
+    def last(self):
+        return self._streams[-1] if self._streams else None
+
+    def get_by_itag(self, itag):
+        return next((s for s in self._streams if s.itag == int(itag)), None)
+
+    def __iter__(self):
+        return iter(self._streams)
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __getitem__(self, index):
+        return self._streams[index]
+
+
+class FakeYouTube:
+    """Objeto YouTube falso: busca os metadados no servidor local (403/429 viram HTTPError)"""
+
+    def __init__(self, url, base_url, client=None):
+        self.video_id = extract_video_id(url)
+        self.client = client
+        self.on_progress = None
+        with urlopen(f"{base_url}/player?" + urlencode({'v': self.video_id, 'client': client or 'DEFAULT'}), timeout=30) as response:
+            data = json.load(response)
+        self.title = data['title']
+        self.author = data['author']
+        self.length = data['length']
+        self.views = data['views']
+        self.description = data['description']
+        self.thumbnail_url = data['thumbnail_url']
+        self.streams = FakeStreamQuery(FakeStream(info, base_url, self.video_id, self) for info in data['streams'])
+        # Manifesto no formato do pytubefix (contentLength por itag, usado pela tabela de streams)
+        self.streaming_data = {
+            'formats': [{'itag': s.itag, 'contentLength': str(s.filesize)} for s in self.streams if s.is_progressive],
+            'adaptiveFormats': [{'itag': s.itag, 'contentLength': str(s.filesize)} for s in self.streams if s.is_adaptive]
+        }
+
+    def register_on_progress_callback(self, func):
+        self.on_progress = func
+
+
+def fake_strategy_factories(base_url, names):
+    """Fábricas no formato de youtube_client.STRATEGY_FACTORIES apontando para o servidor local"""
+    return {name: (lambda url, name=name: FakeYouTube(url, base_url, client=name)) for name in names}
+
+
+if __name__ == '__main__':
+    server = FakeUpstream().start()
+    print(f"Upstream falso em {server.base_url} (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
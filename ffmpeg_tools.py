@@ -0,0 +1,218 @@
+"""Utilitários de FFmpeg (combinação de vídeo e áudio)"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+from metrics import MUX_SECONDS
+from tracing import span
+
+# Recursos do FFmpeg que o app usa: remux para MP4, entrada MP4/WebM e HTTPS (streaming)
+REQUIRED_MUXERS = ('mp4',)
+REQUIRED_DEMUXERS = ('mov', 'matroska')
+REQUIRED_CODECS = ('h264', 'aac', 'opus', 'vp9')
+REQUIRED_PROTOCOLS = ('https',)
+
+# Executável do FFmpeg (nome no PATH ou caminho completo)
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def _run_ffmpeg_info(path, *args):
+    """Executa `ffmpeg -hide_banner <args>` e retorna o stdout"""
+    result = subprocess.run([path, '-hide_banner', *args], capture_output=True, text=True, timeout=10, check=True)
+    return result.stdout
+
+
+def _parse_format_list(output):
+    """Nomes listados por -muxers/-demuxers/-codecs (após a linha "--")"""
+    names = set()
+    started = False
+    for line in output.splitlines():
+        if not started:
+            started = line.strip().startswith('--')
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            names.update(parts[1].split(','))
+    return names
+
+
+def _parse_protocols(output):
+    """Protocolos de entrada listados por -protocols"""
+    names = set()
+    section = None
+    for line in output.splitlines():
+        stripped = line.strip()
+        if stripped.endswith(':'):
+            section = stripped[:-1].lower()
+        elif stripped and section == 'input':
+            names.add(stripped)
+    return names
+
+
+def probe_ffmpeg():
+    """Verifica (uma vez) caminho, versão e recursos do FFmpeg e guarda o resultado"""
+    global _capabilities
+    path = shutil.which(FFMPEG_PATH)
+    info = {
+        'available': False,
+        'path': path,
+        'version': None,
+        'muxers': {},
+        'demuxers': {},
+        'codecs': {},
+        'protocols': {},
+        'can_mux': False,
+        'can_stream': False,
+        'error': None,
+        'probed_at': time.time()
+    }
+
+    if path is None:
+        info['error'] = f'ffmpeg não encontrado ({FFMPEG_PATH})'
+    else:
+        try:
+            version_line = _run_ffmpeg_info(path, '-version').splitlines()[0]
+            info['version'] = version_line.split()[2] if version_line.startswith('ffmpeg version') else version_line
+            muxers = _parse_format_list(_run_ffmpeg_info(path, '-muxers'))
+            demuxers = _parse_format_list(_run_ffmpeg_info(path, '-demuxers'))
+            codecs = _parse_format_list(_run_ffmpeg_info(path, '-codecs'))
+            protocols = _parse_protocols(_run_ffmpeg_info(path, '-protocols'))
+            info['muxers'] = {name: name in muxers for name in REQUIRED_MUXERS}
+            info['demuxers'] = {name: name in demuxers for name in REQUIRED_DEMUXERS}
+            info['codecs'] = {name: name in codecs for name in REQUIRED_CODECS}
+            info['protocols'] = {name: name in protocols for name in REQUIRED_PROTOCOLS}
+            info['available'] = True
+            info['can_mux'] = all(info['muxers'].values()) and all(info['demuxers'].values())
+            info['can_stream'] = info['can_mux'] and all(info['protocols'].values())
+        except (subprocess.SubprocessError, OSError, IndexError) as e:
+            info['error'] = str(e)
+
+    with _capabilities_lock:
+        _capabilities = info
+    return info
+
+
+def get_ffmpeg_capabilities(reprobe=False):
+    """Resultado da verificação do FFmpeg (faz a verificação na primeira chamada ou se `reprobe`)"""
+    with _capabilities_lock:
+        cached = _capabilities
+    if cached is None or reprobe:
+        return probe_ffmpeg()
+    return cached
+
+
+def check_ffmpeg():
+    """FFmpeg disponível e capaz de combinar vídeo e áudio em MP4 (sem novo subprocesso)"""
+    return get_ffmpeg_capabilities()['can_mux']
+
+
+def check_ffmpeg_streaming():
+    """FFmpeg capaz de remuxar direto das URLs HTTPS (modo streaming)"""
+    return get_ffmpeg_capabilities()['can_stream']
+
+
+def ffmpeg_executable():
+    """Caminho do FFmpeg encontrado na verificação (o mesmo que ela testou)"""
+    return get_ffmpeg_capabilities()['path'] or FFMPEG_PATH
+
+
+def mux_files(video_path, audio_path, output_path, on_progress=None):
+    """Combina vídeo e áudio sem recodificar (-c copy)
+
+    Se `on_progress` for informado, recebe o total de bytes já escritos,
+    lido da saída `-progress` do FFmpeg. A duração entra em MUX_SECONDS.
+    """
+    started = time.monotonic()
+    with span('mux', output=os.path.basename(output_path)):
+        try:
+            result = _mux_files(video_path, audio_path, output_path, on_progress)
+        except Exception:
+            MUX_SECONDS.observe(time.monotonic() - started, outcome='error')
+            raise
+    MUX_SECONDS.observe(time.monotonic() - started, outcome='ok')
+    return result
+
+
+def _mux_files(video_path, audio_path, output_path, on_progress):
+    ffmpeg_cmd = [
+        ffmpeg_executable(), '-y',
+        '-i', video_path,
+        '-i', audio_path,
+        '-c', 'copy',
+        output_path
+    ]
+
+    if on_progress is None:
+        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+        return output_path
+
+    # -loglevel error mantém o stderr pequeno (não é lido até o fim do processo)
+    ffmpeg_cmd[1:1] = ['-loglevel', 'error', '-nostats', '-progress', 'pipe:1']
+    process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'total_size' and value.isdigit():
+                on_progress(int(value))
+    finally:
+        stderr = process.stderr.read()
+        process.wait()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ffmpeg_cmd, stderr=stderr)
+
+    if os.path.exists(output_path):
+        on_progress(os.path.getsize(output_path))
+    return output_path
+
+
+def stream_mux(video_url, audio_url, tee_path=None, chunk_size=64 * 1024):
+    """Remuxa vídeo e áudio direto das URLs em MP4 fragmentado, gerando os bytes da saída
+
+    Nada é gravado em disco, exceto a cópia opcional em `tee_path` (gravada
+    como .part e renomeada só se o FFmpeg terminar com sucesso). Se o
+    consumidor parar de ler (cliente desconectou), o FFmpeg é encerrado.
+    """
+    reconnect = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    ffmpeg_cmd = [
+        ffmpeg_executable(), '-loglevel', 'error', '-nostdin',
+        *reconnect, '-i', video_url,
+        *reconnect, '-i', audio_url,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c', 'copy',
+        '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-f', 'mp4', 'pipe:1'
+    ]
+
+    process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    part_path = f"{tee_path}.part" if tee_path else None
+    tee = open(part_path, 'wb') if part_path else None
+    completed = False
+    try:
+        while True:
+            chunk = process.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            if tee:
+                tee.write(chunk)
+            yield chunk
+
+        process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, ffmpeg_cmd)
+        completed = True
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        if tee:
+            tee.close()
+            if completed:
+                os.replace(part_path, tee_path)
+            elif os.path.exists(part_path):
+                os.remove(part_path)
@@ -0,0 +1,54 @@
+"""Envio dos arquivos baixados: Range/If-Range, ETag forte e delegação ao proxy"""
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import Response, send_file
+from werkzeug.datastructures import Headers
+from werkzeug.http import quote_etag
+
+# direct: o Flask envia o arquivo (com suporte a Range)
+# x-accel: nginx envia (X-Accel-Redirect para uma location internal)
+# x-sendfile: Apache/lighttpd enviam (X-Sendfile com o caminho absoluto)
+FILE_SERVING_MODE = os.environ.get('FILE_SERVING_MODE', 'direct')
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads/')
+
+
+def file_etag(filepath):
+    """ETag forte a partir de inode, tamanho e mtime (muda sempre que o conteúdo muda)"""
+    st = os.stat(filepath)
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def offload_headers(filepath, download_name, base_dir):
+    """Cabeçalhos para o proxy enviar o arquivo (modos x-accel e x-sendfile)"""
+    headers = Headers()
+    if FILE_SERVING_MODE == 'x-accel':
+        relative = os.path.relpath(filepath, base_dir).replace(os.sep, '/')
+        headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+    else:
+        headers['X-Sendfile'] = os.path.abspath(filepath)
+    # filename* (RFC 5987) para nomes fora do ASCII, como o send_file faz
+    ascii_name = download_name.encode('ascii', 'ignore').decode().replace('"', '') or 'download'
+    headers['Content-Disposition'] = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(download_name)}"
+    headers['Accept-Ranges'] = 'bytes'
+    headers['ETag'] = quote_etag(file_etag(filepath))
+    return headers
+
+
+def serve_download(filepath, download_name, base_dir):
+    """Responde com o arquivo como anexo, no modo configurado"""
+    if FILE_SERVING_MODE in ('x-accel', 'x-sendfile'):
+        # O proxy lê o arquivo e trata Range; o worker Python é liberado na hora
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        return Response(status=200, mimetype=mimetype, headers=offload_headers(filepath, download_name, base_dir))
+
+    # conditional=True: responde 206 para Range, 304 para If-None-Match e respeita If-Range
+    response = send_file(
+        filepath,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=file_etag(filepath)
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
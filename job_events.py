@@ -0,0 +1,32 @@
+"""Notificação de mudanças de status dos jobs (usado pelo endpoint SSE)"""
+import threading
+
+
+class JobEvents:
+    """Contador de versão por job com espera bloqueante até a próxima mudança"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versions = {}
+
+    def notify(self, job_id):
+        with self._cond:
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            self._cond.notify_all()
+
+    def version(self, job_id):
+        with self._cond:
+            return self._versions.get(job_id, 0)
+
+    def wait(self, job_id, last_version, timeout=None):
+        """Espera a versão do job passar de `last_version` e retorna a versão atual"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(job_id, 0) != last_version, timeout=timeout)
+            return self._versions.get(job_id, 0)
+
+    def forget(self, job_id):
+        with self._cond:
+            self._versions.pop(job_id, None)
+
+
+job_events = JobEvents()
@@ -0,0 +1,86 @@
+"""Deduplicação de jobs de download por (vídeo, resolução, tipo)"""
+import json
+import os
+import threading
+from job_store import JOB_STORE, JOB_STORE_PATH, connect
+
+# Por quanto tempo um arquivo concluído é reaproveitado para novos pedidos
+COMPLETED_REUSE_TTL = int(os.environ.get('COMPLETED_REUSE_TTL', 3600))
+
+
+class JobRegistry:
+    """Single-flight: um job por chave enquanto estiver rodando ou com arquivo válido"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def claim(self, key, job_id, is_reusable):
+        """Registra `job_id` para a chave, a menos que já exista um job reaproveitável
+
+        `is_reusable(existing_id)` decide se o job existente ainda serve (em
+        andamento ou concluído com arquivo válido). Retorna (job_id, criado).
+        """
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None and is_reusable(existing):
+                return existing, False
+            self._jobs[key] = job_id
+            return job_id, True
+
+    def release(self, job_id):
+        """Esquece o job (ex.: falhou), permitindo que o próximo pedido comece de novo"""
+        with self._lock:
+            for key, current in list(self._jobs.items()):
+                if current == job_id:
+                    del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._jobs)}
+
+
+class SQLiteJobRegistry:
+    """Mesma interface do JobRegistry, com as chaves no SQLite compartilhado entre workers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = connect(path)
+        conn.execute('CREATE TABLE IF NOT EXISTS job_keys (key TEXT PRIMARY KEY, job_id TEXT NOT NULL)')
+        conn.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key, job_id, is_reusable):
+        """Registra `job_id` para a chave (atômico entre workers); retorna (job_id, criado)"""
+        conn = self._conn()
+        encoded = json.dumps(list(key))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT job_id FROM job_keys WHERE key = ?', (encoded,)).fetchone()
+            if row is not None and is_reusable(row[0]):
+                conn.execute('COMMIT')
+                return row[0], False
+            conn.execute('INSERT OR REPLACE INTO job_keys (key, job_id) VALUES (?, ?)', (encoded, job_id))
+            conn.execute('COMMIT')
+            return job_id, True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, job_id):
+        """Esquece o job (ex.: falhou), permitindo que o próximo pedido comece de novo"""
+        self._conn().execute('DELETE FROM job_keys WHERE job_id = ?', (job_id,))
+
+    def stats(self):
+        row = self._conn().execute('SELECT COUNT(*) FROM job_keys').fetchone()
+        return {'keys': row[0]}
+
+
+job_registry = SQLiteJobRegistry(JOB_STORE_PATH) if JOB_STORE == 'sqlite' else JobRegistry()
@@ -0,0 +1,236 @@
+"""Armazenamento do status dos jobs: em memória ou SQLite (compartilhado entre workers)"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from job_events import job_events
+
+# memory: só o próprio processo enxerga (1 worker)
+# sqlite: arquivo em modo WAL, compartilhado por todos os workers do servidor
+JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3'))
+
+# Intervalo de verificação de mudanças feitas por outros workers (SSE)
+POLL_INTERVAL = 0.25
+
+
+def connect(path):
+    """Abre conexão SQLite em autocommit e modo WAL"""
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class JobHandle(MutableMapping):
+    """Visão de um job no store: leituras atualizadas e escritas repassadas ao backend"""
+
+    def __init__(self, store, job_id):
+        self._store = store
+        self._job_id = job_id
+
+    def _data(self):
+        data = self._store.read(self._job_id)
+        if data is None:
+            raise KeyError(self._job_id)
+        return data
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __setitem__(self, key, value):
+        self._store.write(self._job_id, {key: value})
+
+    def __delitem__(self, key):
+        raise TypeError("Campos de status não podem ser removidos")
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+    def update(self, *args, **kwargs):
+        """Grava vários campos de uma vez (uma única escrita no backend)"""
+        self._store.write(self._job_id, dict(*args, **kwargs))
+
+    def copy(self):
+        """Cópia do status atual (uma única leitura no backend)"""
+        return self._data()
+
+
+class MemoryJobStore:
+    """Status dos jobs em um dict do processo"""
+
+    def __init__(self, events=job_events):
+        self._events = events
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def __getitem__(self, job_id):
+        if job_id not in self:
+            raise KeyError(job_id)
+        return JobHandle(self, job_id)
+
+    def __setitem__(self, job_id, fields):
+        with self._lock:
+            self._jobs[job_id] = (dict(fields), time.time())
+        self._events.notify(job_id)
+
+    def get(self, job_id, default=None):
+        return self[job_id] if job_id in self else default
+
+    def pop(self, job_id, default=None):
+        with self._lock:
+            item = self._jobs.pop(job_id, None)
+        self._events.forget(job_id)
+        return item[0] if item else default
+
+    def read(self, job_id):
+        with self._lock:
+            item = self._jobs.get(job_id)
+            return dict(item[0]) if item else None
+
+    def write(self, job_id, fields):
+        with self._lock:
+            item = self._jobs.get(job_id)
+            if item is None:
+                raise KeyError(job_id)
+            item[0].update(fields)
+            self._jobs[job_id] = (item[0], time.time())
+        self._events.notify(job_id)
+
+    def version(self, job_id):
+        return self._events.version(job_id)
+
+    def wait_for_change(self, job_id, last_version, timeout=None):
+        """Espera o job mudar desde `last_version`; retorna a versão atual"""
+        return self._events.wait(job_id, last_version, timeout=timeout)
+
+    def purge(self, older_than):
+        """Remove jobs sem atualização há mais de `older_than` segundos"""
+        limit = time.time() - older_than
+        with self._lock:
+            expired = [job_id for job_id, (_, updated) in self._jobs.items() if updated < limit]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for job_id in expired:
+            self._events.forget(job_id)
+        return len(expired)
+
+
+class SQLiteJobStore:
+    """Status dos jobs em SQLite (WAL): todos os workers leem e escrevem o mesmo arquivo"""
+
+    def __init__(self, path, events=job_events):
+        self.path = path
+        self._events = events
+        self._local = threading.local()
+        # Conexão só para criar o schema; cada thread (e cada worker após o fork) abre a sua
+        conn = connect(path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def __contains__(self, job_id):
+        row = self._conn().execute('SELECT 1 FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, job_id):
+        if job_id not in self:
+            raise KeyError(job_id)
+        return JobHandle(self, job_id)
+
+    def __setitem__(self, job_id, fields):
+        self._conn().execute(
+            'INSERT INTO jobs (id, data, version, updated_at) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT(id) DO UPDATE SET data = excluded.data, version = version + 1, updated_at = excluded.updated_at',
+            (job_id, json.dumps(fields), time.time())
+        )
+        self._events.notify(job_id)
+
+    def get(self, job_id, default=None):
+        return self[job_id] if job_id in self else default
+
+    def pop(self, job_id, default=None):
+        data = self.read(job_id)
+        self._conn().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        self._events.forget(job_id)
+        return data if data is not None else default
+
+    def read(self, job_id):
+        row = self._conn().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write(self, job_id, fields):
+        conn = self._conn()
+        # BEGIN IMMEDIATE: leitura + escrita atômicas entre workers
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            data = json.loads(row[0])
+            data.update(fields)
+            conn.execute(
+                'UPDATE jobs SET data = ?, version = version + 1, updated_at = ? WHERE id = ?',
+                (json.dumps(data), time.time(), job_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._events.notify(job_id)
+
+    def version(self, job_id):
+        row = self._conn().execute('SELECT version FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def wait_for_change(self, job_id, last_version, timeout=None):
+        """Espera o job mudar desde `last_version`; retorna a versão atual
+
+        Mudanças do próprio worker acordam na hora; as de outros workers são
+        vistas na próxima verificação (POLL_INTERVAL).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        local_version = self._events.version(job_id)
+        while True:
+            current = self.version(job_id)
+            if current != last_version:
+                return current
+            remaining = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            if remaining <= 0:
+                return current
+            local_version = self._events.wait(job_id, local_version, timeout=remaining)
+
+    def purge(self, older_than):
+        """Remove jobs sem atualização há mais de `older_than` segundos"""
+        cursor = self._conn().execute('DELETE FROM jobs WHERE updated_at < ?', (time.time() - older_than,))
+        return cursor.rowcount
+
+
+def create_job_store():
+    """Cria o store configurado em JOB_STORE"""
+    if JOB_STORE == 'sqlite':
+        print(f"Status dos jobs em SQLite compartilhado: {JOB_STORE_PATH}")
+        return SQLiteJobStore(JOB_STORE_PATH)
+    return MemoryJobStore()
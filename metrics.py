@@ -0,0 +1,165 @@
+"""Métricas no formato de texto do Prometheus (/metrics), sem dependências externas
+
+Contadores, gauges e histogramas com labels, baratos o bastante para ficarem
+sempre ligados: cada observação é um lock e uma busca binária nos buckets.
+Os valores são do processo; com vários workers, cada um expõe os seus.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+PREFIX = 'ytdl_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Valor que só cresce (exposto com o sufixo _total)"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Valor instantâneo; com `function`, lido só na hora da coleta (sem custo no caminho quente)"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self._function = function
+
+    def set(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribuição em buckets cumulativos (_bucket, _sum, _count)"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items()]
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+def render_metrics():
+    """Texto de todas as métricas registradas, no formato de exposição do Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Métricas do caminho quente (os módulos instrumentados importam daqui)
+STRATEGY_ATTEMPT_SECONDS = Histogram(
+    'strategy_attempt_seconds', 'Duração de cada tentativa de estratégia (cliente) do YouTube',
+    labels=('client', 'outcome'), buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+VIDEO_INFO_SECONDS = Histogram(
+    'video_info_seconds', 'Tempo de /get_video_info de ponta a ponta',
+    labels=('outcome',), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+DOWNLOAD_BYTES = Counter(
+    'download_bytes', 'Bytes baixados do YouTube por tipo de stream', labels=('part',))
+DOWNLOAD_THROUGHPUT = Histogram(
+    'download_throughput_bytes_per_second', 'Velocidade média de cada transferência concluída, por tipo de stream',
+    labels=('part',), buckets=(64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6))
+MUX_SECONDS = Histogram(
+    'mux_seconds', 'Duração do mux de vídeo e áudio pelo FFmpeg',
+    labels=('outcome',), buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+FALLBACK_STEPS = Counter(
+    'fallback_steps', 'Degraus da escada de fallback do HD tentados', labels=('step', 'resolution', 'outcome'))
+RETRIES = Counter(
+    'retries', 'Novas tentativas pela política de retry, por operação e tipo de erro', labels=('operation', 'kind'))
+SPECULATIVE_JOBS = Counter(
+    'speculative_jobs', 'Downloads especulativos por desfecho (started, hit, miss, expired, skipped)', labels=('outcome',))
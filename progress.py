@@ -0,0 +1,178 @@
+"""Progresso real (bytes, velocidade, ETA) dos downloads, publicado no status do job"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT
+
+# Intervalo mínimo entre publicações no status (evita escrever a cada chunk)
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_UPDATE_INTERVAL', 0.5))
+
+# Partes de cada etapa do job; o peso da etapa entra no percentual geral
+STAGE_OF_PART = {'video': 'download', 'audio': 'download', 'stream': 'download', 'mux': 'mux'}
+STAGE_WEIGHTS = {'download': 0.9, 'mux': 0.1}
+
+_local = threading.local()
+
+
+def dispatch_progress(stream, chunk, bytes_remaining):
+    """Callback registrado no pytubefix: repassa o chunk ao progresso da thread atual
+
+    O objeto YouTube é compartilhado (cache), então o destino é escolhido pela
+    thread que está baixando, não pelo objeto.
+    """
+    transfer = getattr(_local, 'transfer', None)
+    if transfer is not None:
+        transfer.advance(len(chunk))
+
+
+def current_transfer():
+    """Parte sendo acompanhada na thread atual (ou None)"""
+    return getattr(_local, 'transfer', None)
+
+
+@contextmanager
+def tracking(transfer):
+    """Direciona os chunks baixados nesta thread para `transfer`"""
+    previous = getattr(_local, 'transfer', None)
+    _local.transfer = transfer
+    try:
+        yield transfer
+    finally:
+        _local.transfer = previous
+
+
+class Transfer:
+    """Uma parte do job (vídeo, áudio, mux) sendo acompanhada"""
+
+    def __init__(self, job, part):
+        self.job = job
+        self.part = part
+
+    def advance(self, nbytes):
+        self.job.advance(self.part, nbytes)
+
+    def set(self, bytes_done):
+        self.job.set(self.part, bytes_done)
+
+
+class JobProgress:
+    """Agrega o progresso das partes de um job e publica no status com taxa limitada"""
+
+    def __init__(self, publish, stages=('download',), interval=PROGRESS_INTERVAL, on_bytes=None):
+        self._publish = publish
+        # Chamado a cada chunk antes de contar (limite de banda, cancelamento por exceção)
+        self._on_bytes = on_bytes
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._parts = {}
+        self._last_publish = 0.0
+        total_weight = sum(STAGE_WEIGHTS[s] for s in stages)
+        self._weights = {s: STAGE_WEIGHTS[s] / total_weight for s in stages}
+
+    @contextmanager
+    def transfer(self, part, total_bytes):
+        """Registra uma parte; os chunks baixados nesta thread dentro do bloco contam para ela"""
+        now = time.monotonic()
+        with self._lock:
+            self._parts[part] = {
+                'bytes_done': 0,
+                'total_bytes': total_bytes or 0,
+                'started': now,
+                'last_sample': (now, 0),
+                'speed': 0.0,
+                'last_byte_at': time.time(),
+                'done': False
+            }
+        with tracking(Transfer(self, part)) as transfer:
+            yield transfer
+        self.finish(part)
+        self._observe(part, time.monotonic() - now)
+
+    def _observe(self, part, elapsed):
+        """Bytes e velocidade média da parte concluída (mux fica de fora: não é download)"""
+        if STAGE_OF_PART.get(part) != 'download':
+            return
+        with self._lock:
+            nbytes = self._parts[part]['bytes_done']
+        if nbytes:
+            DOWNLOAD_BYTES.inc(nbytes, part=part)
+            if elapsed > 0:
+                DOWNLOAD_THROUGHPUT.observe(nbytes / elapsed, part=part)
+
+    def advance(self, part, nbytes):
+        if self._on_bytes is not None:
+            self._on_bytes(nbytes)
+        with self._lock:
+            info = self._parts[part]
+            info['bytes_done'] += nbytes
+            info['last_byte_at'] = time.time()
+        self._maybe_publish()
+
+    def set(self, part, bytes_done):
+        with self._lock:
+            info = self._parts[part]
+            if bytes_done != info['bytes_done']:
+                info['bytes_done'] = bytes_done
+                info['last_byte_at'] = time.time()
+        self._maybe_publish()
+
+    def finish(self, part):
+        with self._lock:
+            info = self._parts.get(part)
+            if info:
+                info['done'] = True
+                if info['bytes_done'] > info['total_bytes']:
+                    info['total_bytes'] = info['bytes_done']
+        self._maybe_publish(force=True)
+
+    def _maybe_publish(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_publish < self._interval:
+                return
+            self._last_publish = now
+            fields = self._snapshot(now)
+        self._publish(fields)
+
+    def _snapshot(self, now):
+        transfers = {}
+        stage_done = {}
+        stage_total = {}
+        for part, info in self._parts.items():
+            # Velocidade suavizada a partir da amostra anterior
+            sample_time, sample_bytes = info['last_sample']
+            elapsed = now - sample_time
+            if elapsed > 0:
+                instant = (info['bytes_done'] - sample_bytes) / elapsed
+                info['speed'] = instant if not info['speed'] else 0.7 * info['speed'] + 0.3 * instant
+                info['last_sample'] = (now, info['bytes_done'])
+
+            remaining = max(0, info['total_bytes'] - info['bytes_done'])
+            eta = None
+            if info['done']:
+                eta = 0
+            elif info['speed'] > 0 and info['total_bytes']:
+                eta = round(remaining / info['speed'], 1)
+
+            transfers[part] = {
+                'bytes_done': info['bytes_done'],
+                'total_bytes': info['total_bytes'],
+                'speed': int(info['speed']),
+                'eta': eta,
+                'last_byte_at': info['last_byte_at'],
+                'done': info['done']
+            }
+
+            stage = STAGE_OF_PART.get(part, 'download')
+            total = info['total_bytes'] or info['bytes_done']
+            stage_done[stage] = stage_done.get(stage, 0) + (total if info['done'] else min(info['bytes_done'], total))
+            stage_total[stage] = stage_total.get(stage, 0) + total
+
+        overall = 0.0
+        for stage, weight in self._weights.items():
+            if stage_total.get(stage):
+                overall += weight * stage_done[stage] / stage_total[stage]
+
+        # 100% só quando o job inteiro termina
+        return {'progress': min(99, int(overall * 100)), 'transfers': transfers}
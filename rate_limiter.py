@@ -0,0 +1,163 @@
+"""Limite global de requisições ao YouTube (token bucket), separado para metadados e streams"""
+import asyncio
+import os
+import threading
+import time
+from job_store import JOB_STORE, JOB_STORE_PATH, connect
+
+# Metadados: cada estratégia de cliente (player/watch), playlist. Streams: cada GET de mídia
+# (faixa do download segmentado, download do pytubefix, entrada do FFmpeg)
+RATE_LIMIT_METADATA_RATE = float(os.environ.get('RATE_LIMIT_METADATA_RATE', 2.0))
+RATE_LIMIT_METADATA_BURST = float(os.environ.get('RATE_LIMIT_METADATA_BURST', 5))
+RATE_LIMIT_STREAM_RATE = float(os.environ.get('RATE_LIMIT_STREAM_RATE', 8.0))
+RATE_LIMIT_STREAM_BURST = float(os.environ.get('RATE_LIMIT_STREAM_BURST', 16))
+
+# Esperas a partir disso aparecem no log
+REPORT_WAIT = 1.0
+
+
+def take_tokens(tokens, updated, now, rate, burst, cost):
+    """Reabastece o balde e reserva `cost` fichas; retorna (fichas, espera em segundos)
+
+    O saldo pode ficar negativo: cada chamador reserva a sua vez e espera até
+    ela chegar, então a fila é atendida em ordem sem ninguém ficar tentando.
+    """
+    tokens = min(burst, tokens + (now - updated) * rate) - cost
+    return tokens, max(0.0, -tokens / rate)
+
+
+class TokenBucket:
+    """Token bucket do processo: `rate` fichas por segundo, acumulando até `burst`"""
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._acquired = 0
+        self._delayed = 0
+        self._waiting = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _reserve(self, cost):
+        with self._lock:
+            now = time.time()
+            self._tokens, wait = take_tokens(self._tokens, self._updated, now, self.rate, self.burst, cost)
+            self._updated = now
+            return wait
+
+    def _available(self):
+        with self._lock:
+            return min(self.burst, self._tokens + (time.time() - self._updated) * self.rate)
+
+    def _before_wait(self, cost):
+        wait = self._reserve(min(cost, self.burst)) if self.rate > 0 else 0.0
+        with self._lock:
+            self._acquired += 1
+            if wait > 0:
+                self._delayed += 1
+                self._waiting += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+        if wait >= REPORT_WAIT:
+            print(f"⏳ Limite de requisições ({self.name}): aguardando {wait:.1f}s")
+        return wait
+
+    def _after_wait(self, wait):
+        if wait > 0:
+            with self._lock:
+                self._waiting -= 1
+
+    def acquire(self, cost=1):
+        """Bloqueia até haver fichas para `cost` requisições; retorna quanto esperou"""
+        wait = self._before_wait(cost)
+        try:
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            self._after_wait(wait)
+        return wait
+
+    async def acquire_async(self, cost=1):
+        """Como acquire, mas a espera é asyncio.sleep (não ocupa thread)"""
+        wait = self._before_wait(cost)
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            self._after_wait(wait)
+        return wait
+
+    def stats(self):
+        available = self._available()
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'available': round(available, 2),
+                'acquired': self._acquired,
+                'delayed': self._delayed,
+                'waiting': self._waiting,
+                'avg_wait': round(self._total_wait / self._delayed, 3) if self._delayed else 0.0,
+                'max_wait': round(self._max_wait, 3)
+            }
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """Mesmo balde, com o saldo no SQLite compartilhado: vale para todos os workers do servidor"""
+
+    def __init__(self, name, rate, burst, path):
+        super().__init__(name, rate, burst)
+        self.path = path
+        self._local = threading.local()
+        conn = connect(path)
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+        conn.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _reserve(self, cost):
+        conn = self._conn()
+        # BEGIN IMMEDIATE: leitura + reserva atômicas entre workers
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE name = ?', (self.name,)).fetchone()
+            tokens, updated = row if row else (self.burst, now)
+            tokens, wait = take_tokens(tokens, updated, now, self.rate, self.burst, cost)
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                         (self.name, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def _available(self):
+        row = self._conn().execute('SELECT tokens, updated_at FROM rate_buckets WHERE name = ?', (self.name,)).fetchone()
+        if row is None:
+            return self.burst
+        return min(self.burst, row[0] + (time.time() - row[1]) * self.rate)
+
+
+def create_bucket(name, rate, burst):
+    """Balde no SQLite quando os jobs também estão (vários workers), senão em memória"""
+    if JOB_STORE == 'sqlite':
+        return SQLiteTokenBucket(name, rate, burst, JOB_STORE_PATH)
+    return TokenBucket(name, rate, burst)
+
+
+metadata_limiter = create_bucket('metadata', RATE_LIMIT_METADATA_RATE, RATE_LIMIT_METADATA_BURST)
+stream_limiter = create_bucket('stream', RATE_LIMIT_STREAM_RATE, RATE_LIMIT_STREAM_BURST)
+
+
+def rate_limit_stats():
+    return {'metadata': metadata_limiter.stats(), 'stream': stream_limiter.stats()}
@@ -0,0 +1,283 @@
+"""Política única de novas tentativas: classificação de erros, backoff com jitter,
+orçamento por operação e disjuntor para ondas de 403 do YouTube"""
+import http.client
+import os
+import random
+import re
+import socket
+import threading
+import time
+from collections import deque
+from urllib.error import HTTPError, URLError
+from pytubefix.exceptions import VideoPrivate, MembersOnly, RecordingUnavailable, LiveStreamOffline, VideoUnavailable
+from metrics import RETRIES, Gauge
+
+# Tipos de erro
+FORBIDDEN = 'forbidden'        # 403: URL/cliente bloqueado
+RATE_LIMITED = 'rate_limited'  # 429
+NOT_FOUND = 'not_found'        # 404
+VIDEO = 'video'                # privado, só membros, removido: repetir não adianta
+NETWORK = 'network'            # conexão caiu, timeout, resposta incompleta
+SERVER = 'server'              # 5xx
+CIRCUIT_OPEN = 'circuit_open'  # disjuntor aberto (erro rápido)
+UNKNOWN = 'unknown'
+
+# Códigos HTTP citados na mensagem (como número solto: "Arquivo incompleto: 5403120 de ..." não é 403)
+FORBIDDEN_MESSAGE = re.compile(r'\b403\b|Forbidden')
+RATE_LIMITED_MESSAGE = re.compile(r'\b429\b|Too Many Requests')
+NOT_FOUND_MESSAGE = re.compile(r'\b404\b')
+
+# Tempo máximo de uma chamada de teste com o disjuntor meio-aberto
+PROBE_TIMEOUT = 60
+
+
+# Erros do próprio vídeo: repetir ou trocar de cliente não adianta. Só o tipo
+# exato conta: BotDetection, LoginRequired, AgeRestrictedError e
+# VideoRegionBlocked herdam de VideoUnavailable, mas dependem do cliente
+VIDEO_ERRORS = (VideoPrivate, MembersOnly, RecordingUnavailable, LiveStreamOffline, VideoUnavailable)
+
+
+def is_video_error(error):
+    """Privado, só membros, removido...: falha do vídeo, não do cliente"""
+    return type(error) in VIDEO_ERRORS
+
+
+class StreamChanged(Exception):
+    """A URL renovada aponta para um arquivo de outro tamanho: não dá para retomar a transferência"""
+
+
+class CircuitOpenError(Exception):
+    """Disjuntor aberto: o YouTube está bloqueando e as chamadas foram suspensas"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"YouTube bloqueando acessos (muitos 403). Novas tentativas suspensas por {retry_after}s")
+        self.retry_after = retry_after
+
+
+def classify_error(error):
+    """Tipo do erro, pela exceção quando possível e pela mensagem como último recurso"""
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if is_video_error(error):
+        return VIDEO
+    if isinstance(error, StreamChanged):
+        return UNKNOWN
+    if isinstance(error, HTTPError):
+        if error.code == 403:
+            return FORBIDDEN
+        if error.code == 429:
+            return RATE_LIMITED
+        if error.code == 404:
+            return NOT_FOUND
+        if error.code >= 500:
+            return SERVER
+        return UNKNOWN
+    if isinstance(error, (URLError, socket.timeout, ConnectionError, http.client.HTTPException)):
+        return NETWORK
+
+    message = str(error)
+    if FORBIDDEN_MESSAGE.search(message):
+        return FORBIDDEN
+    if RATE_LIMITED_MESSAGE.search(message):
+        return RATE_LIMITED
+    if NOT_FOUND_MESSAGE.search(message):
+        return NOT_FOUND
+    return UNKNOWN
+
+
+class RetryPolicy:
+    """Quantas tentativas uma operação tem e quanto esperar entre elas
+
+    Espera exponencial (base × fator^tentativa, limitada a `max_delay`) com
+    jitter: metade fixa e metade aleatória, para os workers não baterem no
+    YouTube ao mesmo tempo. Erros 403/429 esperam `penalty` vezes mais.
+    """
+
+    def __init__(self, name, attempts, base_delay, max_delay, multiplier=2.0, penalty=2.0,
+                 retry_on=(FORBIDDEN, RATE_LIMITED, NETWORK, SERVER, UNKNOWN)):
+        prefix = f"RETRY_{name.upper()}_"
+        self.name = name
+        self.attempts = int(os.environ.get(prefix + 'ATTEMPTS', attempts))
+        self.base_delay = float(os.environ.get(prefix + 'BASE_DELAY', base_delay))
+        self.max_delay = float(os.environ.get(prefix + 'MAX_DELAY', max_delay))
+        self.multiplier = multiplier
+        self.penalty = penalty
+        self.retry_on = retry_on
+
+    def should_retry(self, attempt, kind):
+        """`attempt` começa em 0; decide se ainda cabe mais uma tentativa"""
+        return kind in self.retry_on and attempt + 1 < self.attempts
+
+    def delay(self, attempt, kind=UNKNOWN):
+        ceiling = self.base_delay * self.multiplier ** attempt
+        if kind in (FORBIDDEN, RATE_LIMITED):
+            ceiling *= self.penalty
+        ceiling = min(self.max_delay, ceiling)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def call(self, func, *args, cancel_event=None, on_retry=None, attempts=None, **kwargs):
+        """Executa `func` até dar certo ou acabar o orçamento; relança o último erro
+
+        `on_retry(erro, tipo)` roda antes de cada nova tentativa (ex.: renovar a
+        URL). Com `cancel_event`, a espera é interrompível e o acionamento
+        relança o erro na hora. `attempts` substitui o orçamento da política.
+        """
+        budget = attempts or self.attempts
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind not in self.retry_on or attempt + 1 >= budget or (cancel_event and cancel_event.is_set()):
+                    raise
+                wait = self.delay(attempt, kind)
+                RETRIES.inc(operation=self.name, kind=kind)
+                print(f"↻ {self.name}: {kind} na tentativa {attempt + 1}/{budget}, nova tentativa em {wait:.1f}s")
+                if cancel_event:
+                    if cancel_event.wait(wait):
+                        raise
+                else:
+                    time.sleep(wait)
+                if on_retry:
+                    on_retry(e, kind)
+                attempt += 1
+
+
+# Orçamentos por operação (ajustáveis por RETRY_<OPERAÇÃO>_ATTEMPTS/_BASE_DELAY/_MAX_DELAY)
+POLICIES = {
+    # Passagem de uma estratégia de cliente para a próxima (cada estratégia = 1 tentativa)
+    'strategy': RetryPolicy('strategy', attempts=8, base_delay=1.0, max_delay=6.0, multiplier=1.3),
+    # Obter o objeto YouTube dentro do job de download
+    'youtube_object': RetryPolicy('youtube_object', attempts=3, base_delay=3.0, max_delay=15.0,
+                                  retry_on=(FORBIDDEN, RATE_LIMITED, NETWORK, SERVER)),
+    # Download de um stream inteiro (cada nova tentativa recomeça com URL nova)
+    'download': RetryPolicy('download', attempts=3, base_delay=2.0, max_delay=20.0,
+                            retry_on=(FORBIDDEN, RATE_LIMITED, NETWORK, SERVER)),
+    # Um segmento do download segmentado, retomando do último byte
+    'segment': RetryPolicy('segment', attempts=4, base_delay=0.5, max_delay=8.0, retry_on=(NETWORK, SERVER)),
+}
+
+
+class CircuitBreaker:
+    """Disjuntor global para 403 do YouTube
+
+    Fechado: tudo passa e os resultados entram numa janela de `window`
+    segundos. Se houver pelo menos `min_calls` e a fração de 403 passar de
+    `threshold`, abre por `cooldown` segundos: as chamadas falham na hora com
+    CircuitOpenError. Depois disso, meio-aberto: check() libera uma chamada de
+    teste e devolve o token dela; só o record() com esse token decide (sucesso
+    fecha, novo 403 reabre, outro erro libera um novo teste).
+
+    Só 403 conta como falha (should_trip): rede, 404 e vídeo privado não dizem
+    nada sobre bloqueio e ficam fora da janela.
+    """
+
+    def __init__(self, threshold=0.5, min_calls=10, window=60, cooldown=120):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._opened_at = None
+        self._probe = None
+        self._probe_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    @staticmethod
+    def should_trip(error):
+        return classify_error(error) == FORBIDDEN
+
+    def check(self):
+        """Levanta CircuitOpenError se as chamadas ao YouTube estão suspensas
+
+        Retorna o token da chamada de teste (meio-aberto), a repassar ao
+        record() dessa chamada, ou None com o disjuntor fechado.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            now = time.monotonic()
+            remaining = self._opened_at + self.cooldown - now
+            # Uma chamada de teste por vez (se ela nunca reportar, outra é liberada depois de PROBE_TIMEOUT)
+            probing = self._probe is not None and now - self._probe_started < PROBE_TIMEOUT
+            if remaining > 0 or probing:
+                self.rejected += 1
+                raise CircuitOpenError(max(1, int(remaining)) if remaining > 0 else 5)
+            self._probe = object()
+            self._probe_started = now
+            return self._probe
+
+    def record(self, error=None, probe=None):
+        """Registra o resultado de uma chamada ao YouTube (`error` None = sucesso)
+
+        `probe` é o token devolvido pelo check() da mesma chamada.
+        """
+        forbidden = error is not None and self.should_trip(error)
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                # Aberto: chamadas admitidas antes de abrir não decidem nada, só a de teste
+                if probe is None or probe is not self._probe:
+                    return
+                self._probe = None
+                if forbidden:
+                    self._opened_at = now
+                    print("⚡ Disjuntor continua aberto: 403 na chamada de teste")
+                elif error is None:
+                    self._opened_at = None
+                    self._events.clear()
+                    print("⚡ Disjuntor fechado: YouTube respondendo de novo")
+                else:
+                    print("⚡ Chamada de teste inconclusiva (erro sem 403); a próxima chamada testa de novo")
+                return
+
+            if error is not None and not forbidden:
+                return
+            self._events.append((now, forbidden))
+            self._prune(now)
+            if len(self._events) >= self.min_calls:
+                rate = sum(1 for _, is_forbidden in self._events if is_forbidden) / len(self._events)
+                if rate >= self.threshold:
+                    self._opened_at = now
+                    self.trips += 1
+                    print(f"⚡ Disjuntor aberto: {rate:.0%} de 403 em {len(self._events)} chamadas; pausa de {self.cooldown}s")
+
+    def release(self, probe):
+        """Chamada de teste que terminou sem resultado (cancelada por nós): libera um novo teste"""
+        with self._lock:
+            if probe is not None and probe is self._probe:
+                self._probe = None
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            state = 'closed'
+            if self._opened_at is not None:
+                state = 'half_open' if self._probe is not None or now >= self._opened_at + self.cooldown else 'open'
+            return {
+                'state': state,
+                'calls': len(self._events),
+                'forbidden': sum(1 for _, is_forbidden in self._events if is_forbidden),
+                'retry_after': max(0, int(self._opened_at + self.cooldown - now)) if self._opened_at is not None else 0,
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
+
+
+upstream_breaker = CircuitBreaker(
+    threshold=float(os.environ.get('CIRCUIT_403_THRESHOLD', 0.5)),
+    min_calls=int(os.environ.get('CIRCUIT_MIN_CALLS', 10)),
+    window=int(os.environ.get('CIRCUIT_WINDOW', 60)),
+    cooldown=int(os.environ.get('CIRCUIT_COOLDOWN', 120))
+)
+
+# 1 enquanto o disjuntor não está fechado (aberto ou meio-aberto)
+Gauge('circuit_open', 'Disjuntor de 403 aberto', function=lambda: int(upstream_breaker.stats()['state'] != 'closed'))
@@ -0,0 +1,252 @@
+"""Download segmentado: um stream baixado em faixas de bytes por várias conexões paralelas"""
+import http.client
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+from rate_limiter import stream_limiter
+from retry_policy import POLICIES, classify_error
+from metrics import RETRIES
+
+# O googlevideo limita a velocidade por conexão; várias faixas em paralelo somam a banda
+SEGMENTED_DOWNLOAD = os.environ.get('SEGMENTED_DOWNLOAD', '1') == '1'
+SEGMENT_SIZE = int(os.environ.get('DOWNLOAD_SEGMENT_SIZE', 8 * 1024 * 1024))
+SEGMENT_CONNECTIONS = int(os.environ.get('DOWNLOAD_SEGMENT_CONNECTIONS', 4))
+SEGMENT_TIMEOUT = float(os.environ.get('DOWNLOAD_SEGMENT_TIMEOUT', 30))
+# Quantas vezes uma URL nova é pedida após 403 antes de desistir do download
+URL_REFRESHES = int(os.environ.get('DOWNLOAD_URL_REFRESHES', 2))
+
+CHUNK_SIZE = 64 * 1024
+# Conexões ociosas por mais tempo que isso provavelmente já foram fechadas pelo servidor
+IDLE_TIMEOUT = 15
+MAX_REDIRECTS = 5
+# Mesmos cabeçalhos que o pytubefix usa nas requisições de mídia
+HEADERS = {'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-US,en'}
+
+
+class RangeNotSupported(Exception):
+    """O servidor ignorou o cabeçalho Range (não dá para baixar em faixas)"""
+
+
+class ConnectionPool:
+    """Conexões HTTP(S) keep-alive por host, reaproveitadas entre segmentos e downloads"""
+
+    def __init__(self, max_idle_per_host=SEGMENT_CONNECTIONS * 2, timeout=SEGMENT_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._opened = 0
+        self._reused = 0
+
+    def acquire(self, scheme, netloc):
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get((scheme, netloc), [])
+            while idle and conn is None:
+                candidate, released_at = idle.pop()
+                if time.monotonic() - released_at < IDLE_TIMEOUT:
+                    conn = candidate
+                    self._reused += 1
+                else:
+                    stale.append(candidate)
+            if conn is None:
+                self._opened += 1
+        for candidate in stale:
+            candidate.close()
+        if conn is not None:
+            return conn
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(netloc, timeout=self.timeout)
+
+    def release(self, scheme, netloc, conn):
+        """Devolve uma conexão cuja resposta foi lida até o fim"""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'opened': self._opened,
+                'reused': self._reused
+            }
+
+
+connection_pool = ConnectionPool()
+
+
+def split_ranges(filesize, segment_size):
+    """Faixas [início, fim] (inclusivas) que cobrem o arquivo"""
+    return [[start, min(start + segment_size, filesize) - 1] for start in range(0, filesize, segment_size)]
+
+
+def _read_range(url, segment, fileobj, should_stop, on_chunk, pool):
+    """Baixa o que falta de `segment` ([posição, fim]) escrevendo no lugar; segue redirecionamentos"""
+    target = url
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(target)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+        stream_limiter.acquire()
+        conn = pool.acquire(parts.scheme, parts.netloc)
+        try:
+            conn.request('GET', path, headers=dict(HEADERS, Range=f"bytes={segment[0]}-{segment[1]}"))
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            response.read()
+            pool.release(parts.scheme, parts.netloc, conn)
+            target = urljoin(target, response.getheader('Location'))
+            continue
+
+        if response.status not in (200, 206):
+            conn.close()
+            # Mesmo tipo de erro do pytubefix ("HTTP Error 403: ..."), tratado igual pelo chamador
+            raise HTTPError(target, response.status, response.reason, response.headers, None)
+
+        if response.status == 200 and segment[0] != 0:
+            conn.close()
+            raise RangeNotSupported(f"Servidor respondeu 200 para a faixa {segment[0]}-{segment[1]}")
+
+        # Resposta 200 traz o arquivo inteiro: lê só a faixa e descarta a conexão
+        reusable = response.status == 206
+        try:
+            fileobj.seek(segment[0])
+            while segment[0] <= segment[1]:
+                if should_stop():
+                    reusable = False
+                    return
+                chunk = response.read(min(CHUNK_SIZE, segment[1] - segment[0] + 1))
+                if not chunk:
+                    reusable = False
+                    raise http.client.IncompleteRead(b'', segment[1] - segment[0] + 1)
+                fileobj.write(chunk)
+                segment[0] += len(chunk)
+                if on_chunk:
+                    on_chunk(len(chunk))
+        except Exception:
+            reusable = False
+            raise
+        finally:
+            if reusable and response.isclosed():
+                pool.release(parts.scheme, parts.netloc, conn)
+            else:
+                conn.close()
+        return
+
+    raise HTTPError(target, 310, 'Too many redirects', None, None)
+
+
+def _download_segment(url, segment, part_path, should_stop, on_chunk, pool):
+    """Baixa um segmento, retomando da última posição escrita em falhas de rede/5xx
+
+    Novas tentativas e esperas seguem POLICIES['segment']; 403/404 sobem na
+    hora (repetir a mesma URL não adianta).
+    """
+    policy = POLICIES['segment']
+    attempt = 0
+    with open(part_path, 'r+b') as fileobj:
+        while segment[0] <= segment[1] and not should_stop():
+            try:
+                _read_range(url, segment, fileobj, should_stop, on_chunk, pool)
+            except (OSError, http.client.HTTPException) as e:
+                kind = classify_error(e)
+                if not policy.should_retry(attempt, kind):
+                    raise
+                wait = policy.delay(attempt, kind)
+                RETRIES.inc(operation=policy.name, kind=kind)
+                attempt += 1
+                print(f"Falha no segmento ({kind}, tentativa {attempt}/{policy.attempts}), retomando em {wait:.1f}s: {e}")
+                time.sleep(wait)
+
+
+def _run_segments(url, segments, part_path, cancel_event, on_chunk, pool, connections):
+    """Baixa os segmentos pendentes em paralelo; no primeiro erro para os demais e o retorna"""
+    failed = threading.Event()
+
+    def should_stop():
+        return failed.is_set() or cancel_event.is_set()
+
+    first_error = None
+    with ThreadPoolExecutor(max_workers=max(1, min(connections, len(segments))), thread_name_prefix='segment') as executor:
+        futures = [
+            executor.submit(_download_segment, url, segment, part_path, should_stop, on_chunk, pool)
+            for segment in segments
+        ]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                if first_error is None:
+                    first_error = e
+                failed.set()
+                for pending in futures:
+                    pending.cancel()
+    return first_error
+
+
+def download_segmented(url, filesize, filepath, cancel_event=None, on_chunk=None, resolve_url=None,
+                       segment_size=SEGMENT_SIZE, connections=SEGMENT_CONNECTIONS, pool=None):
+    """Baixa `url` (tamanho conhecido) em faixas paralelas para `filepath`
+
+    O arquivo é pré-alocado como `.part`, cada segmento escreve na sua posição
+    e o nome final só aparece quando todos os bytes chegaram. `on_chunk(n)` é
+    chamado (de várias threads) a cada bloco escrito. Se `cancel_event` for
+    acionado, o parcial é removido e retorna None; senão retorna `filepath`.
+
+    Em um 403 (URL assinada expirada/bloqueada), `resolve_url()` fornece uma
+    URL nova e cada segmento continua do último byte escrito, até
+    URL_REFRESHES vezes, em vez de recomeçar do zero.
+    """
+    pool = pool or connection_pool
+    cancel_event = cancel_event or threading.Event()
+
+    part_path = f"{filepath}.part"
+    with open(part_path, 'wb') as fileobj:
+        if hasattr(os, 'posix_fallocate') and filesize:
+            os.posix_fallocate(fileobj.fileno(), 0, filesize)
+        else:
+            fileobj.truncate(filesize)
+
+    segments = split_ranges(filesize, segment_size)
+    refreshes = 0
+    try:
+        while True:
+            pending = [segment for segment in segments if segment[0] <= segment[1]]
+            error = _run_segments(url, pending, part_path, cancel_event, on_chunk, pool, connections) if pending else None
+            if cancel_event.is_set():
+                os.remove(part_path)
+                return None
+            if error is None:
+                break
+            if not (isinstance(error, HTTPError) and error.code == 403 and resolve_url and refreshes < URL_REFRESHES):
+                raise error
+            refreshes += 1
+            missing = sum(segment[1] - segment[0] + 1 for segment in segments if segment[0] <= segment[1])
+            print(f"403 no download segmentado: nova URL ({refreshes}/{URL_REFRESHES}), retomando {missing} de {filesize} bytes")
+            url = resolve_url()
+
+        # Conferência final: todos os segmentos completos e o arquivo com o tamanho esperado
+        missing = sum(segment[1] - segment[0] + 1 for segment in segments if segment[0] <= segment[1])
+        size = os.path.getsize(part_path)
+        if missing or size != filesize:
+            raise http.client.IncompleteRead(b'', missing or abs(filesize - size))
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+
+    os.replace(part_path, filepath)
+    return filepath
@@ -0,0 +1,250 @@
+"""Download especulativo: logo após o /get_video_info, aquece no cache a escolha mais provável
+
+Opcional (SPECULATIVE_PREFETCH=1). A qualidade prevista é a mais escolhida no
+/start_download entre as disponíveis no vídeo (sem histórico, o melhor
+progressivo). O job especulativo é um download comum registrado no
+job_registry: se o usuário escolher a mesma qualidade, o /start_download
+reaproveita o job em andamento (que deixa de ser limitado) ou o arquivo já
+no cache.
+
+Prioridade baixa: roda numa fila própria, com poucos workers, sem ocupar os
+workers dos usuários, e a banda de todos os jobs especulativos do processo
+passa por um único token bucket em bytes/s. O job é cancelado se o usuário
+escolher outra qualidade do mesmo vídeo ou não escolher nada em
+SPECULATIVE_IDLE_TIMEOUT segundos.
+"""
+import os
+import threading
+import time
+from download_queue import DownloadQueue, QueueFullError
+from metrics import SPECULATIVE_JOBS
+from rate_limiter import TokenBucket
+from stream_table import best_audio
+
+SPECULATIVE_PREFETCH = os.environ.get('SPECULATIVE_PREFETCH', '0') == '1'
+SPECULATIVE_BANDWIDTH = float(os.environ.get('SPECULATIVE_BANDWIDTH', 2_000_000))  # bytes/s, todos os jobs
+SPECULATIVE_BURST = float(os.environ.get('SPECULATIVE_BURST', 1_000_000))
+SPECULATIVE_MAX_BYTES = int(os.environ.get('SPECULATIVE_MAX_BYTES', 300 * 1024 * 1024))
+SPECULATIVE_IDLE_TIMEOUT = float(os.environ.get('SPECULATIVE_IDLE_TIMEOUT', 120))
+SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', 1))
+SPECULATIVE_MAX_QUEUE = int(os.environ.get('SPECULATIVE_MAX_QUEUE', 4))
+
+
+class SpeculationCancelled(Exception):
+    """Download especulativo interrompido (outra escolha, usuário saiu)"""
+
+
+class ChoiceStats:
+    """Frequência das qualidades escolhidas no /start_download (do processo)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, resolution):
+        with self._lock:
+            self._counts[resolution] = self._counts.get(resolution, 0) + 1
+
+    def predict(self, streams):
+        """Entrada de `streams` (resposta do /get_video_info) mais provável de ser escolhida"""
+        with self._lock:
+            counts = dict(self._counts)
+        ranked = [s for s in streams if counts.get(s['resolution'])]
+        if ranked:
+            return max(ranked, key=lambda s: counts[s['resolution']])
+        return next((s for s in streams if s['type'] == 'progressive'), None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class Speculator:
+    """Jobs especulativos por vídeo: previsão, fila de prioridade baixa, banda e cancelamento"""
+
+    def __init__(self, enabled, bandwidth, burst, idle_timeout, max_bytes, workers, max_queue):
+        self.enabled = enabled
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.choices = ChoiceStats()
+        self.bandwidth = TokenBucket('speculative', bandwidth, burst)
+        self.queue = DownloadQueue(workers=workers, max_queue=max_queue)
+        self._lock = threading.Lock()
+        # video_id → job especulativo; download_id → o mesmo job
+        self._by_video = {}
+        self._by_download = {}
+
+    def predict(self, video_id, streams, table):
+        """Qualidade a especular para o vídeo, ou None (desligado, já especulado, grande demais)
+
+        Grande demais: acima de max_bytes, ou sem tempo de terminar dentro do
+        prazo de escolha na banda especulativa (seria cancelado no meio).
+        """
+        if not self.enabled or not video_id:
+            return None
+        with self._lock:
+            self._prune()
+            if video_id in self._by_video:
+                return None
+        choice = self.choices.predict(streams)
+        if choice is None:
+            return None
+        size = self._estimate_size(choice, table)
+        if size and size > self.size_limit():
+            SPECULATIVE_JOBS.inc(outcome='skipped')
+            return None
+        return choice['resolution']
+
+    def size_limit(self):
+        """Maior download que cabe no orçamento e termina antes do prazo de escolha"""
+        limit = self.max_bytes
+        if self.bandwidth.rate > 0:
+            limit = min(limit, self.bandwidth.rate * self.idle_timeout)
+        return limit
+
+    @staticmethod
+    def _estimate_size(choice, table):
+        rows = [row for row in table if row['itag'] == choice.get('itag')]
+        if choice['type'] == 'adaptive':
+            rows.append(best_audio(table, 'mp4'))
+        return sum((row['size'] or row['size_approx'] or 0) for row in rows if row)
+
+    def start(self, video_id, download_id, resolution, func, args, on_cancel):
+        """Enfileira `func(*args)` como job especulativo; False se a fila estiver cheia
+
+        `on_cancel(download_id, motivo)` é chamado se o job for cancelado antes de começar.
+        """
+        job = {
+            'video_id': video_id,
+            'download_id': download_id,
+            'resolution': resolution,
+            'state': 'queued',
+            'promoted': False,
+            'cancelled': None,
+            'deadline': time.monotonic() + self.idle_timeout,
+            'on_cancel': on_cancel
+        }
+        with self._lock:
+            self._by_video[video_id] = job
+            self._by_download[download_id] = job
+        try:
+            self.queue.submit(download_id, self._run, job, func, args)
+        except QueueFullError:
+            self._forget(job)
+            return False
+        SPECULATIVE_JOBS.inc(outcome='started')
+        print(f"🔮 Download especulativo {resolution} do vídeo {video_id} enfileirado")
+        return True
+
+    def _run(self, job, func, args):
+        with self._lock:
+            # Cancelado na fila pelo on_choice, que já avisou o on_cancel
+            if job['state'] == 'done':
+                return
+            if job['state'] == 'queued' and not job['promoted'] and time.monotonic() > job['deadline']:
+                job['cancelled'] = 'nenhuma escolha a tempo'
+                SPECULATIVE_JOBS.inc(outcome='expired')
+            if job['cancelled']:
+                job['state'] = 'done'
+                reason = job['cancelled']
+            else:
+                job['state'] = 'running'
+                reason = None
+        if reason:
+            job['on_cancel'](job['download_id'], f"Download especulativo cancelado ({reason})")
+            return
+        try:
+            func(*args)
+        finally:
+            with self._lock:
+                job['state'] = 'done'
+
+    def throttle_for(self, download_id):
+        """Função chamada a cada bloco baixado pelo job (banda e cancelamento), ou None"""
+        with self._lock:
+            job = self._by_download.get(download_id)
+        if job is None:
+            return None
+
+        def throttle(nbytes):
+            # O balde limita cada pedido a `burst`: chunks grandes pagam em pedaços,
+            # e o cancelamento é conferido entre eles
+            while nbytes > 0:
+                with self._lock:
+                    if job['promoted']:
+                        return
+                    if not job['cancelled'] and time.monotonic() > job['deadline']:
+                        job['cancelled'] = 'nenhuma escolha a tempo'
+                        SPECULATIVE_JOBS.inc(outcome='expired')
+                    reason = job['cancelled']
+                if reason:
+                    raise SpeculationCancelled(f"Download especulativo cancelado ({reason})")
+                piece = min(nbytes, self.bandwidth.burst)
+                self.bandwidth.acquire(piece)
+                nbytes -= piece
+
+        return throttle
+
+    def on_choice(self, video_id, resolution):
+        """Escolha real do usuário: conta a frequência e resolve o job especulativo do vídeo
+
+        Mesma qualidade: o job vira do usuário (sem limite de banda), ou, se ainda
+        nem começou, é cancelado para o pedido entrar na fila normal. Outra
+        qualidade: o job é cancelado.
+        """
+        self.choices.record(resolution)
+        with self._lock:
+            job = self._by_video.get(video_id)
+            if job is None or job['cancelled'] or job['promoted']:
+                return
+            hit = job['resolution'] == resolution
+            SPECULATIVE_JOBS.inc(outcome='hit' if hit else 'miss')
+            if hit and job['state'] != 'queued':
+                job['promoted'] = True
+                return
+            job['cancelled'] = 'usuário escolheu outra qualidade' if not hit else 'pedido real na fila normal'
+            cancel_now = job['state'] == 'queued'
+            if cancel_now:
+                job['state'] = 'done'
+        if cancel_now:
+            job['on_cancel'](job['download_id'], f"Download especulativo cancelado ({job['cancelled']})")
+
+    def _forget(self, job):
+        with self._lock:
+            if self._by_video.get(job['video_id']) is job:
+                del self._by_video[job['video_id']]
+            self._by_download.pop(job['download_id'], None)
+
+    def _prune(self):
+        # Jobs terminados ficam até o dobro do prazo, para contar acertos tardios
+        now = time.monotonic()
+        for video_id, job in list(self._by_video.items()):
+            if job['state'] == 'done' and now > job['deadline'] + self.idle_timeout:
+                del self._by_video[video_id]
+                self._by_download.pop(job['download_id'], None)
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._by_video.values():
+                state = 'promoted' if job['promoted'] else ('cancelled' if job['cancelled'] else job['state'])
+                states[state] = states.get(state, 0) + 1
+        return {
+            'enabled': self.enabled,
+            'size_limit': int(self.size_limit()),
+            'jobs': states,
+            'choices': self.choices.stats(),
+            'queue': self.queue.stats(),
+            'bandwidth': self.bandwidth.stats()
+        }
+
+
+speculator = Speculator(
+    enabled=SPECULATIVE_PREFETCH,
+    bandwidth=SPECULATIVE_BANDWIDTH,
+    burst=SPECULATIVE_BURST,
+    idle_timeout=SPECULATIVE_IDLE_TIMEOUT,
+    max_bytes=SPECULATIVE_MAX_BYTES,
+    workers=SPECULATIVE_WORKERS,
+    max_queue=SPECULATIVE_MAX_QUEUE
+)
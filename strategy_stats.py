@@ -0,0 +1,111 @@
+"""Placar das estratégias (clientes) usadas para acessar o YouTube"""
+import os
+import threading
+import time
+from collections import deque
+
+# Estimativa usada enquanto uma estratégia ainda não tem histórico
+DEFAULT_LATENCY = 3.0
+
+
+class StrategyScoreboard:
+    """Registra sucesso/latência por cliente em janela deslizante e ordena as estratégias
+
+    A ordem é pelo custo esperado até o sucesso (latência média / taxa de
+    sucesso suavizada). Estratégias com várias falhas seguidas ficam em
+    quarentena por um tempo e são puladas, a menos que todas estejam.
+    """
+
+    def __init__(self, window_size=50, window_seconds=1800, failure_threshold=3, cooldown=600):
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._consecutive_failures = {}
+        self._skip_until = {}
+        self._last_error = {}
+
+    def _window(self, name, now):
+        samples = self._samples.setdefault(name, deque(maxlen=self.window_size))
+        while samples and now - samples[0][0] > self.window_seconds:
+            samples.popleft()
+        return samples
+
+    def record(self, name, success, latency, error=None):
+        """Registra o resultado de uma tentativa"""
+        now = time.time()
+        with self._lock:
+            self._window(name, now).append((now, success, latency))
+            if success:
+                self._consecutive_failures[name] = 0
+                self._skip_until.pop(name, None)
+            else:
+                failures = self._consecutive_failures.get(name, 0) + 1
+                self._consecutive_failures[name] = failures
+                if error:
+                    self._last_error[name] = str(error)[:200]
+                if failures >= self.failure_threshold:
+                    self._skip_until[name] = now + self.cooldown
+
+    def _summary(self, name, now):
+        samples = self._window(name, now)
+        attempts = len(samples)
+        successes = sum(1 for _, ok, _ in samples if ok)
+        ok_latencies = [lat for _, ok, lat in samples if ok]
+        all_latencies = [lat for _, _, lat in samples]
+        # Taxa suavizada (prior Beta(1,1)) para não descartar clientes com pouco histórico
+        success_rate = (successes + 1) / (attempts + 2)
+        if ok_latencies:
+            latency = sum(ok_latencies) / len(ok_latencies)
+        elif all_latencies:
+            latency = max(DEFAULT_LATENCY, sum(all_latencies) / len(all_latencies))
+        else:
+            latency = DEFAULT_LATENCY
+        return {
+            'attempts': attempts,
+            'successes': successes,
+            'success_rate': success_rate,
+            'avg_latency': latency,
+            'expected_cost': latency / success_rate,
+            'consecutive_failures': self._consecutive_failures.get(name, 0),
+            'skipped_until': self._skip_until.get(name) if self._skip_until.get(name, 0) > now else None,
+            'last_error': self._last_error.get(name)
+        }
+
+    def order(self, names):
+        """Retorna os nomes ordenados do mais para o menos promissor, sem os em quarentena"""
+        now = time.time()
+        with self._lock:
+            summaries = {name: self._summary(name, now) for name in names}
+        base_index = {name: i for i, name in enumerate(names)}
+        ranked = sorted(names, key=lambda n: (summaries[n]['expected_cost'], base_index[n]))
+        healthy = [n for n in ranked if not summaries[n]['skipped_until']]
+        # Se todas estão em quarentena, tenta todas mesmo assim
+        return healthy or ranked
+
+    def snapshot(self, names):
+        """Estado atual do placar, na ordem em que as estratégias serão tentadas"""
+        now = time.time()
+        ordered = self.order(names)
+        with self._lock:
+            summaries = {name: self._summary(name, now) for name in names}
+        result = []
+        for name in ordered + [n for n in names if n not in ordered]:
+            summary = summaries[name]
+            summary['name'] = name
+            summary['healthy'] = summary['skipped_until'] is None
+            summary['success_rate'] = round(summary['success_rate'], 3)
+            summary['avg_latency'] = round(summary['avg_latency'], 3)
+            summary['expected_cost'] = round(summary['expected_cost'], 3)
+            result.append(summary)
+        return result
+
+
+strategy_scoreboard = StrategyScoreboard(
+    window_size=int(os.environ.get('STRATEGY_WINDOW_SIZE', 50)),
+    window_seconds=int(os.environ.get('STRATEGY_WINDOW_SECONDS', 1800)),
+    failure_threshold=int(os.environ.get('STRATEGY_FAILURE_THRESHOLD', 3)),
+    cooldown=int(os.environ.get('STRATEGY_COOLDOWN', 600))
+)
@@ -0,0 +1,176 @@
+"""Transferência dos streams do YouTube para o disco"""
+import http.client
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from progress import current_transfer
+from rate_limiter import stream_limiter
+from retry_policy import POLICIES, StreamChanged, upstream_breaker
+from speculative import SpeculationCancelled
+from segmented_download import SEGMENTED_DOWNLOAD, RangeNotSupported, download_segmented
+from tracing import span, in_current_trace
+
+PART_LABELS = {'video': 'vídeo', 'audio': 'áudio', 'stream': 'stream'}
+
+
+class DownloadCancelled(Exception):
+    """Download interrompido porque outra parte do job falhou"""
+
+
+class IncompleteDownload(http.client.IncompleteRead):
+    """Arquivo baixado com tamanho diferente do anunciado (conexão caiu no meio)"""
+
+    def __init__(self, size, expected):
+        super().__init__(b'', abs(expected - size))
+        self.size = size
+        self.total = expected
+
+    def __str__(self):
+        return f"Arquivo incompleto: {self.size} de {self.total} bytes"
+
+
+def remove_files(*paths):
+    """Remove arquivos temporários, ignorando os que não existem"""
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            print(f"✗ Não foi possível remover {path}: {e}")
+
+
+def fetch_stream(stream, output_path, filename, cancel_event=None, skip_existing=False, resolve_stream=None):
+    """Baixa o stream para `output_path/filename`
+
+    Com o tamanho conhecido, usa o download segmentado (várias conexões);
+    senão, ou se o servidor não aceitar Range, usa o download do pytubefix.
+    Os bytes contam para a parte acompanhada na thread atual. Com
+    `resolve_stream(itag)` (mesmo itag, URL nova), um 403 no meio do download
+    continua de onde parou. Com o disjuntor de 403 aberto, falha na hora.
+    """
+    probe = upstream_breaker.check()
+    with span('fetch_stream', itag=stream.itag, filename=filename) as trace:
+        try:
+            filepath = _fetch_stream(stream, output_path, filename, cancel_event, skip_existing, resolve_stream, trace)
+        except SpeculationCancelled:
+            # Cancelado por nós, não pelo YouTube: fica fora do disjuntor, mas
+            # se era a chamada de teste, outra precisa poder testar
+            upstream_breaker.release(probe)
+            raise
+        except Exception as e:
+            upstream_breaker.record(e, probe)
+            raise
+        if os.path.exists(filepath):
+            trace.set(bytes=os.path.getsize(filepath))
+    upstream_breaker.record(probe=probe)
+    return filepath
+
+
+def _fetch_stream(stream, output_path, filename, cancel_event, skip_existing, resolve_stream, trace):
+    filepath = os.path.join(output_path, filename)
+    filesize = stream.filesize if SEGMENTED_DOWNLOAD else 0
+    if skip_existing and filesize and os.path.exists(filepath) and os.path.getsize(filepath) == filesize:
+        trace.set(mode='existing')
+        return filepath
+
+    def resolve_url():
+        fresh = resolve_stream(stream.itag)
+        if fresh.filesize != filesize:
+            raise StreamChanged(f"Stream itag {stream.itag} mudou de tamanho ({filesize} → {fresh.filesize}), não dá para retomar")
+        return fresh.url
+
+    transfer = current_transfer()
+    if filesize:
+        trace.set(mode='segmented')
+        try:
+            download_segmented(stream.url, filesize, filepath, cancel_event=cancel_event,
+                               on_chunk=transfer.advance if transfer else None,
+                               resolve_url=resolve_url if resolve_stream else None)
+            return filepath
+        except RangeNotSupported as e:
+            print(f"Download segmentado indisponível ({e}), usando conexão única")
+            if transfer:
+                transfer.set(0)
+
+    trace.set(mode='single', rate_limit_wait_s=round(stream_limiter.acquire(), 3))
+    stream.download(
+        output_path=output_path,
+        filename=filename,
+        skip_existing=skip_existing,
+        interrupt_checker=cancel_event.is_set if cancel_event else None
+    )
+    # O pytubefix não confere o tamanho final; um arquivo truncado não pode virar "concluído"
+    expected = stream.filesize
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if not cancelled and expected and os.path.exists(filepath) and os.path.getsize(filepath) != expected:
+        size = os.path.getsize(filepath)
+        remove_files(filepath)
+        raise IncompleteDownload(size, expected)
+    return filepath
+
+
+def download_stream(stream, output_path, filename, retries=0, cancel_event=None, part='stream', job_progress=None,
+                    resolve_stream=None):
+    """Baixa um stream com as novas tentativas de POLICIES['download'] (até `retries` além da primeira)
+
+    Com `job_progress`, os bytes recebidos são contabilizados na parte `part`.
+    Com `resolve_stream(itag)`, 403 no meio da transferência retoma com URL nova.
+    """
+    cancel_event = cancel_event or threading.Event()
+    label = PART_LABELS.get(part, part)
+
+    def attempt():
+        if cancel_event.is_set():
+            raise DownloadCancelled(f"Download de {label} cancelado")
+        tracked = job_progress.transfer(part, stream.filesize) if job_progress else nullcontext()
+        with tracked:
+            fetch_stream(stream, output_path, filename, cancel_event=cancel_event, resolve_stream=resolve_stream)
+        if cancel_event.is_set():
+            raise DownloadCancelled(f"Download de {label} cancelado")
+        return os.path.join(output_path, filename)
+
+    # Espera interrompível: se a outra metade falhar, desiste na hora
+    with span('download_part', part=part, itag=stream.itag):
+        return POLICIES['download'].call(attempt, cancel_event=cancel_event, attempts=retries + 1)
+
+
+def download_video_audio(video_stream, audio_stream, output_path, video_filename, audio_filename, retries=0, job_progress=None,
+                         resolve_stream=None):
+    """Baixa os streams adaptivos de vídeo e áudio ao mesmo tempo
+
+    Se qualquer um falhar, o outro é interrompido, os dois temporários são
+    removidos e o primeiro erro é propagado. Retorna (video_path, audio_path).
+    """
+    video_path = os.path.join(output_path, video_filename)
+    audio_path = os.path.join(output_path, audio_filename)
+    cancel_event = threading.Event()
+
+    with span('download_streams') as trace, \
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix='stream-download') as executor:
+        # Cada metade roda no trace do job (spans 'download_part' lado a lado)
+        futures = [
+            executor.submit(in_current_trace(download_stream), video_stream, output_path, video_filename, retries, cancel_event, 'video', job_progress, resolve_stream),
+            executor.submit(in_current_trace(download_stream), audio_stream, output_path, audio_filename, retries, cancel_event, 'audio', job_progress, resolve_stream),
+        ]
+        first_error = None
+        finished = []
+        for future in as_completed(futures):
+            finished.append(time.monotonic())
+            try:
+                future.result()
+            except DownloadCancelled:
+                pass
+            except Exception as e:
+                if first_error is None:
+                    first_error = e
+                cancel_event.set()
+        # Quanto a parte mais rápida ficou esperando a outra antes do mux
+        trace.set(straggler_wait_s=round(finished[-1] - finished[0], 3))
+
+    if first_error is not None:
+        remove_files(video_path, audio_path)
+        raise first_error
+
+    return video_path, audio_path
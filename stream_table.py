@@ -0,0 +1,126 @@
+"""Tabela compacta dos streams de um vídeo, montada numa única passada pelo manifesto
+
+Cada linha: itag, kind (progressive/video/audio), resolution, abr, codec,
+subtype, size (contentLength do manifesto em yt.streaming_data, ou None), size_approx (bitrate ×
+duração, sem requisição) e expires (validade da URL assinada). O tamanho
+exato de um stream sem content-length só é buscado quando ele for baixado.
+
+A tabela fica no video_cache junto com o objeto YouTube de onde saiu; o
+/get_video_info e o download escolhem os streams por ela e só então pegam o
+objeto Stream pelo itag.
+"""
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# Resoluções adaptivas oferecidas na interface
+LISTED_RESOLUTIONS = ('1080p', '720p', '480p', '360p')
+
+# URLs que vencem antes disso não valem para um download novo
+EXPIRY_MARGIN = 300
+
+
+def _number(value):
+    """'1080p' → 1080, '128kbps' → 128 (None se não houver número)"""
+    digits = ''.join(c for c in str(value or '') if c.isdigit())
+    return int(digits) if digits else None
+
+
+def _url_expiry(url):
+    try:
+        expire = parse_qs(urlsplit(url).query).get('expire')
+    except ValueError:
+        return None
+    return int(expire[0]) if expire and expire[0].isdigit() else None
+
+
+def _manifest_sizes(yt):
+    """itag → contentLength do manifesto (streamingData), sem HEAD por stream"""
+    try:
+        data = yt.streaming_data or {}
+    except Exception:
+        return {}
+    sizes = {}
+    for fmt in data.get('formats', []) + data.get('adaptiveFormats', []):
+        try:
+            sizes[int(fmt['itag'])] = int(fmt['contentLength'])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return sizes
+
+
+def _row(stream, length, sizes):
+    if stream.is_progressive:
+        kind = 'progressive'
+    elif stream.includes_video_track:
+        kind = 'video'
+    else:
+        kind = 'audio'
+    codec = getattr(stream, 'video_codec', None) if kind != 'audio' else getattr(stream, 'audio_codec', None)
+    bitrate = getattr(stream, 'bitrate', None)
+    size = sizes.get(stream.itag) or None
+    return {
+        'itag': stream.itag,
+        'kind': kind,
+        'resolution': stream.resolution if kind != 'audio' else None,
+        'abr': stream.abr,
+        'codec': codec,
+        'subtype': stream.subtype,
+        'size': size,
+        'size_approx': size or (int(length * bitrate / 8) if length and bitrate else None),
+        'expires': _url_expiry(stream.url)
+    }
+
+
+def build_stream_table(yt, length=None):
+    """Uma passada por `yt.streams`, sem filtros repetidos nem HEAD por tamanho"""
+    if length is None:
+        try:
+            length = yt.length
+        except Exception:
+            length = None
+    sizes = _manifest_sizes(yt)
+    return [_row(stream, length, sizes) for stream in yt.streams]
+
+
+def _sorted(rows, key):
+    return sorted(rows, key=lambda row: _number(row[key]) or 0, reverse=True)
+
+
+def select(table, kind, resolution=None, subtype='mp4'):
+    """Linhas do tipo pedido, da maior resolução (ou abr) para a menor"""
+    rows = [row for row in table if row['kind'] == kind
+            and (subtype is None or row['subtype'] == subtype)
+            and (resolution is None or row['resolution'] == resolution)]
+    if kind == 'audio':
+        return _sorted([row for row in rows if row['abr']], 'abr')
+    return _sorted([row for row in rows if row['resolution']], 'resolution')
+
+
+def first(table, kind, resolution=None, subtype='mp4'):
+    rows = select(table, kind, resolution, subtype)
+    return rows[0] if rows else None
+
+
+def best_audio(table, subtype=None):
+    """Áudio de maior abr (qualquer contêiner, como o filtro only_audio do pytubefix)"""
+    return first(table, 'audio', subtype=subtype)
+
+
+def is_expired(table, margin=EXPIRY_MARGIN):
+    """Alguma URL da tabela vence dentro de `margin` segundos"""
+    expiries = [row['expires'] for row in table if row['expires']]
+    return bool(expiries) and min(expiries) < time.time() + margin
+
+
+def size_label(row):
+    """Tamanho para a interface: exato, aproximado (~) ou N/A"""
+    if row['size']:
+        return f"{row['size'] / (1024*1024):.1f} MB"
+    if row['size_approx']:
+        return f"~{row['size_approx'] / (1024*1024):.1f} MB"
+    return 'N/A'
+
+
+def stream_for(yt, row):
+    """Objeto Stream de uma linha da tabela (busca direta por itag, sem filtro)"""
+    return yt.streams.get_by_itag(row['itag']) if row else None
@@ -7,7 +7,7 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import create_youtube_object
+from youtube_client import create_youtube_object
 import time
 
 def test_youtube_connection():
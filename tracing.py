@@ -0,0 +1,266 @@
+"""Spans de tempo por job (aninhados, com atributos), exportados em JSON lines ou OTLP
+
+Cada span guarda início, duração, atributos e erro; os filhos herdam o
+trace e o download_id do pai. O trace de um job usa o próprio download_id
+como trace_id, então o envio do arquivo (/download_file) cai no mesmo trace.
+
+TRACE_EXPORT:
+  off (padrão): desligado (os spans não custam nada)
+  jsonl: uma linha JSON por span em TRACE_FILE (vazio = stdout, junto com o log)
+  otlp: envia em lotes para um coletor OTLP/HTTP (OTEL_EXPORTER_OTLP_ENDPOINT)
+"""
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.request import Request, urlopen
+
+TRACE_EXPORT = os.environ.get('TRACE_EXPORT', 'off')
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318').rstrip('/') + '/v1/traces'
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'dowload-youtube')
+
+# Lote do exportador OTLP
+OTLP_BATCH_SIZE = 256
+OTLP_FLUSH_INTERVAL = 2.0
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Um trecho cronometrado; termina com end() (ou ao sair do bloco de span())"""
+
+    def __init__(self, name, parent=None, trace_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id or (parent.trace_id if parent else uuid.uuid4().hex)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.download_id = parent.download_id if parent else None
+        self.attributes = {}
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.set(**(attributes or {}))
+
+    def set(self, **attributes):
+        """Adiciona atributos (download_id também vale para os spans filhos)"""
+        if 'download_id' in attributes:
+            self.download_id = attributes.pop('download_id')
+        self.attributes.update(attributes)
+        return self
+
+    def backdate(self, started_at):
+        """Faz o span começar em `started_at` (time.time()), medido antes de ele existir"""
+        elapsed = max(0.0, time.time() - started_at)
+        self.start_time = time.time() - elapsed
+        self._started = time.perf_counter() - elapsed
+        return self
+
+    def fail(self, message):
+        """Marca o span com erro sem exceção (erro já tratado pelo chamador)"""
+        self.error = str(message)[:300]
+        return self
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.fail(f"{type(error).__name__}: {error}")
+        _exporter.export(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'download_id': self.download_id,
+            'start': round(self.start_time, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': 'error' if self.error else 'ok',
+            'error': self.error,
+            'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    trace_id = span_id = parent_id = download_id = None
+
+    def set(self, **attributes):
+        return self
+
+    def backdate(self, started_at):
+        return self
+
+    def fail(self, message):
+        return self
+
+    def end(self, error=None):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def trace_id_for(download_id):
+    """trace_id (32 hex) derivado do download_id (UUID), para ligar tudo do job"""
+    try:
+        return uuid.UUID(download_id).hex
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def current_span():
+    """Span aberto no contexto atual (um span vazio se não houver)"""
+    return _current.get() or _NOOP
+
+
+def start_span(name, parent=None, started_at=None, **attributes):
+    """Abre um span que termina com `.end()` (ex.: envio de arquivo, que acaba depois da view)
+
+    Sem pai, começa um trace novo; com `download_id`, o trace é o do job.
+    `started_at` (time.time()) antecipa o início, para incluir uma espera já passada.
+    """
+    if TRACE_EXPORT == 'off':
+        return _NOOP
+    parent = parent or _current.get()
+    trace_id = None
+    if parent is None and attributes.get('download_id'):
+        trace_id = trace_id_for(attributes['download_id'])
+    opened = Span(name, parent=parent, trace_id=trace_id, attributes=attributes)
+    return opened.backdate(started_at) if started_at else opened
+
+
+@contextmanager
+def span(name, started_at=None, **attributes):
+    """Span filho do atual durante o bloco; exceções marcam o span com erro e seguem"""
+    current = start_span(name, started_at=started_at, **attributes)
+    if current is _NOOP:
+        yield current
+        return
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def record_span(name, started_at, **attributes):
+    """Registra um trecho que já terminou, iniciado em `started_at` (time.time()), como filho do atual
+
+    Usado para esperas medidas de fora, como o tempo do job na fila.
+    """
+    start_span(name, started_at=started_at, **attributes).end()
+
+
+def in_current_trace(func):
+    """Envolve `func` para rodar em outra thread dentro do span atual (executor, Thread)
+
+    Cada chamada roda numa cópia do contexto: duas threads não podem entrar no mesmo.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+class _JsonLinesExporter:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1) if path else None
+
+    def export(self, finished):
+        line = json.dumps(finished.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            (self._file or sys.stdout).write(line + '\n')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class _OtlpExporter:
+    """Envia os spans em lotes (OTLP/HTTP com JSON) numa thread própria; o job nunca espera"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._queue = queue.Queue(maxsize=10000)
+        self._failed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, finished):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + OTLP_FLUSH_INTERVAL
+            while len(batch) < OTLP_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        spans = []
+        for finished in batch:
+            attributes = dict(finished.attributes)
+            if finished.download_id:
+                attributes['download_id'] = finished.download_id
+            otlp_span = {
+                'traceId': finished.trace_id,
+                'spanId': finished.span_id,
+                'name': finished.name,
+                'kind': 1,
+                'startTimeUnixNano': str(int(finished.start_time * 1e9)),
+                'endTimeUnixNano': str(int((finished.start_time + finished.duration) * 1e9)),
+                'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None],
+                'status': {'code': 2, 'message': finished.error} if finished.error else {'code': 1}
+            }
+            if finished.parent_id:
+                otlp_span['parentSpanId'] = finished.parent_id
+            spans.append(otlp_span)
+
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': spans}]
+        }]}
+        request = Request(self.endpoint, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=5) as response:
+                response.read()
+            self._failed = False
+        except Exception as e:
+            # Coletor fora do ar: descarta o lote e avisa uma vez
+            if not self._failed:
+                print(f"✗ Exportação OTLP falhou ({self.endpoint}): {e}")
+            self._failed = True
+
+
+def _create_exporter():
+    if TRACE_EXPORT == 'otlp':
+        print(f"Traces exportados via OTLP para {OTLP_ENDPOINT}")
+        return _OtlpExporter(OTLP_ENDPOINT)
+    return _JsonLinesExporter(TRACE_FILE)
+
+
+_exporter = _create_exporter() if TRACE_EXPORT != 'off' else None
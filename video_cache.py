@@ -0,0 +1,114 @@
+"""Cache em memória de metadados de vídeos do YouTube (LRU + TTL)"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+# Hosts aceitos para URLs do YouTube
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com', 'www.youtube-nocookie.com')
+
+
+def extract_video_id(url):
+    """Extrai o ID canônico do vídeo (watch, youtu.be, shorts, embed, live)"""
+    if not url:
+        return None
+
+    url = url.strip()
+    if VIDEO_ID_RE.match(url):
+        return url
+    if '://' not in url:
+        url = 'https://' + url
+
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+
+    host = (parsed.hostname or '').lower()
+    path_parts = [p for p in parsed.path.split('/') if p]
+
+    candidate = None
+    if host in ('youtu.be', 'www.youtu.be'):
+        candidate = path_parts[0] if path_parts else None
+    elif host in YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        elif len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v', 'e'):
+            candidate = path_parts[1]
+
+    if candidate and VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+class VideoCache:
+    """Cache LRU com expiração (TTL) indexado pelo ID do vídeo"""
+
+    def __init__(self, max_entries=128, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, video_id):
+        """Retorna a entrada do cache ou None se não existir/expirou"""
+        if not video_id:
+            return None
+        with self._lock:
+            item = self._entries.get(video_id)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, entry = item
+            if time.monotonic() >= expires_at:
+                del self._entries[video_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return entry
+
+    def put(self, video_id, entry):
+        """Armazena uma entrada, removendo a menos usada se o cache estiver cheio"""
+        if not video_id:
+            return
+        with self._lock:
+            self._entries[video_id] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, video_id, **fields):
+        """Acrescenta campos a uma entrada existente sem renovar o TTL"""
+        with self._lock:
+            item = self._entries.get(video_id)
+            if item is not None:
+                item[1].update(fields)
+
+    def invalidate(self, video_id):
+        """Remove uma entrada (ex.: URLs assinadas expiradas ou 403)"""
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Instância compartilhada pelo processo
+video_cache = VideoCache(
+    max_entries=int(os.environ.get('VIDEO_CACHE_MAX_ENTRIES', 128)),
+    ttl=int(os.environ.get('VIDEO_CACHE_TTL', 900))
+)
@@ -0,0 +1,427 @@
+"""Criação de objetos YouTube com múltiplas estratégias, placar e cache de metadados"""
+from pytubefix import YouTube, Playlist
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from itertools import islice
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from video_cache import video_cache, extract_video_id
+from strategy_stats import strategy_scoreboard
+from progress import dispatch_progress
+from rate_limiter import metadata_limiter
+from metrics import STRATEGY_ATTEMPT_SECONDS
+from tracing import span, in_current_trace
+from stream_table import build_stream_table, is_expired
+from retry_policy import POLICIES, VIDEO, classify_error, is_video_error, upstream_breaker
+
+# Estratégias de tentativa, na ordem padrão (usada enquanto não há histórico)
+STRATEGIES = [
+    # Cliente ANDROID (mais confiável)
+    ('ANDROID', lambda url: YouTube(url, client='ANDROID')),
+
+    # Cliente IOS
+    ('IOS', lambda url: YouTube(url, client='IOS')),
+
+    # Cliente WEB padrão
+    ('WEB', lambda url: YouTube(url, client='WEB')),
+
+    # Cliente TV_EMBED
+    ('TV_EMBED', lambda url: YouTube(url, client='TV_EMBED')),
+
+    # Cliente WEB_EMBED
+    ('WEB_EMBED', lambda url: YouTube(url, client='WEB_EMBED')),
+
+    # Com use_po_token
+    ('PO_TOKEN', lambda url: YouTube(url, use_po_token=True)),
+
+    # Configuração básica
+    ('DEFAULT', lambda url: YouTube(url)),
+
+    # Cliente ANDROID com bypass
+    ('ANDROID_EMBEDDED', lambda url: YouTube(url, client='ANDROID_EMBEDDED')),
+]
+
+STRATEGY_NAMES = [name for name, _ in STRATEGIES]
+STRATEGY_FACTORIES = dict(STRATEGIES)
+
+# Modo corrida: dispara as N melhores estratégias escalonadas e usa a primeira que responder
+RACE_MODE = os.environ.get('STRATEGY_RACE_MODE', '0') == '1'
+RACE_WIDTH = int(os.environ.get('STRATEGY_RACE_WIDTH', 3))
+RACE_HEDGE_DELAY = float(os.environ.get('STRATEGY_RACE_HEDGE_DELAY', 0.75))
+
+# Limite global de tentativas extras (hedge) simultâneas contra o YouTube
+RACE_MAX_HEDGES = int(os.environ.get('STRATEGY_RACE_MAX_HEDGES', 4))
+
+# Cartão básico do modo rápido (/get_video_info com "fast"): oEmbed, sem estratégias
+OEMBED_URL = os.environ.get('YOUTUBE_OEMBED_URL', 'https://www.youtube.com/oembed')
+OEMBED_TIMEOUT = float(os.environ.get('YOUTUBE_OEMBED_TIMEOUT', 3))
+_hedge_slots = threading.BoundedSemaphore(RACE_MAX_HEDGES)
+
+def _try_strategy(name, url, throttle=True, probe=None):
+    """Executa uma estratégia, valida o resultado e registra no placar
+
+    Cada tentativa consome uma ficha do limite de metadados (`throttle=False`
+    quando o chamador já esperou por ela). `probe` é o token de upstream_breaker.check().
+    """
+    with span('strategy', client=name) as trace:
+        if throttle:
+            trace.set(rate_limit_wait_s=round(metadata_limiter.acquire(), 3))
+        yt = _run_strategy(name, url, probe)
+        trace.set(outcome='success')
+    return yt
+
+def _run_strategy(name, url, probe=None):
+    started = time.monotonic()
+    try:
+        yt = STRATEGY_FACTORIES[name](url)
+
+        # Testa se consegue acessar propriedades básicas
+        _ = yt.title  # Força o carregamento dos dados
+        _ = yt.length
+
+        # Testa se consegue obter streams (importante para evitar 403 no download);
+        # a tabela de streams é montada depois, numa passada só (get_stream_table)
+        if not len(yt.streams):
+            raise Exception("Nenhum stream disponível")
+
+    except Exception as e:
+        elapsed = time.monotonic() - started
+        # Erros do próprio vídeo (VIDEO_ERRORS) não dizem nada sobre a saúde do cliente
+        if not is_video_error(e):
+            strategy_scoreboard.record(name, False, elapsed, error=str(e))
+        STRATEGY_ATTEMPT_SECONDS.observe(elapsed, client=name, outcome=classify_error(e))
+        upstream_breaker.record(e, probe)
+        raise
+
+    elapsed = time.monotonic() - started
+    strategy_scoreboard.record(name, True, elapsed)
+    STRATEGY_ATTEMPT_SECONDS.observe(elapsed, client=name, outcome='success')
+    upstream_breaker.record(probe=probe)
+
+    # Progresso dos downloads é roteado para o job da thread que baixa
+    yt.register_on_progress_callback(dispatch_progress)
+    return yt
+
+def _race_strategies(url, names, probe=None):
+    """Corre as estratégias em paralelo escalonado e retorna a primeira que funcionar
+
+    Uma nova estratégia é disparada quando a anterior falha ou quando passa o
+    atraso de hedge sem resposta (se houver vaga no limite global). As que
+    ainda não começaram são canceladas; as que já estão rodando são descartadas.
+    Só a primeira carrega o token `probe` do disjuntor. Um erro do próprio
+    vídeo encerra a corrida e é relançado.
+    """
+    results = queue.Queue()
+    remaining = list(names)
+    pending = 0
+
+    def run(name, hedged, token):
+        try:
+            results.put((name, _try_strategy(name, url, probe=token), None))
+        except Exception as e:
+            results.put((name, None, e))
+        finally:
+            if hedged:
+                _hedge_slots.release()
+
+    def launch(hedged):
+        nonlocal pending, probe
+        name = remaining.pop(0)
+        print(f"🏁 Disparando estratégia {name}{' (hedge)' if hedged else ''}...")
+        thread = threading.Thread(target=in_current_trace(run), args=(name, hedged, probe))
+        probe = None
+        thread.daemon = True
+        thread.start()
+        pending += 1
+
+    launch(hedged=False)
+    while pending:
+        try:
+            name, yt, error = results.get(timeout=RACE_HEDGE_DELAY if remaining else None)
+        except queue.Empty:
+            # Sem resposta dentro do atraso: dispara mais uma, se o limite permitir
+            if _hedge_slots.acquire(blocking=False):
+                launch(hedged=True)
+            continue
+
+        pending -= 1
+        if yt is not None:
+            print(f"✓ Corrida vencida pela estratégia {name}")
+            return yt
+
+        print(f"✗ Estratégia {name} falhou na corrida: {str(error)[:100]}")
+        if is_video_error(error):
+            raise error
+        if remaining:
+            if not pending:
+                launch(hedged=False)
+            elif _hedge_slots.acquire(blocking=False):
+                launch(hedged=True)
+
+    return None
+
+def create_youtube_object(url, race=None):
+    """Cria objeto YouTube com configurações anti-bot e múltiplas estratégias
+
+    A espera entre estratégias segue POLICIES['strategy'] (maior após 403/429).
+    Erros do próprio vídeo encerram na hora, e com o disjuntor de 403 aberto
+    levanta CircuitOpenError sem tentar nada.
+    """
+    policy = POLICIES['strategy']
+
+    # Ordena as estratégias pelo histórico recente (as bloqueadas ficam de fora)
+    ordered = strategy_scoreboard.order(STRATEGY_NAMES)
+    total = len(ordered)
+    start_index = 0
+    use_race = RACE_MODE if race is None else race
+
+    if use_race:
+        probe = upstream_breaker.check()
+        yt = _race_strategies(url, ordered[:RACE_WIDTH], probe)
+        if yt is not None:
+            return yt
+        # Nenhuma das primeiras respondeu: segue com as restantes em sequência
+        start_index = min(RACE_WIDTH, total)
+
+    # Tenta cada estratégia
+    for i, name in enumerate(ordered[start_index:], start=start_index):
+        probe = upstream_breaker.check()
+        try:
+            print(f"Tentando estratégia {i+1}/{total} ({name})...")
+            yt = _try_strategy(name, url, probe=probe)
+            print(f"✓ Sucesso com estratégia {i+1} ({name})")
+            return yt
+
+        except Exception as e:
+            kind = classify_error(e)
+            print(f"✗ Estratégia {i+1} ({name}) falhou: {str(e)[:100]}")
+
+            # Vídeo privado/removido: as outras estratégias dariam o mesmo erro
+            if kind == VIDEO:
+                raise
+            if not policy.should_retry(i, kind) or i + 1 == total:
+                break
+
+            # Delay para evitar rate limiting (maior após 403/429)
+            wait = policy.delay(i - start_index, kind)
+            print(f"  → {kind}: aguardando {wait:.1f}s antes da próxima estratégia")
+            with span('backoff', kind=kind, wait_s=round(wait, 3)):
+                time.sleep(wait)
+
+    # Se todas as estratégias falharam
+    raise Exception("Todas as estratégias falharam. YouTube pode estar bloqueando o acesso. Tente:\n1. Aguardar alguns minutos\n2. Usar uma VPN\n3. Tentar outro vídeo")
+
+async def _race_strategies_async(url, names, executor, probe=None):
+    """Versão assíncrona de _race_strategies: as estratégias rodam no `executor` e a
+    espera pelo hedge não ocupa thread"""
+    loop = asyncio.get_running_loop()
+    remaining = list(names)
+    running = {}
+
+    def launch(hedged):
+        nonlocal probe
+        name = remaining.pop(0)
+        print(f"🏁 Disparando estratégia {name}{' (hedge)' if hedged else ''}...")
+        future = loop.run_in_executor(executor, in_current_trace(_try_strategy), name, url, True, probe)
+        probe = None
+        if hedged:
+            # A vaga só volta quando a tentativa termina, mesmo se a corrida já acabou
+            future.add_done_callback(lambda _: _hedge_slots.release())
+        running[future] = name
+
+    launch(hedged=False)
+    while running:
+        done, _ = await asyncio.wait(running, timeout=RACE_HEDGE_DELAY if remaining else None,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            if _hedge_slots.acquire(blocking=False):
+                launch(hedged=True)
+            continue
+
+        for future in done:
+            name = running.pop(future)
+            if future.exception() is None:
+                print(f"✓ Corrida vencida pela estratégia {name}")
+                return future.result()
+            error = future.exception()
+            print(f"✗ Estratégia {name} falhou na corrida: {str(error)[:100]}")
+            if is_video_error(error):
+                raise error
+            if remaining:
+                if not running:
+                    launch(hedged=False)
+                elif _hedge_slots.acquire(blocking=False):
+                    launch(hedged=True)
+
+    return None
+
+async def create_youtube_object_async(url, executor, race=None):
+    """Mesma sequência de create_youtube_object para o modo ASGI
+
+    Só as chamadas ao pytubefix ocupam threads (do `executor`, limitado); os
+    intervalos entre estratégias e o backoff após 403 são asyncio.sleep.
+    """
+    loop = asyncio.get_running_loop()
+    policy = POLICIES['strategy']
+    ordered = strategy_scoreboard.order(STRATEGY_NAMES)
+    total = len(ordered)
+    start_index = 0
+    use_race = RACE_MODE if race is None else race
+
+    if use_race:
+        probe = upstream_breaker.check()
+        yt = await _race_strategies_async(url, ordered[:RACE_WIDTH], executor, probe)
+        if yt is not None:
+            return yt
+        start_index = min(RACE_WIDTH, total)
+
+    for i, name in enumerate(ordered[start_index:], start=start_index):
+        probe = upstream_breaker.check()
+        try:
+            print(f"Tentando estratégia {i+1}/{total} ({name})...")
+            # Espera pela ficha fora do executor
+            with span('rate_limit_wait', limiter='metadata'):
+                await metadata_limiter.acquire_async()
+            yt = await loop.run_in_executor(executor, in_current_trace(_try_strategy), name, url, False, probe)
+            print(f"✓ Sucesso com estratégia {i+1} ({name})")
+            return yt
+
+        except Exception as e:
+            kind = classify_error(e)
+            print(f"✗ Estratégia {i+1} ({name}) falhou: {str(e)[:100]}")
+            if kind == VIDEO:
+                raise
+            if not policy.should_retry(i, kind) or i + 1 == total:
+                break
+            wait = policy.delay(i - start_index, kind)
+            print(f"  → {kind}: aguardando {wait:.1f}s antes da próxima estratégia")
+            with span('backoff', kind=kind, wait_s=round(wait, 3)):
+                await asyncio.sleep(wait)
+
+    raise Exception("Todas as estratégias falharam. YouTube pode estar bloqueando o acesso. Tente:\n1. Aguardar alguns minutos\n2. Usar uma VPN\n3. Tentar outro vídeo")
+
+# Resoluções assíncronas em andamento por vídeo: pedidos simultâneos esperam a mesma
+_inflight = {}
+
+async def get_youtube_object_async(url, executor):
+    """Versão assíncrona de get_youtube_object (cache primeiro, uma resolução por vídeo)"""
+    video_id = extract_video_id(url)
+    entry = video_cache.get(video_id)
+    if entry:
+        print(f"✓ Vídeo {video_id} obtido do cache de metadados")
+        return entry['yt']
+
+    key = video_id or url
+    pending = _inflight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    task = asyncio.ensure_future(create_youtube_object_async(url, executor))
+    _inflight[key] = task
+    try:
+        yt = await asyncio.shield(task)
+    finally:
+        _inflight.pop(key, None)
+
+    video_cache.put(video_id, {
+        'yt': yt,
+        'title': yt.title,
+        'length': yt.length
+    })
+    return yt
+
+def get_youtube_object(url):
+    """Retorna o objeto YouTube do cache de metadados ou cria um novo"""
+    video_id = extract_video_id(url)
+    with span('youtube_object', video_id=video_id) as trace:
+        entry = video_cache.get(video_id)
+        trace.set(cached=bool(entry))
+        if entry:
+            print(f"✓ Vídeo {video_id} obtido do cache de metadados")
+            return entry['yt']
+
+        yt = create_youtube_object(url)
+        video_cache.put(video_id, {
+            'yt': yt,
+            'title': yt.title,
+            'length': yt.length
+        })
+        return yt
+
+def get_basic_info(url):
+    """Título, autor e thumbnail pelo oEmbed do YouTube (uma requisição leve), ou None
+
+    Não passa pelas estratégias de cliente nem pelo manifesto de streams;
+    duração, views e descrição ficam para a resposta completa.
+    """
+    video_id = extract_video_id(url)
+    if not video_id:
+        return None
+    with span('oembed', video_id=video_id) as trace:
+        metadata_limiter.acquire()
+        query = urlencode({'url': f"https://www.youtube.com/watch?v={video_id}", 'format': 'json'})
+        try:
+            with urlopen(f"{OEMBED_URL}?{query}", timeout=OEMBED_TIMEOUT) as response:
+                data = json.load(response)
+        except Exception as e:
+            # Privado, removido ou lento: a resposta completa explica o erro
+            print(f"✗ oEmbed indisponível para {video_id}: {str(e)[:100]}")
+            trace.set(outcome='error')
+            return None
+        trace.set(outcome='success')
+    return {
+        'title': data.get('title') or "Título não disponível",
+        'author': data.get('author_name') or "Autor não disponível",
+        'length': None,
+        'thumbnail': data.get('thumbnail_url') or f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        'views': None,
+        'description': ''
+    }
+
+def get_stream_table(yt):
+    """Tabela de streams do objeto (stream_table.py), montada uma vez e guardada junto dele no cache"""
+    entry = video_cache.get(yt.video_id)
+    if entry and entry.get('yt') is yt and 'stream_table' in entry:
+        return entry['stream_table']
+    with span('stream_table', video_id=yt.video_id) as trace:
+        table = build_stream_table(yt)
+        trace.set(streams=len(table))
+    if entry and entry.get('yt') is yt:
+        video_cache.update(yt.video_id, stream_table=table)
+    return table
+
+def get_video_streams(url):
+    """Objeto YouTube e tabela de streams; resolve de novo se as URLs estão para vencer"""
+    yt = get_youtube_object(url)
+    table = get_stream_table(yt)
+    if is_expired(table):
+        print("↻ URLs dos streams perto de expirar, resolvendo o vídeo de novo")
+        yt = refresh_youtube_object(url)
+        table = get_stream_table(yt)
+    return yt, table
+
+def refresh_youtube_object(url):
+    """Descarta o vídeo do cache e resolve novamente (novas URLs assinadas)"""
+    video_cache.invalidate(extract_video_id(url))
+    return get_youtube_object(url)
+
+def resolve_stream(url, itag):
+    """Resolve o vídeo de novo e retorna o stream com o mesmo itag (URL assinada nova)"""
+    stream = refresh_youtube_object(url).streams.get_by_itag(itag)
+    if stream is None:
+        raise Exception(f"Stream itag {itag} não está mais disponível")
+    return stream
+
+def expand_playlist(url, limit):
+    """Título e URLs dos vídeos de uma playlist (no máximo `limit` vídeos)"""
+    metadata_limiter.acquire()
+    playlist = Playlist(url)
+    return playlist.title, list(islice(playlist.url_generator(), limit))
+
+def get_strategy_stats():
+    """Placar das estratégias na ordem em que serão tentadas"""
+    return strategy_scoreboard.snapshot(STRATEGY_NAMES)